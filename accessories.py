@@ -3,7 +3,7 @@ from flask_mail import Mail
 from flask_mail import Message
 from flask_redis import FlaskRedis
 from itsdangerous import URLSafeTimedSerializer
-from flask import current_app, request, url_for
+from flask import current_app, request, url_for, g, has_request_context
 from flask_login import LoginManager, UserMixin
 from queue import Queue
 from flask_pymongo import PyMongo
@@ -16,8 +16,9 @@ from sqlalchemy.exc import OperationalError
 import time
 import json
 import os
+import threading
 import google.generativeai as genai
-from tool.api_keys import get_api_key
+from tool.api_keys import get_api_key, lease_api_key
 # 條件性導入 neo4j 以避免環境相容性問題
 try:
     from neo4j import GraphDatabase
@@ -160,120 +161,181 @@ def remove_json_in_mongo(collection_name, doc_name, save_history=True):
 
 
 
+# 存取權杖有效期
+ACCESS_TOKEN_LIFETIME = timedelta(hours=3)
+# 舊權杖剩餘效期與新權杖相差不到此秒數時直接沿用，不重新簽發
+TOKEN_REFRESH_SKIP_SECONDS = 300
+
+
+def decode_token(token):
+    """
+    解碼 JWT，同一請求內相同權杖只解碼一次（結果存放在 flask.g）
+
+    解碼失敗時拋出 jwt 的例外，與 jwt.decode 相同
+    """
+    cache = None
+    if has_request_context():
+        cache = g.setdefault('_decoded_tokens', {})
+        if token in cache:
+            return cache[token]
+    decoded_token = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
+    if cache is not None:
+        cache[token] = decoded_token
+    return decoded_token
+
+
 def refresh_token(old_token):   
     try:
-        decoded_token = jwt.decode(old_token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-        access_exp_time = datetime.now() + timedelta(hours=3)
+        decoded_token = decode_token(old_token)
+        access_exp = int((datetime.now() + ACCESS_TOKEN_LIFETIME).timestamp())
+        # 剛簽發不久的權杖直接沿用，避免每個回應都重新簽發
+        if decoded_token.get('exp', 0) >= access_exp - TOKEN_REFRESH_SKIP_SECONDS:
+            return old_token
         new_access_token = jwt.encode({
             'user': decoded_token['user'],
-            'exp': int(access_exp_time.timestamp())
+            'exp': access_exp
         }, current_app.config['SECRET_KEY'], algorithm='HS256')
         return new_access_token
     except Exception as e:
         print(f"❌ Token 刷新失敗: {e}")
         return None
     
-def init_gemini(model_name = 'gemini-2.5-flash'):
-    """初始化主要的Gemini API（優先使用新版 SDK）"""
-    try:
-        api_key = get_api_key()  # 使用tool/api_keys.py
-        # 強制優先使用新版 Google GenAI SDK
+# Gemini 客戶端池：每個 API 金鑰一個長期存活的 Client（共用 HTTP 連線），
+# 每個 (金鑰, 模型) 一個 GeminiWrapper，避免每次呼叫重新建立 Client 與 TLS 連線
+_gemini_clients = {}
+_gemini_wrappers = {}
+_gemini_clients_lock = threading.Lock()
+
+
+class GeminiWrapper:
+    """包裝新版 SDK 的 Client，保持舊版 generate_content API 兼容性"""
+    def __init__(self, client, model_name):
+        self.client = client
+        self.model_name = model_name
+        self.sdk_version = "new"
+        print(f"🔍 [DEBUG] GeminiWrapper 初始化完成，模型: {model_name}")
+
+    def generate_content(self, contents, generation_config=None):
+        """兼容舊版 API 的 generate_content 方法，優化圖片處理"""
+        print(f"🔍 [DEBUG] generate_content 被呼叫，contents 類型: {type(contents)}")
+        if generation_config:
+            print(f"🔍 [DEBUG] 包含 generation_config: {generation_config}")
+
+        # 準備請求參數
+        request_params = {
+            'model': self.model_name,
+            'contents': contents if isinstance(contents, list) else [contents]
+        }
+
+        # 新版 SDK 的 generation_config 參數名稱可能不同
+        if generation_config:
+            # 將舊版參數轉換為新版參數
+            config = {}
+            if 'max_output_tokens' in generation_config:
+                config['max_output_tokens'] = generation_config['max_output_tokens']
+            if 'temperature' in generation_config:
+                config['temperature'] = generation_config['temperature']
+            if 'top_p' in generation_config:
+                config['top_p'] = generation_config['top_p']
+            if 'top_k' in generation_config:
+                config['top_k'] = generation_config['top_k']
+
+            if config:
+                request_params['config'] = config
+
+        if isinstance(contents, str):
+            print("🔍 [DEBUG] 處理純文字內容")
+        elif isinstance(contents, list):
+            print(f"🔍 [DEBUG] 處理列表內容，項目數: {len(contents)}")
+
+            # 檢查是否包含圖片
+            has_images = False
+            for i, item in enumerate(contents):
+                item_type = type(item).__name__
+                if 'Part' in item_type:
+                    print(f"🔍 [DEBUG] 項目 {i}: {item_type} (圖片 Part 物件)")
+                    has_images = True
+                else:
+                    print(f"🔍 [DEBUG] 項目 {i}: {item_type} - {str(item)[:50]}...")
+
+            if has_images:
+                print("🔍 [DEBUG] 檢測到圖片內容，使用新版 SDK 圖片處理")
+        else:
+            print(f"🔍 [DEBUG] 處理其他格式內容: {type(contents)}")
+
         try:
-            # 嘗試多種導入方式
-            try:
-                import google.genai as new_genai
-                from google.genai import types
-                print("🔍 [DEBUG] 成功導入新版 Google GenAI SDK (方式1)")
-            except ImportError:
-                from google import genai as new_genai
-                from google.genai import types
-                print("🔍 [DEBUG] 成功導入新版 Google GenAI SDK (方式2)")
-            except ImportError:
-                raise ImportError("無法導入新版 SDK")
-            
+            response = self.client.models.generate_content(**request_params)
+            print(f"🔍 [DEBUG] 新版 SDK 回應類型: {type(response)}")
+            return response
+        except Exception as e:
+            print(f"⚠️ [DEBUG] 新版 SDK 參數失敗，嘗試簡化版本: {e}")
+            # 如果參數有問題，回退到基本版本
+            response = self.client.models.generate_content(
+                model=self.model_name,
+                contents=contents if isinstance(contents, list) else [contents]
+            )
+            print(f"🔍 [DEBUG] 簡化版本回應類型: {type(response)}")
+            return response
+
+
+def _import_new_genai():
+    """導入新版 Google GenAI SDK，失敗時拋出 ImportError"""
+    try:
+        import google.genai as new_genai
+    except ImportError:
+        from google import genai as new_genai
+    return new_genai
+
+
+def get_gemini_client(api_key: str):
+    """獲取指定 API 金鑰的共用 Client（執行緒安全）"""
+    client = _gemini_clients.get(api_key)
+    if client is not None:
+        return client
+    new_genai = _import_new_genai()
+    with _gemini_clients_lock:
+        client = _gemini_clients.get(api_key)
+        if client is None:
             client = new_genai.Client(api_key=api_key)
-            # 創建一個包裝器以保持 API 兼容性
-            class GeminiWrapper:
-                def __init__(self, client, model_name):
-                    self.client = client
-                    self.model_name = model_name
-                    self.sdk_version = "new"
-                    print(f"🔍 [DEBUG] GeminiWrapper 初始化完成，模型: {model_name}")
-                
-                def generate_content(self, contents, generation_config=None):
-                    """兼容舊版 API 的 generate_content 方法，優化圖片處理"""
-                    print(f"🔍 [DEBUG] generate_content 被呼叫，contents 類型: {type(contents)}")
-                    if generation_config:
-                        print(f"🔍 [DEBUG] 包含 generation_config: {generation_config}")
-                    
-                    # 準備請求參數
-                    request_params = {
-                        'model': self.model_name,
-                        'contents': contents if isinstance(contents, list) else [contents]
-                    }
-                    
-                    # 新版 SDK 的 generation_config 參數名稱可能不同
-                    if generation_config:
-                        # 將舊版參數轉換為新版參數
-                        config = {}
-                        if 'max_output_tokens' in generation_config:
-                            config['max_output_tokens'] = generation_config['max_output_tokens']
-                        if 'temperature' in generation_config:
-                            config['temperature'] = generation_config['temperature']
-                        if 'top_p' in generation_config:
-                            config['top_p'] = generation_config['top_p']
-                        if 'top_k' in generation_config:
-                            config['top_k'] = generation_config['top_k']
-                        
-                        if config:
-                            request_params['config'] = config
-                    
-                    if isinstance(contents, str):
-                        print("🔍 [DEBUG] 處理純文字內容")
-                    elif isinstance(contents, list):
-                        print(f"🔍 [DEBUG] 處理列表內容，項目數: {len(contents)}")
-                        
-                        # 檢查是否包含圖片
-                        has_images = False
-                        for i, item in enumerate(contents):
-                            item_type = type(item).__name__
-                            if 'Part' in item_type:
-                                print(f"🔍 [DEBUG] 項目 {i}: {item_type} (圖片 Part 物件)")
-                                has_images = True
-                            else:
-                                print(f"🔍 [DEBUG] 項目 {i}: {item_type} - {str(item)[:50]}...")
-                        
-                        if has_images:
-                            print("🔍 [DEBUG] 檢測到圖片內容，使用新版 SDK 圖片處理")
-                    else:
-                        print(f"🔍 [DEBUG] 處理其他格式內容: {type(contents)}")
-                    
-                    try:
-                        response = self.client.models.generate_content(**request_params)
-                        print(f"🔍 [DEBUG] 新版 SDK 回應類型: {type(response)}")
-                        return response
-                    except Exception as e:
-                        print(f"⚠️ [DEBUG] 新版 SDK 參數失敗，嘗試簡化版本: {e}")
-                        # 如果參數有問題，回退到基本版本
-                        response = self.client.models.generate_content(
-                            model=self.model_name,
-                            contents=contents if isinstance(contents, list) else [contents]
-                        )
-                        print(f"🔍 [DEBUG] 簡化版本回應類型: {type(response)}")
-                        return response
-            
-            wrapper = GeminiWrapper(client, model_name)
-            print("✅ Gemini API 初始化成功 (新版 SDK - 圖片優化)")
+            _gemini_clients[api_key] = client
+            print(f"✅ 建立 Gemini Client (金鑰 {api_key[:8]}...，共 {len(_gemini_clients)} 個)")
+    return client
+
+
+def init_gemini(model_name = 'gemini-2.5-flash', api_key = None):
+    """
+    獲取 Gemini 模型（優先使用新版 SDK）
+
+    參數：
+    - model_name: 模型名稱
+    - api_key: 指定使用的 API 金鑰；None 時由 tool/api_keys.py 挑選
+    同一 (金鑰, 模型) 重複呼叫會取得同一個實例
+    """
+    try:
+        api_key = api_key or get_api_key()  # 使用tool/api_keys.py
+        cache_key = (api_key, model_name)
+        wrapper = _gemini_wrappers.get(cache_key)
+        if wrapper is not None:
             return wrapper
-            
+
+        # 強制優先使用新版 Google GenAI SDK
+        try:
+            client = get_gemini_client(api_key)
         except ImportError as e:
             print(f"⚠️ [DEBUG] 新版 SDK 導入失敗: {e}")
-            # 回退到舊版 SDK
+            # 回退到舊版 SDK（舊版以全域 configure 設定金鑰，無法依金鑰共用實例）
             print("🔍 [DEBUG] 回退到舊版 SDK")
             genai.configure(api_key=api_key)
             model = genai.GenerativeModel(model_name)
             print("✅ Gemini API 初始化成功 (舊版 SDK)")
             return model
+
+        with _gemini_clients_lock:
+            wrapper = _gemini_wrappers.get(cache_key)
+            if wrapper is None:
+                wrapper = GeminiWrapper(client, model_name)
+                _gemini_wrappers[cache_key] = wrapper
+        return wrapper
             
     except Exception as e:
         print(f"❌ Gemini API 初始化失敗: {e}")
@@ -283,6 +345,21 @@ def init_gemini(model_name = 'gemini-2.5-flash'):
         return None
 
 
+def generate_gemini_content(contents, model_name = 'gemini-2.5-flash', generation_config = None):
+    """
+    以租約取得 API 金鑰呼叫 Gemini 並回報結果（429 / 5xx 會讓金鑰進入冷卻）
+
+    參數與 generate_content 相同；模型初始化失敗時拋出 RuntimeError
+    """
+    with lease_api_key() as lease:
+        model = init_gemini(model_name, api_key=lease.key)
+        if model is None:
+            raise RuntimeError('Gemini API 初始化失敗')
+        if generation_config:
+            return model.generate_content(contents, generation_config=generation_config)
+        return model.generate_content(contents)
+
+
 def init_mongo_data():
     try:
         exam_count = mongo.db.exam.count_documents({})
@@ -360,6 +437,10 @@ def init_mongo_data():
                     processed_data.append(item)
            
             result = mongo.db.exam.insert_many(processed_data)
+            from src.exam_facets import invalidate_exam_facets
+            from src.question_pools import invalidate_question_pools
+            invalidate_exam_facets()
+            invalidate_question_pools()
             print(f"包含單題和群組題的完整結構")
             return True    
         else:
@@ -379,19 +460,6 @@ def send_mail(sender, receiver, subject,content):
     created_at = datetime.now(taipei_tz)  
     content = content.replace("\n", "<br>")
     subject = subject.replace("\n", " ")
-    create_mail_info= text("""
-        CREATE TABLE IF NOT EXISTS mail_info (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            sender VARCHAR(255) NOT NULL,
-            receiver VARCHAR(255) NOT NULL,
-            subject VARCHAR(255) NOT NULL,
-            argument TEXT NULL,
-            content TEXT NOT NULL,
-            time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            due_time INT NOT NULL,
-            mail_type INT NOT NULL
-        );
-    """)
     insert_mail = text("""
         INSERT INTO mail_info (sender, receiver, subject, content, time)
         VALUES (:sender, :receiver, :subject, :content, :time)
@@ -400,7 +468,6 @@ def send_mail(sender, receiver, subject,content):
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            sqldb.session.execute(create_mail_info)
             result = sqldb.session.execute(insert_mail, {
                 "sender": sender,
                 "receiver": receiver,
@@ -427,13 +494,9 @@ def send_mail(sender, receiver, subject,content):
         <strong>{subject}</strong>
         {content}
         """
-        msg = Message(
-            subject=f"訊息通知 - {subject}",
-            recipients=[receiver],
-            html=body,
-            sender="misteacher011@gmail.com"
-        )
-        mail.send(msg)
+        # mail_info 資料表於啟動時由 init_mail_tables 建立；實際寄送交給郵件 outbox
+        from src.mail_outbox import enqueue_mail
+        enqueue_mail(receiver, f"訊息通知 - {subject}", html=body, sender="misteacher011@gmail.com")
     return {"mail_id": mail_id}
 
 def send_calendar_notification(student_email: str, event_title: str, event_content: str, event_date: str):
@@ -470,14 +533,9 @@ def send_calendar_notification(student_email: str, event_title: str, event_conte
         </div>
         """
         
-        # 發送郵件
-        msg = Message(
-            subject=subject,
-            recipients=[student_email],
-            html=content,
-            sender="misteacher011@gmail.com"
-        )
-        mail.send(msg)
+        # 發送郵件（寫入 outbox，由郵件 worker 寄送）
+        from src.mail_outbox import enqueue_mail
+        enqueue_mail(student_email, subject, html=content, sender="misteacher011@gmail.com")
         
         print(f"✅ 行事曆通知郵件已發送給 {student_name} ({student_email})")
         return True
@@ -1,4 +1,5 @@
 from flask import Flask, jsonify, request, Blueprint, send_from_directory
+from werkzeug.security import safe_join
 from flask_cors import CORS
 import sys
 from accessories import sqldb, mail, redis_client, token_store, mongo, login_manager, init_mongo_data
@@ -8,18 +9,22 @@ from src.login import login_bp
 from src.register import register_bp
 from src.dashboard import dashboard_bp
 from src.quiz import quiz_bp, init_quiz_tables
+from src.concept_mastery import init_concept_mastery_tables
+from src.mail_outbox import init_mail_tables
+from src.mongo_indexes import ensure_mongo_indexes
 from src.ai_quiz import ai_quiz_bp
 from src.materials_api import materials_bp
 from src.note import note_bp
+from src.static_cache import send_cached_file, send_cached_image, guess_image_mimetype
 import os
 import redis, json ,time
 from datetime import datetime
 from flask_mail import Mail, Message
 from accessories import mail, redis_client, send_calendar_notification
 import threading
-import schedule
-from src.dashboard import init_calendar_tables
+from src.dashboard import init_calendar_tables, claim_due_notifications, schedule_notification
 from neo4j.exceptions import ServiceUnavailable
+from src.scheduler import start_scheduler_thread
 
 
 from src.ai_teacher import ai_teacher_bp
@@ -126,32 +131,21 @@ def serve_static_image(filename):
     """提供靜態圖片文件服務（題目圖片）"""
     try:
         import os
-        import mimetypes
-        from flask import send_from_directory
         
         # 圖片文件位於 backend/src/picture 目錄
         # 使用絕對路徑，確保路徑正確
         base_dir = os.path.dirname(os.path.abspath(__file__))
         image_dir = os.path.join(base_dir, 'src', 'picture')
-        image_path = os.path.join(image_dir, filename)
+        image_path = safe_join(image_dir, filename)
         
         # 確定 MIME 類型
-        mime_type, _ = mimetypes.guess_type(filename)
-        if not mime_type:
-            # 根據副檔名設定預設 MIME 類型
-            ext = os.path.splitext(filename)[1].lower()
-            mime_map = {
-                '.jpg': 'image/jpeg',
-                '.jpeg': 'image/jpeg',
-                '.png': 'image/png',
-                '.gif': 'image/gif',
-                '.webp': 'image/webp',
-                '.svg': 'image/svg+xml'
-            }
-            mime_type = mime_map.get(ext, 'image/jpeg')
+        mime_type = guess_image_mimetype(filename)
         
-        if os.path.exists(image_path):
-            response = send_from_directory(image_dir, filename, mimetype=mime_type)
+        # 經由記憶體快取提供（含 ETag / 304 與快取標頭）
+        # 帶 ?v=<內容版本> 時為 immutable 長期快取；?w=<寬度> 提供伺服器端縮圖
+        width = request.args.get('w', type=int)
+        response = send_cached_image(image_path, mime_type, width=width) if image_path else None
+        if response is not None:
             # 設置 CORS 頭 - 動態允許 ngrok 域名
             origin = request.headers.get('Origin', '')
             if is_allowed_origin(origin):
@@ -175,32 +169,19 @@ def serve_course_image(filename):
     """提供課程圖片文件服務"""
     try:
         import os
-        import mimetypes
-        from flask import send_from_directory, Response
         
         # 課程圖片文件位於 backend/data/courses_picture 目錄
         # 使用絕對路徑，確保路徑正確
         base_dir = os.path.dirname(os.path.abspath(__file__))
         course_image_dir = os.path.join(base_dir, 'data', 'courses_picture')
-        image_path = os.path.join(course_image_dir, filename)
+        image_path = safe_join(course_image_dir, filename)
         
         # 確定 MIME 類型
-        mime_type, _ = mimetypes.guess_type(filename)
-        if not mime_type:
-            # 根據副檔名設定預設 MIME 類型
-            ext = os.path.splitext(filename)[1].lower()
-            mime_map = {
-                '.jpg': 'image/jpeg',
-                '.jpeg': 'image/jpeg',
-                '.png': 'image/png',
-                '.gif': 'image/gif',
-                '.webp': 'image/webp',
-                '.svg': 'image/svg+xml'
-            }
-            mime_type = mime_map.get(ext, 'image/jpeg')
+        mime_type = guess_image_mimetype(filename)
         
-        if os.path.exists(image_path):
-            response = send_from_directory(course_image_dir, filename, mimetype=mime_type)
+        # 經由記憶體快取提供（含 ETag / 304 與快取標頭）
+        response = send_cached_file(image_path, mime_type) if image_path else None
+        if response is not None:
             # 設置 CORS 頭 - 動態允許 ngrok 域名
             origin = request.headers.get('Origin', '')
             if is_allowed_origin(origin):
@@ -215,9 +196,9 @@ def serve_course_image(filename):
             # 如果課程圖片不存在，嘗試從題目圖片目錄查找
             base_dir = os.path.dirname(os.path.abspath(__file__))
             question_image_dir = os.path.join(base_dir, 'src', 'picture')
-            question_image_path = os.path.join(question_image_dir, filename)
-            if os.path.exists(question_image_path):
-                response = send_from_directory(question_image_dir, filename, mimetype=mime_type)
+            question_image_path = safe_join(question_image_dir, filename)
+            response = send_cached_file(question_image_path, mime_type) if question_image_path else None
+            if response is not None:
                 origin = request.headers.get('Origin', '')
                 if is_allowed_origin(origin):
                     response.headers['Access-Control-Allow-Origin'] = origin
@@ -242,29 +223,11 @@ def check_calendar_notifications():
         current_time = datetime.now()
         current_time_str = current_time.strftime('%Y-%m-%d %H:%M')
         
-        # 從 Redis List 獲取所有通知
-        notifications = redis_client.lrange('event_notification', 0, -1)
-        notifications_to_send = []
-        
-        for notification_data in notifications:
-            try:
-                notification = json.loads(notification_data)
-                notify_time_str = notification.get('notify_time')
-                
-                if notify_time_str:
-                    # 檢查是否到了通知時間（允許 5 分鐘誤差）
-                    notify_time = datetime.strptime(notify_time_str, '%Y-%m-%d %H:%M')
-                    time_diff = abs((notify_time - current_time).total_seconds())
-                    
-                    if time_diff <= 300:  # 5 分鐘內
-                        notifications_to_send.append({
-                            'notification_data': notification_data,
-                            'event_id': notification.get('event_id'),
-                            'notification': notification
-                        })
-            except Exception as e:
-                print(f"處理通知時發生錯誤: {e}")
-                continue
+        # 從 Redis 排程原子地取出到期的通知（取出即移除）
+        notifications_to_send = [
+            {'event_id': notification.get('event_id'), 'notification': notification}
+            for notification in claim_due_notifications(current_time)
+        ]
         
         # 發送通知
         for item in notifications_to_send:
@@ -298,11 +261,11 @@ def check_calendar_notifications():
                         )
                     
                     if mail_success or line_success:
-                        # 發送成功後從 Redis List 移除
-                        redis_client.lrem('event_notification', 1, item['notification_data'])
-                        print(f"✅ 通知已發送並從 Redis List 移除: event_id {item['event_id']}")
+                        print(f"✅ 通知已發送: event_id {item['event_id']}")
                     else:
-                        print(f"❌ 通知發送失敗: event_id {item['event_id']}")
+                        # 發送失敗時放回排程，誤差範圍內的下一次檢查會重試
+                        schedule_notification(notification)
+                        print(f"❌ 通知發送失敗，已重新排程: event_id {item['event_id']}")
                             
             except Exception as e:
                 print(f"發送通知時發生錯誤: {e}")
@@ -346,24 +309,26 @@ def send_line_calendar_notification(user_id: str, event_title: str, event_conten
         print(f"❌ 發送 LINE 行事曆通知失敗: {e}")
         return False
 
-def run_scheduler():
-    """運行背景排程器"""
-    schedule.every(1).minutes.do(check_calendar_notifications)
-    while True:
-        schedule.run_pending()
-        time.sleep(60) 
+# 週期性工作：(間隔分鐘, 工作函數)，由 scheduler_worker.py 以 leader 鎖執行
+SCHEDULED_JOBS = [
+    (1, check_calendar_notifications)
+]
 
 # 初始化數據庫表格
 with app.app_context():
     sqldb.create_all()
     init_quiz_tables() 
+    init_concept_mastery_tables()  # 初始化概念掌握度表
     init_calendar_tables()
+    init_mail_tables()  # 初始化郵件記錄與 outbox 表
     init_news_table()  # 初始化新聞表
     migrate_news_data()  # 自動遷移 ithome_news.json 到資料庫（若尚未導入）
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
+    # 排程器預設由獨立的 scheduler_worker.py 執行；單一行程部署可設定 RUN_SCHEDULER_IN_WEB=true
+    if app.config.get('RUN_SCHEDULER_IN_WEB', False):
+        start_scheduler_thread(app, SCHEDULED_JOBS)
     # 初始化MongoDB數據
     init_mongo_data()
+    ensure_mongo_indexes()  # 建立熱門查詢所需的 MongoDB 索引
     initialize_mis_teach_db()
     rename_materials()
     # 自動檢查並插入測試學校資料
@@ -381,5 +346,12 @@ with app.app_context():
         print(f"⚠ 警告: Neo4j 初始化時發生錯誤，跳過知識圖譜初始化")
         print(f"  詳細資訊: {str(e)}")
 
+    # 背景預先開啟向量資料庫與載入嵌入模型，避免第一個 RAG 請求承擔載入時間
+    try:
+        from src.rag_sys.vector_store import warm_up_vector_store
+        threading.Thread(target=warm_up_vector_store, daemon=True, name="vector-store-warmup").start()
+    except Exception as e:
+        print(f"⚠ 警告: 向量資料庫預熱失敗: {str(e)}")
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,14 @@
+"""
+批改 worker 啟動入口
+
+與 Web 服務分開執行，從 Redis 批改佇列取出測驗作答進行 AI 批改：
+    python grading_worker.py              # 開發環境設定
+    python grading_worker.py production   # 正式環境設定
+
+併發數由 GRADING_WORKER_CONCURRENCY 環境變數設定（預設 4）。
+"""
+from app import app
+from src.grading_queue import run_grading_workers
+
+if __name__ == '__main__':
+    run_grading_workers(app, app.config.get('GRADING_WORKER_CONCURRENCY', 4))
@@ -0,0 +1,15 @@
+"""
+LINE 事件 worker 啟動入口
+
+與 Web 服務分開執行，從 Redis 佇列逐一取出 LINE Webhook 事件並分派給註冊的事件處理函數：
+    python line_worker.py
+
+需同時設定 LINE_ASYNC_WEBHOOK=true，Webhook 才會將事件寫入佇列。
+併發數由 LINE_WORKER_CONCURRENCY 環境變數設定（預設 4）。
+"""
+from app import app
+from src.linebot import dispatch_line_event
+from src.line_event_queue import run_line_event_workers
+
+if __name__ == '__main__':
+    run_line_event_workers(app, dispatch_line_event, app.config.get('LINE_WORKER_CONCURRENCY', 4))
@@ -0,0 +1,13 @@
+"""
+郵件寄送 worker 啟動入口
+
+與 Web 服務分開執行，從 mail_outbox 資料表分批取出郵件並以共用 SMTP 連線寄送：
+    MAIL_USE_OUTBOX=true python mail_worker.py
+
+可同時啟動多個實例，資料列以 FOR UPDATE SKIP LOCKED 認領，不會重複寄送。
+"""
+from app import app
+from src.mail_outbox import run_mail_worker
+
+if __name__ == '__main__':
+    run_mail_worker(app, poll_seconds=app.config.get('MAIL_WORKER_POLL_SECONDS', 2))
@@ -0,0 +1,17 @@
+"""
+背景排程 worker 啟動入口
+
+與 Web 服務分開執行週期性工作（行事曆通知等）：
+    python scheduler_worker.py
+
+可同時啟動多個實例作為備援，透過 Redis leader 鎖保證同一時間只有一個實例執行工作。
+"""
+from app import app, SCHEDULED_JOBS
+from src.scheduler import run_scheduler
+
+if __name__ == '__main__':
+    print("🚀 背景排程 worker 已啟動")
+    try:
+        run_scheduler(app, SCHEDULED_JOBS)
+    except KeyboardInterrupt:
+        print("🛑 收到中斷訊號，排程 worker 結束")
@@ -11,13 +11,23 @@ from src.api import get_user_info, verify_token
 import jwt
 from datetime import datetime
 import random
-import base64
 import os
 import json
 from sqlalchemy import text
 from bson import ObjectId
 from src.grade_answer import batch_grade_ai_questions
+from src.grading_progress import (
+    update_progress_status, get_progress_status, publish_question_graded,
+    stream_progress_events, new_progress_id, TOTAL_STAGES
+)
 from src.ai_teacher import get_quiz_from_database
+from src.concept_mastery import record_quiz_attempts
+from src.grading_queue import enqueue_grading_job, is_async_grading_requested, register_job_handler
+from src.question_images import get_question_image_src
+from src.quiz_persistence import upsert_quiz_history, save_graded_answers
+from src.exam_catalogue import exam_catalogue_response
+from src.question_pools import draw_knowledge_questions, draw_question_ids, pool_values, QuestionPoolUnavailable
+from src.question_loader import load_questions_by_ids, QUIZ_QUESTION_PROJECTION
 import time
 import hashlib
 import json
@@ -34,7 +44,7 @@ logger = logging.getLogger(__name__)
 
 @ai_quiz_bp.route('/submit-quiz', methods=['POST', 'OPTIONS'])
 def submit_quiz():
-    """提交測驗 API - 全AI評分版本"""
+    """提交測驗 API - 全AI評分版本（支援非同步批改）"""
     if request.method == 'OPTIONS':
         return jsonify({'token': None, 'message': 'CORS preflight'}), 200
     
@@ -47,13 +57,58 @@ def submit_quiz():
     # 獲取請求數據
     data = request.get_json()
     template_id = data.get('template_id')
-    answers = data.get('answers', {})
-    time_taken = data.get('time_taken', 0)
-    question_answer_times = data.get('question_answer_times', {})  # 新增：提取每題作答時間
-    frontend_questions = data.get('questions', [])  # 新增：提取前端發送的題目數據
     if not template_id:
         return jsonify({'success': False, 'message': '缺少考卷模板ID'}), 400
-    progress_id = f"progress_{user_email}_{int(time.time())}"
+    progress_id = new_progress_id(user_email, data.get('progress_id'))
+    submission = {
+        'template_id': template_id,
+        'answers': data.get('answers', {}),
+        'time_taken': data.get('time_taken', 0),
+        'question_answer_times': data.get('question_answer_times', {}),  # 每題作答時間
+        'questions': data.get('questions', [])  # 前端發送的題目數據
+    }
+    
+    # 非同步模式：寫入批改佇列後立即返回，前端以 progress_id 訂閱 SSE 或查詢 job 狀態
+    if is_async_grading_requested(data):
+        job_id = enqueue_grading_job('ai_quiz', user_email, submission, progress_id)
+        if job_id:
+            return jsonify({
+                'token': refresh_token(token),
+                'success': True,
+                'message': '測驗已提交，正在批改中',
+                'data': {
+                    'job_id': job_id,
+                    'progress_id': progress_id,
+                    'template_id': template_id,
+                    'status': 'queued'
+                }
+            }), 202
+        print("⚠️ 批改佇列不可用，改為同步批改")
+    
+    result = grade_ai_quiz_submission(user_email, submission, progress_id)
+    if not result.get('success'):
+        return jsonify({'success': False, 'message': result.get('message', '測驗批改失敗')}), result.get('status_code', 500)
+    
+    return jsonify({
+        'token': refresh_token(token),
+        'success': True,
+        'message': '測驗提交成功',
+        'data': result['data']
+    })
+
+
+def grade_ai_quiz_submission(user_email, submission, progress_id):
+    """
+    批改一份測驗作答（AI 模板或數字模板）並寫入 quiz_history / quiz_answers / quiz_errors
+    
+    由 /submit-quiz 同步呼叫，或由批改 worker 從佇列取出後呼叫。
+    返回 {'success': True, 'data': {...}}，失敗時返回 {'success': False, 'message': ..., 'status_code': ...}
+    """
+    template_id = submission.get('template_id')
+    answers = submission.get('answers', {})
+    time_taken = submission.get('time_taken', 0)
+    question_answer_times = submission.get('question_answer_times', {})
+    frontend_questions = submission.get('questions', [])
     # 階段1: 試卷批改 - 獲取題目數據
     # 更新進度狀態為第1階段
     update_progress_status(progress_id, False, 1, "正在獲取題目數據...")
@@ -71,10 +126,7 @@ def submit_quiz():
                 total_questions = len(frontend_questions)
                 quiz_type = 'knowledge'  # 使用現有的類型，避免資料庫錯誤
             else:
-                return jsonify({
-                    'success': False,
-                    'message': 'AI模板需要前端題目數據'
-                }), 400
+                return {'success': False, 'message': 'AI模板需要前端題目數據', 'status_code': 400}
         else:
             # 傳統數字ID模板
             try:
@@ -84,20 +136,14 @@ def submit_quiz():
                 """), {'template_id': template_id_int}).fetchone()
                 
                 if not template:
-                    return jsonify({
-                        'success': False,
-                        'message': '考卷模板不存在'
-                    }), 404
+                    return {'success': False, 'message': '考卷模板不存在', 'status_code': 404}
                 
                 # 從模板獲取題目ID列表
                 question_ids = json.loads(template.question_ids)
                 total_questions = len(question_ids)
                 quiz_type = 'knowledge'  # 強制使用knowledge類型，避免資料庫錯誤
             except (ValueError, TypeError):
-                return jsonify({
-                    'success': False,
-                    'message': '無效的模板ID格式'
-                }), 400
+                return {'success': False, 'message': '無效的模板ID格式', 'status_code': 400}
         
         # 從模板獲取題目數量
         
@@ -107,13 +153,9 @@ def submit_quiz():
         else:
             # 從MongoDB exam集合獲取題目詳情
             questions = []
-            for i, question_id in enumerate(question_ids):
-                # 嘗試使用ObjectId查詢
-                exam_question = mongo.db.exam.find_one({"_id": ObjectId(question_id)})
-                if not exam_question:
-                    # 如果ObjectId查詢失敗，嘗試直接查詢
-                    exam_question = mongo.db.exam.find_one({"_id": question_id})
-                
+            # 單次 $in 查詢取回所有題目（保持原始順序）
+            exam_questions = load_questions_by_ids(question_ids, QUIZ_QUESTION_PROJECTION)
+            for i, (question_id, exam_question) in enumerate(zip(question_ids, exam_questions)):
                 if exam_question:
                     # 正確讀取題目類型
                     exam_type = exam_question.get('type', 'single')
@@ -229,7 +271,10 @@ def submit_quiz():
             })
         
         # 使用AI批改模組進行批量評分
-        ai_results = batch_grade_ai_questions(ai_questions_data)
+        ai_results = batch_grade_ai_questions(
+            ai_questions_data,
+            progress_callback=lambda done, total, qid: publish_question_graded(progress_id, done, total, qid)
+        )
         
         # 處理AI評分結果
         for i, result in enumerate(ai_results):
@@ -294,170 +339,34 @@ def submit_quiz():
         else:
             quiz_template_id = template_id_int  # 傳統模板使用數字ID
         
-        # 查找現有的quiz_history記錄
-        existing_record = conn.execute(text("""
-            SELECT id FROM quiz_history 
-            WHERE user_email = :user_email AND quiz_type = :quiz_type
-            ORDER BY created_at DESC LIMIT 1
-        """), {
-            'user_email': user_email,
-            'quiz_type': quiz_type
-        }).fetchone()
-        
-        if existing_record:
-            # 更新現有記錄
-            quiz_history_id = existing_record[0]
-            conn.execute(text("""
-                UPDATE quiz_history 
-                SET answered_questions = :answered_questions,
-                    correct_count = :correct_count,
-                    wrong_count = :wrong_count,
-                    accuracy_rate = :accuracy_rate,
-                    average_score = :average_score,
-                    total_time_taken = :time_taken,
-                    submit_time = :submit_time,
-                    status = 'completed'
-                WHERE id = :quiz_history_id
-            """), {
-                'answered_questions': answered_count,
-                'correct_count': correct_count,
-                'wrong_count': wrong_count,
-                'accuracy_rate': round(accuracy_rate, 2),
-                'average_score': round(average_score, 2),
-                'time_taken': time_taken,
-                'submit_time': datetime.now(),
-                'quiz_history_id': quiz_history_id
-            })
-        else:
-            # 創建新記錄
-            # 對於AI生成的考卷，quiz_template_id設為NULL（資料庫允許NULL）
-            # 對於傳統考卷，使用整數template_id
-            db_quiz_template_id = None if quiz_template_id is None else quiz_template_id
-            
-            result = conn.execute(text("""
-                INSERT INTO quiz_history 
-                (quiz_template_id, user_email, quiz_type, total_questions, answered_questions,
-                 correct_count, wrong_count, accuracy_rate, average_score, total_time_taken, submit_time, status)
-                VALUES (:quiz_template_id, :user_email, :quiz_type, :total_questions, :answered_questions,
-                       :correct_count, :wrong_count, :accuracy_rate, :average_score, :total_time_taken, :submit_time, :status)
-            """), {
-                'quiz_template_id': db_quiz_template_id,
-                'user_email': user_email,
-                'quiz_type': quiz_type,
-                'total_questions': total_questions,
-                'answered_questions': answered_count,
-                'correct_count': correct_count,
-                'wrong_count': wrong_count,
-                'accuracy_rate': round(accuracy_rate, 2),
-                'average_score': round(average_score, 2),
-                'total_time_taken': time_taken,
-                'submit_time': datetime.now(),
-                'status': 'completed'
-            })
-            quiz_history_id = result.lastrowid
-        
-        # 儲存所有題目的用戶答案到 quiz_answers 表
-        # 1. 儲存已作答題目（AI評分結果）
-        for i, q_data in enumerate(answered_questions):
-            question = q_data['question']
-            user_answer = q_data['user_answer']
-            question_id = question.get('original_exam_id', '')
-            
-            # 獲取AI評分結果
-            ai_result = q_data.get('ai_result', {})
-            is_correct = ai_result.get('is_correct', False)
-            score = ai_result.get('score', 0)
-            feedback = ai_result.get('feedback', {})
-            
-            # 獲取作答時間（秒數）
-            answer_time_seconds = q_data.get('answer_time_seconds', 0)
-            
-            # 調試日誌
-            
-            # 構建用戶答案資料
-            answer_data = {
-                'answer': user_answer,
-                'feedback': feedback  # 使用AI批改的feedback
-            }
-            
-            # 使用新的長答案存儲方法，保持數據完整性
-            stored_answer = _store_long_answer(user_answer, 'unknown', quiz_history_id, question_id, user_email)
-            
-            # 插入到 quiz_answers 表，包含feedback和作答時間
-            conn.execute(text("""
-                INSERT INTO quiz_answers 
-                (quiz_history_id, user_email, mongodb_question_id, user_answer, is_correct, score, feedback, answer_time_seconds)
-                VALUES (:quiz_history_id, :user_email, :mongodb_question_id, :user_answer, :is_correct, :score, :feedback, :answer_time_seconds)
-            """), {
-                'quiz_history_id': quiz_history_id,
-                'user_email': user_email,
-                'mongodb_question_id': question_id,
-                'user_answer': stored_answer,  # 使用存儲後的答案引用
-                'is_correct': is_correct,
-                'score': score,
-                'feedback': json.dumps(feedback),  # 將feedback轉換為JSON字符串
-                'answer_time_seconds': answer_time_seconds  # 每題作答時間（秒）
-            })
-        
-        # 2. 儲存未作答題目
-        for q_data in unanswered_questions:
-            i = q_data['index']
-            question = q_data['question']
-            question_id = question.get('original_exam_id', '')
-            
-            # 未作答題目：is_correct = False, score = 0
-            answer_data = {
-                'answer': '',
-                'feedback': {}
-            }
-            
-            # 插入到 quiz_answers 表
-            conn.execute(text("""
-                INSERT INTO quiz_answers 
-                (quiz_history_id, user_email, mongodb_question_id, user_answer, is_correct, score, answer_time_seconds)
-                VALUES (:quiz_history_id, :user_email, :mongodb_question_id, :user_answer, :is_correct, :score, :answer_time_seconds)
-            """), {
-                'quiz_history_id': quiz_history_id,
-                'user_email': user_email,
-                'mongodb_question_id': question_id,
-                'user_answer': '',  # 未作答題目答案為空
-                'is_correct': False,  # 未作答題目標記為錯誤
-                'score': 0,
-                'answer_time_seconds': 0
-            })
-        
-        # 保留原有的錯題儲存邏輯（向後兼容）
-        if wrong_questions:
-            for wrong_q in wrong_questions:
-                # 使用新的長答案存儲方法，保持數據完整性
-                stored_answer = _store_long_answer(wrong_q['user_answer'], 'unknown', quiz_history_id, 
-                                                wrong_q.get('original_exam_id', ''), user_email)
-                
-                conn.execute(text("""
-                    INSERT INTO quiz_errors 
-                    (quiz_history_id, user_email, mongodb_question_id, user_answer,
-                     score, time_taken)
-                    VALUES (:quiz_history_id, :user_email, :mongodb_question_id,
-                           :user_answer, :score, :time_taken)
-                """), {
-                    'quiz_history_id': quiz_history_id,
-                    'user_email': user_email,
-                    'mongodb_question_id': wrong_q.get('original_exam_id', ''),
-                    'user_answer': stored_answer,  # 使用存儲後的答案引用
-                    'score': wrong_q.get('score', 0),
-                    'time_taken': 0  # 簡化時間處理
-                })
-        
+        # quiz_history、所有作答與錯題在同一個交易中批次寫入
+        quiz_history_id = upsert_quiz_history(
+            conn, user_email, quiz_type, quiz_template_id, total_questions,
+            answered_count, correct_count, wrong_count, accuracy_rate, average_score, time_taken
+        )
+        save_graded_answers(conn, quiz_history_id, user_email, answered_questions,
+                            unanswered_questions, wrong_questions,
+                            serialize_answer=lambda question, answer: str(answer))
         conn.commit()
     
+    # 增量更新學生概念掌握度（學習分析頁直接讀取）
+    record_quiz_attempts(user_email, [
+        {
+            'question_id': q_data['question'].get('original_exam_id', ''),
+            'is_correct': q_data.get('ai_result', {}).get('is_correct', False),
+            'time_spent': q_data.get('answer_time_seconds', 0)
+        }
+        for q_data in answered_questions
+    ] + [
+        {'question_id': q_data['question'].get('original_exam_id', ''), 'is_correct': False, 'time_spent': 0}
+        for q_data in unanswered_questions
+    ])
 
     # 更新進度追蹤狀態為完成
     update_progress_status(progress_id, True, 4, "AI批改完成！")
     
-    return jsonify({
-        'token': refresh_token(token),
+    return {
         'success': True,
-        'message': '測驗提交成功',
         'data': {
             'template_id': template_id,  # 返回模板ID
             'quiz_history_id': f'quiz_history_{template_id}',  # 返回測驗歷史記錄ID（使用模板ID）
@@ -492,36 +401,14 @@ def submit_quiz():
                 for q_data in answered_questions
             ]
         }
-    })
-
+    }
 
-# 舊的答案截斷方法已移除，現在使用長答案存儲方法保持數據完整性
 
+register_job_handler('ai_quiz', grade_ai_quiz_submission)
 
-# 進度追蹤存儲（簡單的內存存儲，生產環境建議使用 Redis）
-progress_storage = {}
 
-def update_progress_status(progress_id: str, is_completed: bool, current_stage: int, description: str):
-    """更新進度追蹤狀態"""
-    progress_storage[progress_id] = {
-        'is_completed': is_completed,
-        'current_stage': current_stage,
-        'stage_description': description,
-        'updated_at': time.time()
-    }
+# 舊的答案截斷方法已移除，現在使用長答案存儲方法保持數據完整性
 
-def get_progress_status(progress_id: str) -> dict:
-    """獲取進度追蹤狀態"""
-    try:
-        # 從進度追蹤存儲中獲取狀態
-        return progress_storage.get(progress_id, {
-            'current_stage': 1,  # 默認從第一階段開始
-            'is_completed': False,
-            'stage_description': '正在初始化...'
-        })
-    except Exception as e:
-        print(f"❌ 獲取進度狀態失敗: {e}")
-        return None
 
 def _parse_user_answer(user_answer):
     """解析用戶答案，支援多種格式，包括 LONG_ANSWER_ 引用"""
@@ -557,94 +444,6 @@ def _parse_user_answer(user_answer):
                 return user_answer
     return user_answer
 
-def _store_long_answer(user_answer: any, question_type: str, quiz_history_id: int, question_id: str, user_email: str) -> str:
-    """
-    存儲長答案到專門的表中，保持數據完整性
-    
-    參數：
-    - user_answer: 原始用戶答案
-    - question_type: 題目類型
-    - quiz_history_id: 測驗歷史ID
-    - question_id: 題目ID
-    - user_email: 用戶郵箱
-    
-    返回：
-    - 存儲引用ID或標識符
-    """
-    try:
-        answer_str = str(user_answer)
-        
-        # 如果答案不長，直接返回
-        if len(answer_str) <= 10000:
-            return answer_str
-        
-        # 啟用 SQL 操作，存儲長答案到專門的表中
-        # 對於長答案，存儲到專門的表中
-        with sqldb.engine.connect() as conn:
-            # 創建長答案存儲表（如果不存在）
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS long_answers (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    quiz_history_id INT NOT NULL,
-                    question_id VARCHAR(255) NOT NULL,
-                    user_email VARCHAR(255) NOT NULL,
-                    question_type VARCHAR(50) NOT NULL,
-                    full_answer LONGTEXT NOT NULL,
-                    answer_hash VARCHAR(64) NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    INDEX idx_quiz_question (quiz_history_id, question_id),
-                    INDEX idx_user (user_email)
-                )
-            """))
-            
-            # 計算答案的哈希值作為唯一標識
-            answer_hash = hashlib.md5(answer_str.encode()).hexdigest()
-            
-            # 檢查是否已經存儲過相同的答案
-            existing = conn.execute(text("""
-                SELECT id FROM long_answers 
-                WHERE quiz_history_id = :quiz_history_id AND question_id = :question_id
-            """), {
-                'quiz_history_id': quiz_history_id,
-                'question_id': question_id
-            }).fetchone()
-            
-            if existing:
-                # 如果已存在，返回引用標識
-                return f"LONG_ANSWER_{existing[0]}"
-            else:
-                # 存儲新的長答案
-                result = conn.execute(text("""
-                    INSERT INTO long_answers 
-                    (quiz_history_id, question_id, user_email, question_type, full_answer, answer_hash)
-                    VALUES (:quiz_history_id, :question_id, :user_email, :question_type, :full_answer, :answer_hash)
-                """), {
-                    'quiz_history_id': quiz_history_id,
-                    'question_id': question_id,
-                    'user_email': user_email,
-                    'question_type': question_type,
-                    'full_answer': answer_str,
-                    'answer_hash': answer_hash
-                })
-                
-                long_answer_id = conn.execute(text("SELECT LAST_INSERT_ID()")).scalar()
-                conn.commit()
-                return f"LONG_ANSWER_{long_answer_id}"
-                
-    except Exception as e:
-        print(f"❌ 存儲長答案失敗: {e}")
-        # 如果存儲失敗，返回截斷的答案（但保持數據完整性）
-        answer_str = str(user_answer)
-        if len(answer_str) > 10000:
-            # 返回截斷的答案，但添加錯誤標記
-            truncated_answer = answer_str[:9000] + "...[存儲失敗，答案已截斷]"
-            print(f"⚠️ 長答案存儲失敗，使用截斷方式: {len(answer_str)} -> {len(truncated_answer)} 字符")
-            return truncated_answer
-        else:
-            # 如果答案不長，直接返回
-            return answer_str
-
-
 @ai_quiz_bp.route('/get-drawing-answer/<quiz_history_id>/<question_id>', methods=['GET', 'OPTIONS'])
 def get_drawing_answer(quiz_history_id, question_id):
     """根據測驗歷史ID和題目ID獲取繪圖答案"""
@@ -821,17 +620,18 @@ def get_quiz_result(result_id):
         all_questions = []
         errors = []
         
-        for i, question_id in enumerate(question_ids):
+        # 單次 $in 查詢取回所有題目（保持原始順序）
+        try:
+            exam_questions = load_questions_by_ids(question_ids, QUIZ_QUESTION_PROJECTION)
+        except Exception as e:
+            print(f"⚠️ 批次獲取題目詳情失敗: {e}")
+            exam_questions = [None] * len(question_ids)
+        
+        for i, (question_id, exam_question) in enumerate(zip(question_ids, exam_questions)):
 
             # 從MongoDB獲取題目詳情
             question_detail = {}
             try:
-                # 安全地處理 ObjectId 查詢
-                if isinstance(question_id, str) and len(question_id) == 24:
-                    exam_question = mongo.db.exam.find_one({"_id": ObjectId(question_id)})
-                else:
-                    exam_question = mongo.db.exam.find_one({"_id": question_id})
-                
                 if exam_question:
                     question_detail = {
                         'type': exam_question.get('answer_type', 'single-choice'),  # 添加題目類型
@@ -962,15 +762,19 @@ def create_quiz():
             if not topic:
                 return jsonify({'message': '缺少知識點參數'}), 400
             
-            # 從MongoDB獲取符合條件的考題
-            # 使用正確的欄位名稱：key-points
-            query = {"key-points": topic}
-            available_exams = list(mongo.db.exam.find(query).limit(count * 2))
-            
-            if len(available_exams) < count:
-                available_exams = list(mongo.db.exam.find({}).limit(count))
-            
-            selected_exams = random.sample(available_exams, min(count, len(available_exams)))
+            try:
+                # 從題目池隨機抽題後一次取回題目
+                selected_exams = draw_knowledge_questions(topic, count, difficulty)
+            except QuestionPoolUnavailable as e:
+                print(f"⚠️ 題目池無法使用，改用 MongoDB 查詢: {e}")
+                # 使用正確的欄位名稱：key-points
+                query = {"key-points": topic}
+                available_exams = list(mongo.db.exam.find(query).limit(count * 2))
+                
+                if len(available_exams) < count:
+                    available_exams = list(mongo.db.exam.find({}).limit(count))
+                
+                selected_exams = random.sample(available_exams, min(count, len(available_exams)))
             quiz_title = f"{topic} - {difficulty} - {count}題"
             
             # 知識點測驗的學校、科系、年份
@@ -1218,34 +1022,11 @@ def create_quiz():
         print(f"❌ 創建測驗時發生錯誤: {str(e)}")
         return jsonify({'message': f'創建測驗失敗: {str(e)}'}), 500
 
-def get_image_base64(image_filename):
-    """讀取圖片檔案並轉換為 base64 編碼"""
-    try:
-        # 檢查檔案名稱是否為空
-        if not image_filename or not image_filename.strip():
-            return None
-        
-        # 取得當前檔案所在目錄，圖片在同層的 picture 資料夾
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        image_path = os.path.join(current_dir, 'picture', image_filename)
-        
-        if os.path.exists(image_path):
-            with open(image_path, 'rb') as image_file:
-                image_data = image_file.read()
-                base64_encoded = base64.b64encode(image_data).decode('utf-8')
-                return base64_encoded
-        else:
-            # print(f"圖片檔案不存在: {image_path}")
-            return None
-    except Exception as e:
-        print(f"讀取圖片時發生錯誤: {str(e)}")
-        return None
-
 # 删除 /get-quiz API - 前端不再使用，功能已被 create-quiz 替代
 
 @ai_quiz_bp.route('/get-exam', methods=['POST', 'OPTIONS'])
 def get_exam():
-    """獲取所有考題數據"""
+    """獲取考題目錄（游標分頁 / 篩選 / 欄位投影 / 串流）"""
     if request.method == 'OPTIONS':
         return '', 204
     auth_header = request.headers.get('Authorization')
@@ -1268,40 +1049,14 @@ def get_exam():
         print(f"驗證token時發生錯誤: {str(e)}")
         return jsonify({'message': '認證失敗', 'code': 'AUTH_FAILED'}), 401
     
-    examdata = mongo.db.exam.find()
-    exam_list = []
-    for exam in examdata:
-        exam_dict = {
-             'type': exam.get('type'),
-                    'school': exam.get('school'),
-                    'department': exam.get('department'),
-                    'year': exam.get('year'),
-                    'question_number': exam.get('question_number'),
-                    'question_text': exam.get('question_text'),
-                    'options': exam.get('options'),
-                    'answer': exam.get('answer'),
-                    'answer_type': exam.get('answer_type'),
-                    'image_file': exam.get('image_file'),
-                    'detail-answer': exam.get('detail-answer'),
-                    'key_points': exam.get('key-points'),
-                    'difficulty level': exam.get('difficulty level'),
-        }
-        
-        # 處理圖片檔案
-        if exam_dict['image_file']:
-            image_data_list = []
-            for image_filename in exam_dict['image_file']:
-                image_base64 = get_image_base64(image_filename)
-                if image_base64:
-                    image_data_list.append({
-                        'filename': image_filename,
-                        'data': image_base64
-                    })
-            exam_dict['images'] = image_data_list
-        
-        exam_list.append(exam_dict)
- 
-    return jsonify({'exams': exam_list}), 200
+    # 支援游標分頁、篩選、欄位投影與 NDJSON 串流；未帶分頁參數時維持原本格式（串流輸出）
+    params = request.get_json(silent=True) or {}
+    return exam_catalogue_response(params, token=None, key_points_as_text=False)
+
+
+# 全題型測驗不抽取的測試資料
+MIXED_QUIZ_EXCLUDED_SCHOOL = '測試學校(全題型)'
+
 
 @ai_quiz_bp.route('/create-mixed-quiz', methods=['POST', 'OPTIONS'])
 def create_mixed_quiz():
@@ -1330,32 +1085,46 @@ def create_mixed_quiz():
         return jsonify({'message': '認證失敗', 'code': 'AUTH_FAILED'}), 401
     
     try:
-        # 獲取所有不同的 answer_type（排除測試學校資料）
-        answer_types = mongo.db.exam.distinct('answer_type', {
-            'school': {'$ne': '測試學校(全題型)'}
-        })
-        print(f"🔍 找到的 answer_type: {answer_types}")
-        
         selected_questions = []
-        
-        # 為每個 answer_type 選擇 2 題（只從非測試學校的資料中選擇）
-        for answer_type in answer_types:
-            if answer_type:  # 確保 answer_type 不為空
-                # 從該 answer_type 中隨機選擇 2 題，排除測試學校
-                questions = list(mongo.db.exam.find({
-                    'answer_type': answer_type,
-                    'school': {'$ne': '測試學校(全題型)'}
-                }).limit(20))  # 增加限制數量以獲得更多選擇
-                
-                if len(questions) >= 2:
-                    selected = random.sample(questions, 2)
-                elif len(questions) == 1:
-                    selected = questions
-                else:
+        try:
+            # 從題目池為每個 answer_type 直接抽 2 題（排除測試學校），再一次取回題目
+            answer_types = []
+            selected_ids = []
+            for answer_type in pool_values('answer_type'):
+                question_ids = draw_question_ids(2, {'answer_type': answer_type}, {'school': MIXED_QUIZ_EXCLUDED_SCHOOL})
+                if not question_ids:
                     continue  # 如果沒有題目，跳過這個 answer_type
-                
-                selected_questions.extend(selected)
-                print(f"✅ {answer_type}: 選擇了 {len(selected)} 題")
+                answer_types.append(answer_type)
+                selected_ids.extend(question_ids)
+                print(f"✅ {answer_type}: 選擇了 {len(question_ids)} 題")
+            selected_questions = [doc for doc in load_questions_by_ids(selected_ids) if doc]
+        except QuestionPoolUnavailable as e:
+            print(f"⚠️ 題目池無法使用，改用 MongoDB 查詢: {e}")
+            selected_questions = []
+            # 獲取所有不同的 answer_type（排除測試學校資料）
+            answer_types = mongo.db.exam.distinct('answer_type', {
+                'school': {'$ne': MIXED_QUIZ_EXCLUDED_SCHOOL}
+            })
+            print(f"🔍 找到的 answer_type: {answer_types}")
+            
+            # 為每個 answer_type 選擇 2 題（只從非測試學校的資料中選擇）
+            for answer_type in answer_types:
+                if answer_type:  # 確保 answer_type 不為空
+                    # 從該 answer_type 中隨機選擇 2 題，排除測試學校
+                    questions = list(mongo.db.exam.find({
+                        'answer_type': answer_type,
+                        'school': {'$ne': MIXED_QUIZ_EXCLUDED_SCHOOL}
+                    }).limit(20))  # 增加限制數量以獲得更多選擇
+                    
+                    if len(questions) >= 2:
+                        selected = random.sample(questions, 2)
+                    elif len(questions) == 1:
+                        selected = questions
+                    else:
+                        continue  # 如果沒有題目，跳過這個 answer_type
+                    
+                    selected_questions.extend(selected)
+                    print(f"✅ {answer_type}: 選擇了 {len(selected)} 題")
         
         print(f"📊 總共選擇了 {len(selected_questions)} 題")
         
@@ -1522,26 +1291,28 @@ def get_grading_progress(template_id):
 
 @ai_quiz_bp.route('/quiz-progress/<progress_id>', methods=['GET'])
 def get_quiz_progress(progress_id):
-    """獲取測驗進度 API - 用於前端實時查詢進度"""
+    """獲取測驗進度 API - 用於前端查詢目前進度"""
     try:
-        # 這裡應該從數據庫或緩存中獲取實際進度
-        # 目前先返回模擬進度，後續可以實現真實的進度追蹤
-        
         # 解析progress_id獲取用戶信息
-        if not progress_id.startswith('progress_'):
+        if not progress_id.startswith(('progress_', 'ai_progress_')):
             return jsonify({'error': '無效的進度ID'}), 400
         
-        # 模擬進度狀態（實際應該從數據庫獲取）
+        progress_status = get_progress_status(progress_id)
+        if progress_status is None:
+            return jsonify({'success': False, 'error': '進度服務暫時無法使用'}), 503
+        
+        current_stage = progress_status.get('current_stage', 1)
         progress_data = {
             'progress_id': progress_id,
-            'current_stage': 3,  # 當前階段：1=試卷批改, 2=計算分數, 3=評判知識點, 4=生成學習計畫
-            'total_stages': 4,
-            'stage_name': '評判知識點',
-            'stage_description': 'AI正在進行智能評分...',
-            'progress_percentage': 75,  # 75%完成
-            'is_completed': False,
-            'estimated_time_remaining': 30,  # 預計剩餘時間（秒）
-            'last_updated': time.time()
+            'current_stage': current_stage,  # 當前階段：1=試卷批改, 2=計算分數, 3=評判知識點, 4=生成學習計畫
+            'total_stages': TOTAL_STAGES,
+            'stage_description': progress_status.get('stage_description', ''),
+            'progress_percentage': progress_status.get('progress_percentage', 0),
+            'completed_questions': progress_status.get('completed_questions'),
+            'total_questions': progress_status.get('total_questions'),
+            'is_completed': progress_status.get('is_completed', False),
+            'last_event_id': progress_status.get('event_id'),
+            'last_updated': progress_status.get('updated_at')
         }
         
         return jsonify({
@@ -1559,80 +1330,19 @@ def get_quiz_progress(progress_id):
 
 @ai_quiz_bp.route('/quiz-progress-sse/<progress_id>', methods=['GET'])
 def quiz_progress_sse(progress_id):
-    """測驗進度 Server-Sent Events API - 實時推送進度更新"""
-    def generate_progress_events():
-        """生成進度事件流"""
-        try:
-            # 設置SSE headers
-            yield 'data: {"type": "connected", "message": "進度追蹤已連接"}\n\n'
-            
-            # 檢查進度追蹤狀態
-            progress_status = get_progress_status(progress_id)
-            
-            if progress_status and progress_status.get('is_completed'):
-                # 如果AI批改已經完成，直接發送完成消息
-                completion_data = {
-                    'type': 'completion',
-                    'message': 'AI批改完成！',
-                    'progress_percentage': 100,
-                    'is_completed': True,
-                    'timestamp': time.time()
-                }
-                yield f'data: {json.dumps(completion_data, ensure_ascii=False)}\n\n'
-                return
-            
-            # 如果還沒完成，發送當前進度
-            current_stage = progress_status.get('current_stage', 1) if progress_status else 1
-            stage_descriptions = {
-                1: '正在獲取題目數據...',
-                2: '正在分類題目...',
-                3: 'AI正在進行智能評分...',
-                4: '正在統計結果...'
-            }
-            
-            progress_data = {
-                'type': 'progress_update',
-                'current_stage': current_stage,
-                'stage_description': stage_descriptions.get(current_stage, '處理中...'),
-                'progress_percentage': (current_stage / 4) * 100,
-                'is_completed': False,
-                'timestamp': time.time()
-            }
-            
-            yield f'data: {json.dumps(progress_data, ensure_ascii=False)}\n\n'
-            
-            # 等待一下，然後檢查是否完成
-            time.sleep(1)
-            
-            # 再次檢查完成狀態
-            progress_status = get_progress_status(progress_id)
-            if progress_status and progress_status.get('is_completed'):
-                completion_data = {
-                    'type': 'completion',
-                    'message': 'AI批改完成！',
-                    'progress_percentage': 100,
-                    'is_completed': True,
-                    'timestamp': time.time()
-                }
-                yield f'data: {json.dumps(completion_data, ensure_ascii=False)}\n\n'
-                    
-        except Exception as e:
-            error_data = {
-                'type': 'error',
-                'message': f'進度追蹤錯誤: {str(e)}',
-                'timestamp': time.time()
-            }
-            yield f'data: {json.dumps(error_data, ensure_ascii=False)}\n\n'
+    """測驗進度 Server-Sent Events API - 事件到達即推送，支援 Last-Event-ID 續傳"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
     
     # 設置SSE響應headers
     response = Response(
-        generate_progress_events(),
+        stream_progress_events(progress_id, last_event_id),
         mimetype='text/event-stream',
         headers={
             'Cache-Control': 'no-cache',
             'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no',
             'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Cache-Control'
+            'Access-Control-Allow-Headers': 'Cache-Control, Last-Event-ID'
         }
     )
     
@@ -1955,22 +1665,11 @@ def get_user_submissions_analysis():
                                 elif isinstance(image_file, str):
                                     image_filenames = [image_file]
                                 
-                                # 將每個圖片檔案轉換為 base64
+                                # 取得每個圖片檔案的引用（帶版本的 URL，相容模式為 base64 data URL）
                                 for image_filename in image_filenames:
-                                    image_base64 = get_image_base64(image_filename)
-                                    if image_base64:
-                                        # 判斷圖片格式
-                                        import os
-                                        image_ext = os.path.splitext(image_filename)[1].lower()
-                                        mime_type = 'image/jpeg'
-                                        if image_ext in ['.png']:
-                                            mime_type = 'image/png'
-                                        elif image_ext in ['.gif']:
-                                            mime_type = 'image/gif'
-                                        elif image_ext in ['.webp']:
-                                            mime_type = 'image/webp'
-                                        
-                                        image_data_list.append(f"data:{mime_type};base64,{image_base64}")
+                                    image_src = get_question_image_src(image_filename)
+                                    if image_src:
+                                        image_data_list.append(image_src)
                             
                             # 如果只有一張圖片，直接返回字串；多張圖片返回陣列
                             if len(image_data_list) == 1:
@@ -2531,7 +2230,7 @@ def generate_content_based_quiz():
 
 @ai_quiz_bp.route('/submit-ai-quiz', methods=['POST', 'OPTIONS'])
 def submit_ai_quiz():
-    """提交 AI 生成的測驗答案 - 帶進度追蹤版本"""
+    """提交 AI 生成的測驗答案 - 帶進度追蹤版本（支援非同步批改）"""
     try:
         if request.method == 'OPTIONS':
             return jsonify({'token': None, 'success': True}), 200
@@ -2550,10 +2249,6 @@ def submit_ai_quiz():
         # 提取提交數據
         quiz_id = data.get('quiz_id')
         template_id = data.get('template_id')
-        answers = data.get('answers', {})
-        question_answer_times = data.get('question_answer_times', {})
-        time_taken = data.get('time_taken', 0)
-        frontend_questions = data.get('questions', [])
         
         if not quiz_id or not template_id:
             return jsonify({
@@ -2562,212 +2257,43 @@ def submit_ai_quiz():
             }), 400
         
         # 生成唯一的進度追蹤ID
-        progress_id = f"ai_progress_{user_email}_{int(time.time())}"
-        
-        # 階段1: 獲取題目數據
-        update_progress_status(progress_id, False, 1, "正在獲取AI測驗題目數據...")
-        
-        # 從 MongoDB 獲取考卷數據
-        if mongo is None or mongo.db is None:
-            return jsonify({'success': False, 'error': '資料庫連接不可用'}), 500
-        
-        quiz_doc = mongo.db.exam.find_one({"_id": quiz_id})
-        if not quiz_doc:
-            return jsonify({'success': False, 'error': '找不到考卷'}), 404
-        
-        # 優先使用前端發送的題目數據，如果沒有則從MongoDB獲取
-        if frontend_questions and len(frontend_questions) > 0:
-            questions = frontend_questions
-        else:
-            questions = quiz_doc.get('questions', [])
-            
-        if not questions:
-            return jsonify({'success': False, 'error': '考卷中沒有題目'}), 400
-        
-        total_questions = len(questions)
-        
-        # 階段2: 分類題目
-        update_progress_status(progress_id, False, 2, "正在分類AI測驗題目...")
-        
-        # 分類已作答和未作答題目
-        answered_questions = []
-        unanswered_questions = []
-        correct_count = 0
-        wrong_count = 0
-        total_score = 0
-        wrong_questions = []
-        
-        for i, question in enumerate(questions):
-            user_answer = answers.get(str(i), '')
-            question_type = question.get('type', 'single-choice')
-            
-            # 檢查是否有有效答案
-            has_valid_answer = False
-            if user_answer is not None and user_answer != '':
-                has_valid_answer = True
-            
-            if has_valid_answer:
-                # 已作答題目：收集到已作答列表
-                answered_questions.append({
-                    'index': i,
-                    'question': question,
-                    'user_answer': user_answer,
-                    'question_type': question_type
-                })
-            else:
-                # 未作答題目：收集到未作答列表
-                unanswered_questions.append({
-                    'index': i,
-                    'question': question,
-                    'user_answer': '',
-                    'question_type': question_type
-                })
-        
-        # 階段3: AI智能評分
-        update_progress_status(progress_id, False, 3, "AI正在進行智能評分...")
-        
-        # 批量AI評分所有已作答題目
-        if answered_questions:
-            # 準備AI評分數據
-            ai_questions_data = []
-            for q_data in answered_questions:
-                question = q_data['question']
-                user_answer = q_data['user_answer']
-                question_type = question.get('type', '')
-                
-                ai_questions_data.append({
-                    'question_id': question.get('original_exam_id', ''),
-                    'user_answer': user_answer,
-                    'question_type': question_type,
-                    'question_text': question.get('question_text', ''),
-                    'options': question.get('options', []),
-                    'correct_answer': question.get('correct_answer', ''),
-                    'key_points': question.get('key_points', '')
-                })
-            
-            # 使用AI批改模組進行批量評分
-            from src.grade_answer import batch_grade_ai_questions
-            ai_results = batch_grade_ai_questions(ai_questions_data)
-            
-            # 處理AI評分結果
-            for i, result in enumerate(ai_results):
-                q_data = answered_questions[i]
-                question = q_data['question']
-                
-                is_correct = result.get('is_correct', False)
-                score = result.get('score', 0)
-                feedback = result.get('feedback', {})
-                
-                # 統計正確和錯誤題數
-                if is_correct:
-                    correct_count += 1
-                    total_score += score
-                else:
-                    wrong_count += 1
-                    # 收集錯題信息
-                    wrong_questions.append({
-                        'question_id': question.get('id', q_data['index'] + 1),
-                        'question_text': question.get('question_text', ''),
-                        'question_type': question.get('type', ''),
-                        'user_answer': q_data['user_answer'],
-                        'correct_answer': question.get('correct_answer', ''),
-                        'options': question.get('options', []),
-                        'image_file': question.get('image_file', ''),
-                        'original_exam_id': question.get('original_exam_id', ''),
-                        'question_index': q_data['index'],
-                        'score': score,
-                        'feedback': feedback
-                    })
-                
-                # 保存AI評分結果到 answered_questions 中，供後續使用
-                q_data['ai_result'] = {
-                    'is_correct': is_correct,
-                    'score': score,
-                    'feedback': feedback
-                }
-        
-        # 階段4: 統計結果
-        update_progress_status(progress_id, False, 4, "正在統計AI測驗結果...")
-        
-        # 計算統計數據
-        answered_count = len(answered_questions)
-        unanswered_count = len(unanswered_questions)
-        accuracy_rate = (correct_count / total_questions * 100) if total_questions > 0 else 0
-        average_score = (total_score / answered_count) if answered_count > 0 else 0
-        
-        # 簡化版本：直接保存到 MongoDB，避免 SQL 資料庫問題
-        submission_data = {
+        progress_id = new_progress_id(user_email, data.get('progress_id'), prefix='ai_progress')
+        submission = {
             'quiz_id': quiz_id,
             'template_id': template_id,
-            'user_email': user_email,
-            'answers': answers,
-            'question_answer_times': question_answer_times,
-            'time_taken': time_taken,
-            'score': accuracy_rate,
-            'correct_count': correct_count,
-            'wrong_count': wrong_count,
-            'total_questions': total_questions,
-            'answered_count': answered_count,
-            'unanswered_count': unanswered_count,
-            'accuracy_rate': accuracy_rate,
-            'average_score': average_score,
-            'wrong_questions': wrong_questions,
-            'submitted_at': datetime.now().isoformat(),
-            'quiz_type': 'ai_generated',
-            'progress_id': progress_id
+            'answers': data.get('answers', {}),
+            'question_answer_times': data.get('question_answer_times', {}),
+            'time_taken': data.get('time_taken', 0),
+            'questions': data.get('questions', [])
         }
         
-        # 保存到 submissions 集合
-        result = mongo.db.submissions.insert_one(submission_data)
-        submission_id = str(result.inserted_id)
-        
-        # 生成結果ID
-        result_id = f"ai_result_{submission_id}"
-        quiz_history_id = f"quiz_history_{submission_id}"
+        # 非同步模式：寫入批改佇列後立即返回，前端以 progress_id 訂閱 SSE 或查詢 job 狀態
+        if is_async_grading_requested(data):
+            job_id = enqueue_grading_job('ai_generated_quiz', user_email, submission, progress_id)
+            if job_id:
+                return jsonify({
+                    'token': refresh_token(token),
+                    'success': True,
+                    'message': 'AI測驗已提交，正在批改中',
+                    'data': {
+                        'job_id': job_id,
+                        'progress_id': progress_id,
+                        'template_id': template_id,
+                        'quiz_id': quiz_id,
+                        'status': 'queued'
+                    }
+                }), 202
+            print("⚠️ 批改佇列不可用，改為同步批改")
         
-        # 更新進度追蹤狀態為完成
-        update_progress_status(progress_id, True, 4, "AI測驗批改完成！")
+        result = grade_ai_generated_quiz_submission(user_email, submission, progress_id)
+        if not result.get('success'):
+            return jsonify({'success': False, 'error': result.get('message', 'AI測驗批改失敗')}), result.get('status_code', 500)
         
         return jsonify({
             'token': refresh_token(token),
             'success': True,
             'message': 'AI測驗提交成功',
-            'data': {
-                'submission_id': submission_id,
-                'quiz_history_id': quiz_history_id,  # 返回測驗歷史記錄ID
-                'result_id': result_id,
-                'progress_id': progress_id,  # 返回進度追蹤ID
-                'template_id': template_id,  # 返回模板ID
-                'quiz_id': quiz_id,
-                'total_questions': total_questions,
-                'answered_questions': answered_count,
-                'unanswered_questions': unanswered_count,
-                'correct_count': correct_count,
-                'wrong_count': wrong_count,
-                'marked_count': 0,  # 暫時設為0，後續可擴展
-                'accuracy_rate': round(accuracy_rate, 2),
-                'average_score': round(average_score, 2),
-                'time_taken': time_taken,
-                'total_time': time_taken,  # 添加總時間字段
-                'grading_stages': [
-                    {'stage': 1, 'name': '試卷批改', 'status': 'completed', 'description': '獲取AI測驗題目數據完成'},
-                    {'stage': 2, 'name': '計算分數', 'status': 'completed', 'description': 'AI測驗題目分類完成'},
-                    {'stage': 3, 'name': '評判知識點', 'status': 'completed', 'description': f'AI智能評分完成，共評分{answered_count}題'},
-                    {'stage': 4, 'name': '生成學習計畫', 'status': 'completed', 'description': f'AI測驗統計完成，正確率{accuracy_rate:.1f}%'}
-                ],
-                'detailed_results': [
-                    {
-                        'question_index': q_data['index'],
-                        'question_text': q_data['question'].get('question_text', ''),
-                        'user_answer': q_data['user_answer'],
-                        'correct_answer': q_data['question'].get('correct_answer', ''),
-                        'is_correct': q_data.get('ai_result', {}).get('is_correct', False),
-                        'score': q_data.get('ai_result', {}).get('score', 0),
-                        'feedback': q_data.get('ai_result', {}).get('feedback', {})
-                    }
-                    for q_data in answered_questions
-                ]
-            }
+            'data': result['data']
         })
         
     except Exception as e:
@@ -2777,6 +2303,231 @@ def submit_ai_quiz():
             'message': f'AI測驗提交失敗：{str(e)}'
         }), 500
 
+
+def grade_ai_generated_quiz_submission(user_email, submission, progress_id):
+    """
+    批改一份 AI 生成考卷的作答並寫入 submissions 集合
+    
+    由 /submit-ai-quiz 同步呼叫，或由批改 worker 從佇列取出後呼叫。
+    返回 {'success': True, 'data': {...}}，失敗時返回 {'success': False, 'message': ..., 'status_code': ...}
+    """
+    quiz_id = submission.get('quiz_id')
+    template_id = submission.get('template_id')
+    answers = submission.get('answers', {})
+    question_answer_times = submission.get('question_answer_times', {})
+    time_taken = submission.get('time_taken', 0)
+    frontend_questions = submission.get('questions', [])
+    
+    # 階段1: 獲取題目數據
+    update_progress_status(progress_id, False, 1, "正在獲取AI測驗題目數據...")
+
+    # 從 MongoDB 獲取考卷數據
+    if mongo is None or mongo.db is None:
+        return {'success': False, 'message': '資料庫連接不可用', 'status_code': 500}
+
+    quiz_doc = mongo.db.exam.find_one({"_id": quiz_id})
+    if not quiz_doc:
+        return {'success': False, 'message': '找不到考卷', 'status_code': 404}
+
+    # 優先使用前端發送的題目數據，如果沒有則從MongoDB獲取
+    if frontend_questions and len(frontend_questions) > 0:
+        questions = frontend_questions
+    else:
+        questions = quiz_doc.get('questions', [])
+
+    if not questions:
+        return {'success': False, 'message': '考卷中沒有題目', 'status_code': 400}
+
+    total_questions = len(questions)
+
+    # 階段2: 分類題目
+    update_progress_status(progress_id, False, 2, "正在分類AI測驗題目...")
+
+    # 分類已作答和未作答題目
+    answered_questions = []
+    unanswered_questions = []
+    correct_count = 0
+    wrong_count = 0
+    total_score = 0
+    wrong_questions = []
+
+    for i, question in enumerate(questions):
+        user_answer = answers.get(str(i), '')
+        question_type = question.get('type', 'single-choice')
+
+        # 檢查是否有有效答案
+        has_valid_answer = False
+        if user_answer is not None and user_answer != '':
+            has_valid_answer = True
+
+        if has_valid_answer:
+            # 已作答題目：收集到已作答列表
+            answered_questions.append({
+                'index': i,
+                'question': question,
+                'user_answer': user_answer,
+                'question_type': question_type
+            })
+        else:
+            # 未作答題目：收集到未作答列表
+            unanswered_questions.append({
+                'index': i,
+                'question': question,
+                'user_answer': '',
+                'question_type': question_type
+            })
+
+    # 階段3: AI智能評分
+    update_progress_status(progress_id, False, 3, "AI正在進行智能評分...")
+
+    # 批量AI評分所有已作答題目
+    if answered_questions:
+        # 準備AI評分數據
+        ai_questions_data = []
+        for q_data in answered_questions:
+            question = q_data['question']
+            user_answer = q_data['user_answer']
+            question_type = question.get('type', '')
+
+            ai_questions_data.append({
+                'question_id': question.get('original_exam_id', ''),
+                'user_answer': user_answer,
+                'question_type': question_type,
+                'question_text': question.get('question_text', ''),
+                'options': question.get('options', []),
+                'correct_answer': question.get('correct_answer', ''),
+                'key_points': question.get('key_points', '')
+            })
+
+        # 使用AI批改模組進行批量評分
+        from src.grade_answer import batch_grade_ai_questions
+        ai_results = batch_grade_ai_questions(
+            ai_questions_data,
+            progress_callback=lambda done, total, qid: publish_question_graded(progress_id, done, total, qid)
+        )
+
+        # 處理AI評分結果
+        for i, result in enumerate(ai_results):
+            q_data = answered_questions[i]
+            question = q_data['question']
+
+            is_correct = result.get('is_correct', False)
+            score = result.get('score', 0)
+            feedback = result.get('feedback', {})
+
+            # 統計正確和錯誤題數
+            if is_correct:
+                correct_count += 1
+                total_score += score
+            else:
+                wrong_count += 1
+                # 收集錯題信息
+                wrong_questions.append({
+                    'question_id': question.get('id', q_data['index'] + 1),
+                    'question_text': question.get('question_text', ''),
+                    'question_type': question.get('type', ''),
+                    'user_answer': q_data['user_answer'],
+                    'correct_answer': question.get('correct_answer', ''),
+                    'options': question.get('options', []),
+                    'image_file': question.get('image_file', ''),
+                    'original_exam_id': question.get('original_exam_id', ''),
+                    'question_index': q_data['index'],
+                    'score': score,
+                    'feedback': feedback
+                })
+
+            # 保存AI評分結果到 answered_questions 中，供後續使用
+            q_data['ai_result'] = {
+                'is_correct': is_correct,
+                'score': score,
+                'feedback': feedback
+            }
+
+    # 階段4: 統計結果
+    update_progress_status(progress_id, False, 4, "正在統計AI測驗結果...")
+
+    # 計算統計數據
+    answered_count = len(answered_questions)
+    unanswered_count = len(unanswered_questions)
+    accuracy_rate = (correct_count / total_questions * 100) if total_questions > 0 else 0
+    average_score = (total_score / answered_count) if answered_count > 0 else 0
+
+    # 簡化版本：直接保存到 MongoDB，避免 SQL 資料庫問題
+    submission_data = {
+        'quiz_id': quiz_id,
+        'template_id': template_id,
+        'user_email': user_email,
+        'answers': answers,
+        'question_answer_times': question_answer_times,
+        'time_taken': time_taken,
+        'score': accuracy_rate,
+        'correct_count': correct_count,
+        'wrong_count': wrong_count,
+        'total_questions': total_questions,
+        'answered_count': answered_count,
+        'unanswered_count': unanswered_count,
+        'accuracy_rate': accuracy_rate,
+        'average_score': average_score,
+        'wrong_questions': wrong_questions,
+        'submitted_at': datetime.now().isoformat(),
+        'quiz_type': 'ai_generated',
+        'progress_id': progress_id
+    }
+
+    # 保存到 submissions 集合
+    result = mongo.db.submissions.insert_one(submission_data)
+    submission_id = str(result.inserted_id)
+
+    # 生成結果ID
+    result_id = f"ai_result_{submission_id}"
+    quiz_history_id = f"quiz_history_{submission_id}"
+
+    # 更新進度追蹤狀態為完成
+    update_progress_status(progress_id, True, 4, "AI測驗批改完成！")
+
+    return {
+        'success': True,
+        'data': {
+            'submission_id': submission_id,
+            'quiz_history_id': quiz_history_id,  # 返回測驗歷史記錄ID
+            'result_id': result_id,
+            'progress_id': progress_id,  # 返回進度追蹤ID
+            'template_id': template_id,  # 返回模板ID
+            'quiz_id': quiz_id,
+            'total_questions': total_questions,
+            'answered_questions': answered_count,
+            'unanswered_questions': unanswered_count,
+            'correct_count': correct_count,
+            'wrong_count': wrong_count,
+            'marked_count': 0,  # 暫時設為0，後續可擴展
+            'accuracy_rate': round(accuracy_rate, 2),
+            'average_score': round(average_score, 2),
+            'time_taken': time_taken,
+            'total_time': time_taken,  # 添加總時間字段
+            'grading_stages': [
+                {'stage': 1, 'name': '試卷批改', 'status': 'completed', 'description': '獲取AI測驗題目數據完成'},
+                {'stage': 2, 'name': '計算分數', 'status': 'completed', 'description': 'AI測驗題目分類完成'},
+                {'stage': 3, 'name': '評判知識點', 'status': 'completed', 'description': f'AI智能評分完成，共評分{answered_count}題'},
+                {'stage': 4, 'name': '生成學習計畫', 'status': 'completed', 'description': f'AI測驗統計完成，正確率{accuracy_rate:.1f}%'}
+            ],
+            'detailed_results': [
+                {
+                    'question_index': q_data['index'],
+                    'question_text': q_data['question'].get('question_text', ''),
+                    'user_answer': q_data['user_answer'],
+                    'correct_answer': q_data['question'].get('correct_answer', ''),
+                    'is_correct': q_data.get('ai_result', {}).get('is_correct', False),
+                    'score': q_data.get('ai_result', {}).get('score', 0),
+                    'feedback': q_data.get('ai_result', {}).get('feedback', {})
+                }
+                for q_data in answered_questions
+            ]
+        }
+    }
+
+
+register_job_handler('ai_generated_quiz', grade_ai_generated_quiz_submission)
+
 @ai_quiz_bp.route('/track-learning-progress', methods=['POST', 'OPTIONS'])
 def track_learning_progress():
     """追蹤學習進度"""
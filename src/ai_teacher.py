@@ -11,6 +11,7 @@ from typing import Dict, Any, List, Optional
 from src.api import get_user_info
 from accessories import mongo, refresh_token
 from bson.objectid import ObjectId
+from src.question_loader import load_questions_by_ids, QUIZ_QUESTION_PROJECTION
 
 # 導入 RAG 系統模組
 RAG_AVAILABLE = False
@@ -33,22 +34,8 @@ def get_quiz_from_database(quiz_ids: List[str]) -> dict:
     try:
         # 從 MongoDB 獲取考卷數據
         # 根據你提供的數據結構，quiz_ids 應該是考卷的 _id，而不是題目的 _id
-        quiz_doc = None
-        
-        for quiz_id in quiz_ids:
-            try:
-                # 優先使用 ObjectId 查詢（AI生成的測驗使用ObjectId）
-                quiz_doc = mongo.db.exam.find_one({"_id": ObjectId(quiz_id)})
-                
-                if not quiz_doc:
-                    # 如果 ObjectId 查詢失敗，嘗試直接查詢（支援字串格式ID）
-                    quiz_doc = mongo.db.exam.find_one({"_id": quiz_id})
-                
-                if quiz_doc:
-                    break
-                    
-            except Exception as e:
-                continue
+        # 單次 $in 查詢（同時支援 ObjectId 與字串ID），取第一個存在的考卷
+        quiz_doc = next((doc for doc in load_questions_by_ids(quiz_ids) if doc), None)
         
         if not quiz_doc:
             return {
@@ -347,8 +334,9 @@ def get_quiz_result_data(result_id: str) -> dict:
             
             # 構建題目陣列
             questions = []
-            for question_id in question_ids:
-                question_obj = mongo.db.exam.find_one({'_id': ObjectId(question_id)})
+            # 單次 $in 查詢取回所有題目（保持原始順序）
+            question_objs = load_questions_by_ids(question_ids, QUIZ_QUESTION_PROJECTION)
+            for question_id, question_obj in zip(question_ids, question_objs):
                 if not question_obj:
                     continue
                 
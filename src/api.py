@@ -1,15 +1,28 @@
 from flask import request,url_for, Blueprint, jsonify, current_app, send_from_directory, abort
 import jwt
-from accessories import mongo
+import json
+import threading
+from collections import OrderedDict
+from accessories import mongo, redis_client, decode_token
 from datetime import datetime, timedelta
 from functools import wraps
 import os
 import time
 
+# 用戶資料快取：行程內 TTL LRU + Redis 共用層，只快取常用的個人資料欄位
+USER_CACHE_FIELDS = ('email', 'name', 'school', 'lineId', 'avatar')
+USER_CACHE_TTL_SECONDS = 60
+USER_CACHE_MAX_ENTRIES = 1024
+USER_CACHE_REDIS_TTL_SECONDS = 300
+USER_CACHE_KEY_PREFIX = 'user_profile:'
+
+_user_cache = OrderedDict()  # email -> (到期時間, 資料)
+_user_cache_lock = threading.Lock()
+
 def verify_token(token):
     """验证JWT token并返回用户信息"""
     try:
-        decoded_token = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
+        decoded_token = decode_token(token)
         # 檢查token是否過期 - 現在使用Unix時間戳
         exp = decoded_token.get('exp')
         if exp and time.time() < exp:
@@ -27,12 +40,80 @@ def verify_token(token):
         print(f"❌ Token無效: {e}")
         return None
 
+def _get_local_user(email):
+    with _user_cache_lock:
+        entry = _user_cache.get(email)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del _user_cache[email]
+            return None
+        _user_cache.move_to_end(email)
+        return entry[1]
+
+
+def _set_local_user(email, profile):
+    with _user_cache_lock:
+        _user_cache[email] = (time.time() + USER_CACHE_TTL_SECONDS, profile)
+        _user_cache.move_to_end(email)
+        while len(_user_cache) > USER_CACHE_MAX_ENTRIES:
+            _user_cache.popitem(last=False)
+
+
+def get_cached_user(email):
+    """
+    獲取用戶個人資料（僅 USER_CACHE_FIELDS 欄位）
+
+    依序查詢行程內快取、Redis、MongoDB，用戶不存在時返回 None
+    """
+    profile = _get_local_user(email)
+    if profile is not None:
+        return profile
+
+    redis_key = f"{USER_CACHE_KEY_PREFIX}{email}"
+    try:
+        cached = redis_client.get(redis_key)
+        if cached:
+            profile = json.loads(cached)
+    except Exception as e:
+        print(f"⚠️ 讀取用戶快取失敗: {e}")
+
+    if profile is None:
+        user = mongo.db.user.find_one({"email": email}, {field: 1 for field in USER_CACHE_FIELDS})
+        if not user:
+            return None
+        profile = {field: user[field] for field in USER_CACHE_FIELDS if field in user}
+        try:
+            redis_client.setex(redis_key, USER_CACHE_REDIS_TTL_SECONDS, json.dumps(profile, ensure_ascii=False))
+        except Exception as e:
+            print(f"⚠️ 寫入用戶快取失敗: {e}")
+
+    _set_local_user(email, profile)
+    return profile
+
+
+def invalidate_user_cache(email):
+    """用戶資料更新後清除快取（其他行程的行程內快取最多保留 USER_CACHE_TTL_SECONDS 秒）"""
+    if not email:
+        return
+    with _user_cache_lock:
+        _user_cache.pop(email, None)
+    try:
+        redis_client.delete(f"{USER_CACHE_KEY_PREFIX}{email}")
+    except Exception as e:
+        print(f"⚠️ 清除用戶快取失敗: {e}")
+
+
 def get_user_info(token, key):
-    decoded_token = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-    
-    user = mongo.db.user.find_one({"email": decoded_token['user']})
+    decoded_token = decode_token(token)
+    email = decoded_token['user']
+
+    if key in USER_CACHE_FIELDS:
+        user = get_cached_user(email)
+    else:
+        user = mongo.db.user.find_one({"email": email})
     if not user:
-        print(f"❌ 找不到用戶: {decoded_token['user']}")
+        print(f"❌ 找不到用戶: {email}")
         raise ValueError("User not found")
 
     return user[key]
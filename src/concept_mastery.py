@@ -0,0 +1,312 @@
+"""
+學生概念掌握度表 - 依（學生、領域、微概念、難度）累計作答統計，供學習分析頁讀取
+"""
+import math
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+from sqlalchemy import text
+from accessories import sqldb
+from src.question_loader import load_question_map
+
+# 遺忘曲線每日衰減率（與 calculate_forgetting_aware_mastery 一致）
+DEFAULT_DECAY_RATE = 0.1
+
+# 計算掌握度所需的題目欄位
+CONCEPT_QUESTION_PROJECTION = {
+    'micro_concepts': 1,
+    'key-points': 1,
+    'difficulty level': 1,
+    'difficulty': 1,
+    'level': 1,
+    'domain': 1,
+    'subject': 1,
+    'field': 1
+}
+
+_UPSERT_MASTERY_SQL = text("""
+    INSERT INTO user_concept_mastery
+    (user_email, domain_name, micro_concept_id, difficulty, attempt_count, correct_count,
+     weighted_correct, weighted_total, decay_rate, total_time_seconds,
+     first_attempt_at, last_attempt_at, last_correct_at)
+    VALUES (:user_email, :domain_name, :micro_concept_id, :difficulty, :attempt_count, :correct_count,
+            :weighted_correct, :weighted_total, :decay_rate, :total_time_seconds,
+            :first_attempt_at, :last_attempt_at, :last_correct_at)
+    ON DUPLICATE KEY UPDATE
+        weighted_correct = weighted_correct * EXP(-decay_rate * GREATEST(TIMESTAMPDIFF(SECOND, last_attempt_at, VALUES(last_attempt_at)), 0) / 86400) + VALUES(weighted_correct),
+        weighted_total = weighted_total * EXP(-decay_rate * GREATEST(TIMESTAMPDIFF(SECOND, last_attempt_at, VALUES(last_attempt_at)), 0) / 86400) + VALUES(weighted_total),
+        attempt_count = attempt_count + VALUES(attempt_count),
+        correct_count = correct_count + VALUES(correct_count),
+        total_time_seconds = total_time_seconds + VALUES(total_time_seconds),
+        last_correct_at = COALESCE(VALUES(last_correct_at), last_correct_at),
+        last_attempt_at = GREATEST(last_attempt_at, VALUES(last_attempt_at))
+""")
+
+_LOCK_STATE_SQL = text("""
+    SELECT rebuilt_at FROM user_concept_mastery_state WHERE user_email = :user_email FOR UPDATE
+""")
+
+
+def init_concept_mastery_tables():
+    """創建概念掌握度相關資料表"""
+    try:
+        with sqldb.engine.connect() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS user_concept_mastery (
+                    user_email VARCHAR(191) NOT NULL,
+                    domain_name VARCHAR(191) NOT NULL DEFAULT '',
+                    micro_concept_id VARCHAR(100) NOT NULL DEFAULT '',
+                    difficulty VARCHAR(20) NOT NULL DEFAULT '中等',
+                    attempt_count INT NOT NULL DEFAULT 0,
+                    correct_count INT NOT NULL DEFAULT 0,
+                    weighted_correct DOUBLE NOT NULL DEFAULT 0,  -- 依遺忘曲線衰減的加權答對數
+                    weighted_total DOUBLE NOT NULL DEFAULT 0,  -- 依遺忘曲線衰減的加權作答數
+                    decay_rate DOUBLE NOT NULL DEFAULT 0.1,  -- 每日衰減率
+                    total_time_seconds INT NOT NULL DEFAULT 0,
+                    first_attempt_at DATETIME NOT NULL,
+                    last_attempt_at DATETIME NOT NULL,
+                    last_correct_at DATETIME NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_email, domain_name, micro_concept_id, difficulty)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """))
+            # 記錄已由作答歷史重建過的學生，之後只做增量更新
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS user_concept_mastery_state (
+                    user_email VARCHAR(191) PRIMARY KEY,
+                    rebuilt_at DATETIME NOT NULL
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """))
+            conn.commit()
+        return True
+    except Exception as e:
+        print(f"❌ Failed to initialize concept mastery tables: {e}")
+        return False
+
+
+def question_concept_fields(question_doc: Dict[str, Any]) -> Dict[str, str]:
+    """從題目文件取出領域、微概念與難度（欄位名稱不一致時依序嘗試）"""
+    micro_concepts = question_doc.get('micro_concepts', [])
+    micro_concept_id = str(micro_concepts[0]) if micro_concepts else ''
+    key_points = question_doc.get('key-points', '')
+    difficulty = (question_doc.get('difficulty level') or
+                  question_doc.get('difficulty') or
+                  question_doc.get('level') or
+                  '中等')
+    domain_name = (question_doc.get('domain') or
+                   question_doc.get('subject') or
+                   question_doc.get('field') or
+                   key_points or
+                   '未知領域')
+    return {
+        'micro_concept_id': micro_concept_id,
+        'domain_name': domain_name,
+        'difficulty': difficulty,
+        'key_points': key_points
+    }
+
+
+def _mastery_key(fields: Dict[str, str]) -> tuple:
+    """統計列的主鍵（截斷至欄位長度）"""
+    return (str(fields['domain_name'])[:191], str(fields['micro_concept_id'])[:100], str(fields['difficulty'])[:20])
+
+
+def _fold_attempts(user_email: str, attempts: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    將作答紀錄彙整為統計列
+
+    參數：
+    - attempts: [{'question_id', 'is_correct', 'time_spent', 'attempt_time'}]，attempt_time 為 datetime
+    """
+    attempts = list(attempts)
+    question_map = load_question_map([a.get('question_id') for a in attempts], CONCEPT_QUESTION_PROJECTION)
+
+    rows: Dict[tuple, Dict[str, Any]] = {}
+    for attempt in sorted(attempts, key=lambda a: a['attempt_time']):
+        question_doc = question_map.get(str(attempt.get('question_id')))
+        if not question_doc:
+            continue
+        key = _mastery_key(question_concept_fields(question_doc))
+        attempt_time = attempt['attempt_time']
+        is_correct = bool(attempt.get('is_correct'))
+
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = {
+                'user_email': user_email,
+                'domain_name': key[0],
+                'micro_concept_id': key[1],
+                'difficulty': key[2],
+                'attempt_count': 0,
+                'correct_count': 0,
+                'weighted_correct': 0.0,
+                'weighted_total': 0.0,
+                'decay_rate': DEFAULT_DECAY_RATE,
+                'total_time_seconds': 0,
+                'first_attempt_at': attempt_time,
+                'last_attempt_at': attempt_time,
+                'last_correct_at': None
+            }
+        # 先將既有加權值衰減至本次作答時間，再加上本次結果
+        elapsed_days = max((attempt_time - row['last_attempt_at']).total_seconds(), 0) / 86400
+        decay = math.exp(-row['decay_rate'] * elapsed_days)
+        row['weighted_correct'] = row['weighted_correct'] * decay + (1 if is_correct else 0)
+        row['weighted_total'] = row['weighted_total'] * decay + 1
+        row['attempt_count'] += 1
+        row['correct_count'] += 1 if is_correct else 0
+        row['total_time_seconds'] += int(attempt.get('time_spent') or 0)
+        row['last_attempt_at'] = max(row['last_attempt_at'], attempt_time)
+        if is_correct:
+            row['last_correct_at'] = attempt_time
+    return list(rows.values())
+
+
+def record_quiz_attempts(user_email: str, attempts: List[Dict[str, Any]], attempt_time: Optional[datetime] = None) -> bool:
+    """
+    批改完成後增量更新概念掌握度（失敗不影響批改結果）
+
+    參數：
+    - attempts: [{'question_id', 'is_correct', 'time_spent'}]
+    - attempt_time: 作答時間，預設為現在
+    """
+    if not user_email or not attempts:
+        return False
+    attempt_time = attempt_time or datetime.now()
+    try:
+        rows = _fold_attempts(user_email, [dict(a, attempt_time=attempt_time) for a in attempts])
+        if not rows:
+            return False
+        with sqldb.engine.begin() as conn:
+            # 以狀態列作為每位學生的鎖：重建進行中時等待重建完成，避免增量被重建的 DELETE 覆蓋
+            rebuilt = conn.execute(_LOCK_STATE_SQL, {'user_email': user_email}).fetchone()
+            if not rebuilt:
+                # 尚未重建過：首次讀取時會由作答歷史（已包含本次作答）重建
+                return True
+            conn.execute(_UPSERT_MASTERY_SQL, rows)
+        return True
+    except Exception as e:
+        print(f"⚠️ 更新概念掌握度失敗: {e}")
+        return False
+
+
+def rebuild_user_mastery(user_email: str) -> bool:
+    """由學生全部作答歷史重建概念掌握度（僅在首次讀取時執行）"""
+    try:
+        with sqldb.engine.begin() as conn:
+            # 先寫入狀態列取得每位學生的鎖，整個重建在同一個交易內完成；
+            # 並行的 record_quiz_attempts 會等待重建提交後才套用增量
+            conn.execute(text("""
+                INSERT INTO user_concept_mastery_state (user_email, rebuilt_at)
+                VALUES (:user_email, :rebuilt_at)
+                ON DUPLICATE KEY UPDATE rebuilt_at = VALUES(rebuilt_at)
+            """), {'user_email': user_email, 'rebuilt_at': datetime.now()})
+            answers = conn.execute(text("""
+                SELECT mongodb_question_id, is_correct, answer_time_seconds, created_at
+                FROM quiz_answers
+                WHERE user_email = :user_email
+            """), {'user_email': user_email}).fetchall()
+
+            rows = _fold_attempts(user_email, [
+                {
+                    'question_id': answer.mongodb_question_id,
+                    'is_correct': answer.is_correct,
+                    'time_spent': answer.answer_time_seconds,
+                    'attempt_time': answer.created_at
+                }
+                for answer in answers if answer.created_at
+            ])
+
+            conn.execute(text("DELETE FROM user_concept_mastery WHERE user_email = :user_email"),
+                         {'user_email': user_email})
+            if rows:
+                conn.execute(_UPSERT_MASTERY_SQL, rows)
+        print(f"✅ 已重建 {user_email} 的概念掌握度（{len(answers)} 筆作答，{len(rows)} 筆統計）")
+        return True
+    except Exception as e:
+        print(f"❌ 重建概念掌握度失敗: {e}")
+        return False
+
+
+def get_user_concept_mastery(user_email: str) -> List[Dict[str, Any]]:
+    """獲取學生的概念掌握度統計列（尚未重建過時先由作答歷史重建）"""
+    try:
+        with sqldb.engine.connect() as conn:
+            rebuilt = conn.execute(text("""
+                SELECT 1 FROM user_concept_mastery_state WHERE user_email = :user_email
+            """), {'user_email': user_email}).fetchone()
+        if not rebuilt:
+            rebuild_user_mastery(user_email)
+
+        with sqldb.engine.connect() as conn:
+            result = conn.execute(text("""
+                SELECT domain_name, micro_concept_id, difficulty, attempt_count, correct_count,
+                       weighted_correct, weighted_total, decay_rate, total_time_seconds,
+                       first_attempt_at, last_attempt_at, last_correct_at
+                FROM user_concept_mastery
+                WHERE user_email = :user_email
+            """), {'user_email': user_email}).fetchall()
+    except Exception as e:
+        print(f"❌ 獲取概念掌握度失敗: {e}")
+        return []
+
+    now = datetime.now()
+    rows = []
+    for row in result:
+        days_since = max((now - row.last_attempt_at).total_seconds(), 0) / 86400
+        decay = math.exp(-row.decay_rate * days_since)
+        rows.append({
+            'domain_name': row.domain_name,
+            'micro_concept_id': row.micro_concept_id,
+            'difficulty': row.difficulty,
+            'attempt_count': row.attempt_count,
+            'correct_count': row.correct_count,
+            'mastery': row.correct_count / row.attempt_count if row.attempt_count else 0,
+            # 以遺忘曲線衰減至現在的掌握度
+            'weighted_mastery': row.weighted_correct / row.weighted_total if row.weighted_total else 0,
+            'current_mastery': (row.weighted_correct / row.weighted_total) * decay if row.weighted_total else 0,
+            'decay_rate': row.decay_rate,
+            'days_since_practice': int(days_since),
+            'total_time_seconds': row.total_time_seconds,
+            'first_attempt_at': row.first_attempt_at,
+            'last_attempt_at': row.last_attempt_at,
+            'last_correct_at': row.last_correct_at
+        })
+    return rows
+
+
+def summarize_mastery_by_domain(mastery_rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    將統計列依領域彙總
+
+    返回：
+    - {領域名稱: {'total', 'correct', 'wrong', 'difficulty': {難度: {'total', 'correct'}},
+                  'concepts': {微概念ID: {'total', 'correct', 'wrong'}}}}
+    """
+    summary = defaultdict(lambda: {
+        'total': 0, 'correct': 0, 'wrong': 0,
+        'difficulty': defaultdict(lambda: {'total': 0, 'correct': 0}),
+        'concepts': defaultdict(lambda: {'total': 0, 'correct': 0, 'wrong': 0})
+    })
+    for row in mastery_rows:
+        total = row['attempt_count']
+        correct = row['correct_count']
+        domain = summary[row['domain_name']]
+        domain['total'] += total
+        domain['correct'] += correct
+        domain['wrong'] += total - correct
+        domain['difficulty'][row['difficulty']]['total'] += total
+        domain['difficulty'][row['difficulty']]['correct'] += correct
+        concept_id = row['micro_concept_id']
+        if concept_id and concept_id != 'None':
+            domain['concepts'][concept_id]['total'] += total
+            domain['concepts'][concept_id]['correct'] += correct
+            domain['concepts'][concept_id]['wrong'] += total - correct
+    return summary
+
+
+def calculate_overall_mastery(mastery_rows: List[Dict[str, Any]]) -> float:
+    """整體掌握度：各統計列依遺忘曲線衰減至現在的掌握度，以作答次數加權平均（涵蓋全部作答歷史）"""
+    total_attempts = sum(row['attempt_count'] for row in mastery_rows)
+    if not total_attempts:
+        return 0
+    return round(sum(row['current_mastery'] * row['attempt_count'] for row in mastery_rows) / total_attempts, 3)
@@ -17,7 +17,7 @@ import jwt
 from flask import current_app
 import uuid
 from accessories import mail, redis_client, save_json_to_mongo
-from src.api import get_user_info, verify_token
+from src.api import get_user_info, verify_token, invalidate_user_cache
 import threading
 import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
@@ -53,6 +53,9 @@ def init_calendar_tables():
             conn.commit()        
     except Exception as e:
         print(f"初始化行事曆資料表失敗: {e}")
+    
+    # 舊版 List 格式的通知搬移到排程
+    migrate_legacy_notifications()
 
 
 
@@ -148,6 +151,7 @@ def update_user_info():
             {"email": user_email},
             {"$set": update_data}
         )
+        invalidate_user_cache(user_email)
         
         if result.matched_count == 0:
             return jsonify({'message': '找不到用戶資料'}), 404
@@ -359,6 +363,93 @@ def delete_calendar_event():
 
 
 
+# ==================== 行事曆通知（Redis Sorted Set） ====================
+# 通知以 event_id 為成員、提醒時間戳為分數存入 Sorted Set，內容另存於 Hash。
+# 排程每分鐘只以 ZRANGEBYSCORE 取出到期的通知，新增 / 刪除皆為 O(log N)，
+# 不再走訪整個通知列表。
+
+NOTIFICATION_SCHEDULE_KEY = 'event_notifications:schedule'
+NOTIFICATION_PAYLOAD_KEY = 'event_notifications:payload'
+# 舊版以 List 儲存的通知 key（啟動時自動遷移）
+LEGACY_NOTIFICATION_KEY = 'event_notification'
+# 允許的通知時間誤差（秒），超過此時間仍未發送的通知視為過期
+NOTIFICATION_WINDOW_SECONDS = 300
+# 單次排程最多取出的通知數
+NOTIFICATION_CLAIM_BATCH = 200
+
+# 原子地取出並移除到期通知；過期（早於誤差範圍）的通知直接丟棄
+_CLAIM_DUE_NOTIFICATIONS_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[3]))
+local payloads = {}
+for i = 1, #due, 2 do
+    local member = due[i]
+    local score = tonumber(due[i + 1])
+    redis.call('ZREM', KEYS[1], member)
+    local payload = redis.call('HGET', KEYS[2], member)
+    redis.call('HDEL', KEYS[2], member)
+    if payload and score >= tonumber(ARGV[2]) then
+        table.insert(payloads, payload)
+    end
+end
+return payloads
+"""
+_claim_due_script = None
+
+
+def _parse_notify_time(notify_time_str: str) -> float:
+    """將 'YYYY-MM-DD HH:MM' 轉為時間戳（本地時間）"""
+    return datetime.strptime(notify_time_str, '%Y-%m-%d %H:%M').timestamp()
+
+
+def schedule_notification(notification_data: dict):
+    """將通知寫入排程（同一事件重複寫入時覆蓋原本的通知）"""
+    member = str(notification_data['event_id'])
+    pipe = redis_client.pipeline()
+    pipe.hset(NOTIFICATION_PAYLOAD_KEY, member, json.dumps(notification_data))
+    pipe.zadd(NOTIFICATION_SCHEDULE_KEY, {member: _parse_notify_time(notification_data['notify_time'])})
+    pipe.execute()
+
+
+def claim_due_notifications(now: datetime = None) -> list:
+    """原子地取出所有到期通知（取出後即從排程移除，多個排程實例不會重複發送）"""
+    global _claim_due_script
+    if _claim_due_script is None:
+        _claim_due_script = redis_client.register_script(_CLAIM_DUE_NOTIFICATIONS_LUA)
+    
+    now_ts = (now or datetime.now()).timestamp()
+    payloads = _claim_due_script(
+        keys=[NOTIFICATION_SCHEDULE_KEY, NOTIFICATION_PAYLOAD_KEY],
+        args=[now_ts + NOTIFICATION_WINDOW_SECONDS, now_ts - NOTIFICATION_WINDOW_SECONDS, NOTIFICATION_CLAIM_BATCH]
+    )
+    notifications = []
+    for payload in payloads:
+        try:
+            notifications.append(json.loads(payload))
+        except json.JSONDecodeError:
+            continue
+    return notifications
+
+
+def migrate_legacy_notifications() -> int:
+    """將舊版 List 中的通知搬移到 Sorted Set，返回搬移數量"""
+    migrated = 0
+    try:
+        for notification in redis_client.lrange(LEGACY_NOTIFICATION_KEY, 0, -1):
+            try:
+                data = json.loads(notification)
+                if data.get('event_id') is not None and data.get('notify_time'):
+                    schedule_notification(data)
+                    migrated += 1
+            except (json.JSONDecodeError, ValueError):
+                continue
+        redis_client.delete(LEGACY_NOTIFICATION_KEY)
+        if migrated:
+            print(f"✅ 已遷移 {migrated} 筆行事曆通知到排程")
+    except Exception as e:
+        print(f"遷移行事曆通知失敗: {e}")
+    return migrated
+
+
 def setup_event_notification(student_email: str, event_id: int, title: str, content: str, event_date: str, user_id: str = None):
     """設置事件通知到 Redis"""
     from datetime import datetime, timedelta
@@ -379,11 +470,10 @@ def setup_event_notification(student_email: str, event_id: int, title: str, cont
         'notify_time': notify_time_str
     }
     
-    # 使用 Redis List 儲存通知
-    redis_client.lpush('event_notification', json.dumps(notification_data))
+    schedule_notification(notification_data)
 
 def add_notification_to_redis(student_email: str, event_id: int, title: str, content: str, event_date: str, notify_time: str):
-    """將通知加入 Redis 列表"""
+    """將通知加入 Redis 排程"""
     from datetime import datetime
     # 直接使用前端傳來的時間格式，確保只取到分鐘
     notify_datetime = datetime.fromisoformat(notify_time.replace('Z', ''))
@@ -398,23 +488,16 @@ def add_notification_to_redis(student_email: str, event_id: int, title: str, con
         'notify_time': notify_time_str
     }
     
-    # 使用 Redis List 儲存通知
-    redis_client.lpush('event_notification', json.dumps(notification_data))
+    schedule_notification(notification_data)
 
 
 def remove_notification_from_redis(event_id: int):
-    """從 Redis 列表移除通知"""
-    # 獲取所有通知
-    notifications = redis_client.lrange('event_notification', 0, -1)
-    for notification in notifications:
-        try:
-            data = json.loads(notification)
-            if data.get('event_id') == event_id:
-                # 移除這個通知
-                redis_client.lrem('event_notification', 1, notification)
-                break
-        except json.JSONDecodeError:
-            continue
+    """從 Redis 排程移除通知"""
+    member = str(event_id)
+    pipe = redis_client.pipeline()
+    pipe.zrem(NOTIFICATION_SCHEDULE_KEY, member)
+    pipe.hdel(NOTIFICATION_PAYLOAD_KEY, member)
+    pipe.execute()
 
 # 移除自動初始化，改為在應用程式啟動時初始化
 
@@ -673,6 +756,116 @@ def get_recent_activities():
         return jsonify({'error': str(e)}), 500
 
 
+def perform_daily_checkin(user_email: str, user_name: str) -> dict:
+    """
+    執行每日簽到（網站與 LINE Bot 共用）
+
+    返回：
+    - already_checked: 今日是否已簽到過
+    - checkin_time: 簽到時間
+    - checkin_streak: 連續簽到天數（本次新簽到時提供）
+    - message: 提示訊息
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    
+    # 使用 Redis 檢查今日是否已簽到
+    checkin_key = f'checkin:{user_email}:{today}'
+    already_checked = redis_client.exists(checkin_key)
+    
+    if already_checked:
+        # 已簽到，返回簽到信息
+        checkin_data = redis_client.get(checkin_key)
+        checkin_info = json.loads(checkin_data) if checkin_data else {}
+        return {
+            'already_checked': True,
+            'checkin_time': checkin_info.get('checkin_time'),
+            'message': '今日已簽到'
+        }
+    
+    # 執行簽到
+    checkin_time = datetime.now().isoformat()
+    
+    # 1. 保存到 Redis
+    redis_client.setex(checkin_key, 86400, json.dumps({
+        'user_email': user_email,
+        'user_name': user_name,
+        'checkin_time': checkin_time,
+        'date': today
+    }))
+    
+    # 2. 更新 MongoDB user 簽到記錄
+    # 獲取或創建用戶的簽到統計
+    user = mongo.db.user.find_one({'email': user_email})
+    
+    if user:
+        last_checkin_date = user.get('last_checkin_date', '')
+        checkin_streak = user.get('checkin_streak', 0)
+        
+        # 計算連續簽到天數
+        if last_checkin_date == today:
+            # 今天已經簽到過了（理論上不會發生，因為 Redis 已檢查）
+            new_streak = checkin_streak
+        else:
+            # 檢查是否連續簽到
+            yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+            if last_checkin_date == yesterday:
+                # 連續簽到
+                new_streak = checkin_streak + 1
+            else:
+                # 中斷了，重新開始
+                new_streak = 1
+        
+        # 更新簽到統計
+        mongo.db.user.update_one(
+            {'email': user_email},
+            {
+                '$set': {
+                    'last_checkin_date': today,
+                    'checkin_streak': new_streak,
+                    'total_checkin_days': user.get('total_checkin_days', 0) + 1
+                }
+            }
+        )
+    else:
+        # 新用戶，創建簽到記錄
+        new_streak = 1
+        mongo.db.user.update_one(
+            {'email': user_email},
+            {
+                '$set': {
+                    'last_checkin_date': today,
+                    'checkin_streak': new_streak,
+                    'total_checkin_days': 1
+                }
+            },
+            upsert=True
+        )
+    
+    return {
+        'already_checked': False,
+        'checkin_time': checkin_time,
+        'checkin_streak': new_streak,
+        'message': '簽到成功'
+    }
+
+def checkin_for_linebot(line_id: str) -> str:
+    """LINE Bot 專用的每日簽到函數"""
+    try:
+        # 通過 line_id 找到用戶
+        user = mongo.db.user.find_one({"lineId": line_id})
+        if not user:
+            return "❌ 請先綁定您的帳號才能使用簽到功能！"
+        
+        user_name = user.get('name', '同學')
+        result = perform_daily_checkin(user.get('email'), user_name)
+        if result['already_checked']:
+            return f"✅ {user_name}，您今天已經簽到過了！\n🕒 簽到時間：{str(result.get('checkin_time', ''))[11:16]}"
+        return f"🎉 {user_name}，簽到成功！\n🔥 已連續簽到 {result['checkin_streak']} 天，繼續保持！"
+        
+    except Exception as e:
+        print(f"❌ LINE Bot 簽到失敗: {e}")
+        return "簽到功能暫時無法使用，請稍後再試。"
+
 @dashboard_bp.route('/daily-checkin', methods=['POST', 'OPTIONS'])
 @cross_origin()
 def daily_checkin():
@@ -689,92 +882,9 @@ def daily_checkin():
         user_email = get_user_info(token, 'email')
         user_name = get_user_info(token, 'name')
         
-        today = datetime.now().strftime('%Y-%m-%d')
-        
-        # 使用 Redis 檢查今日是否已簽到
-        checkin_key = f'checkin:{user_email}:{today}'
-        already_checked = redis_client.exists(checkin_key)
-        
-        if already_checked:
-            # 已簽到，返回簽到信息
-            checkin_data = redis_client.get(checkin_key)
-            checkin_info = json.loads(checkin_data) if checkin_data else {}
-            
-            refreshed_token = refresh_token(token)
-            return jsonify({
-                'token': refreshed_token,
-                'already_checked': True,
-                'checkin_time': checkin_info.get('checkin_time'),
-                'message': '今日已簽到'
-            })
-        
-        # 執行簽到
-        checkin_time = datetime.now().isoformat()
-        
-        # 1. 保存到 Redis
-        redis_client.setex(checkin_key, 86400, json.dumps({
-            'user_email': user_email,
-            'user_name': user_name,
-            'checkin_time': checkin_time,
-            'date': today
-        }))
-        
-        # 2. 更新 MongoDB user 簽到記錄
-        # 獲取或創建用戶的簽到統計
-        user = mongo.db.user.find_one({'email': user_email})
-        
-        if user:
-            last_checkin_date = user.get('last_checkin_date', '')
-            checkin_streak = user.get('checkin_streak', 0)
-            
-            # 計算連續簽到天數
-            if last_checkin_date == today:
-                # 今天已經簽到過了（理論上不會發生，因為 Redis 已檢查）
-                new_streak = checkin_streak
-            else:
-                # 檢查是否連續簽到
-                yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-                if last_checkin_date == yesterday:
-                    # 連續簽到
-                    new_streak = checkin_streak + 1
-                else:
-                    # 中斷了，重新開始
-                    new_streak = 1
-            
-            # 更新簽到統計
-            mongo.db.user.update_one(
-                {'email': user_email},
-                {
-                    '$set': {
-                        'last_checkin_date': today,
-                        'checkin_streak': new_streak,
-                        'total_checkin_days': user.get('total_checkin_days', 0) + 1
-                    }
-                }
-            )
-        else:
-            # 新用戶，創建簽到記錄
-            new_streak = 1
-            mongo.db.user.update_one(
-                {'email': user_email},
-                {
-                    '$set': {
-                        'last_checkin_date': today,
-                        'checkin_streak': new_streak,
-                        'total_checkin_days': 1
-                    }
-                },
-                upsert=True
-            )
-        
+        result = perform_daily_checkin(user_email, user_name)
         refreshed_token = refresh_token(token)
-        return jsonify({
-            'token': refreshed_token,
-            'already_checked': False,
-            'checkin_time': checkin_time,
-            'checkin_streak': new_streak,
-            'message': '簽到成功'
-        })
+        return jsonify({'token': refreshed_token, **result})
     
     except Exception as e:
         print(f"❌ 簽到失敗: {e}")
@@ -828,8 +938,8 @@ def get_checkin_status():
         return jsonify({'error': str(e)}), 500
 
 
-def get_calendar_for_linebot(line_id: str) -> str:
-    """LINE Bot 專用的行事曆查看函數"""
+def get_calendar_for_linebot(line_id: str, today_only: bool = False) -> str:
+    """LINE Bot 專用的行事曆查看函數（today_only=True 時只列出今天的事件）"""
     try:
         # 通過 line_id 找到用戶
         user = mongo.db.user.find_one({"lineId": line_id})
@@ -841,10 +951,11 @@ def get_calendar_for_linebot(line_id: str) -> str:
         
         # 獲取行事曆數據
         with sqldb.engine.connect() as conn:
-            result = conn.execute(text("""
+            today_filter = "AND DATE(event_date) = CURDATE()" if today_only else ""
+            result = conn.execute(text(f"""
                 SELECT id, title, content, event_date, notify_enabled 
                 FROM schedule 
-                WHERE student_email = :email 
+                WHERE student_email = :email {today_filter}
                 ORDER BY event_date ASC 
                 LIMIT 10
             """), {"email": user_email})
@@ -860,7 +971,7 @@ def get_calendar_for_linebot(line_id: str) -> str:
                 })
         
         if events:
-            calendar_text = f"您的行事曆事件 - {user_name}\n\n"
+            calendar_text = f"您今天的行事曆事件 - {user_name}\n\n" if today_only else f"您的行事曆事件 - {user_name}\n\n"
             for i, event in enumerate(events, 1):
                 title = event.get('title', '無標題')
                 event_date = event.get('event_date', '')
@@ -899,6 +1010,8 @@ def get_calendar_for_linebot(line_id: str) -> str:
             calendar_text += "\n💡 提示：每個事件都有唯一的 ID，請記住要操作的 ID 號碼\n"
             calendar_text += "\n📱 目前顯示最新 10 筆事件\n"
             calendar_text += "如需查看更多事件，請至網站查看完整行事曆"
+        elif today_only:
+            calendar_text = f"您今天沒有安排任何事件 - {user_name}\n\n使用「新增事件:標題|內容|日期時間」來新增學習計畫！"
         else:
             calendar_text = f"您的行事曆目前沒有事件 - {user_name}\n\n使用「新增事件:標題|內容|日期時間」來新增您的第一個學習計畫！"
         
@@ -0,0 +1,197 @@
+"""
+題庫目錄查詢 - 游標分頁、伺服器端篩選、欄位投影與串流輸出
+"""
+import json
+from typing import Any, Dict, Iterator, List, Optional
+from bson import ObjectId
+from flask import Response, jsonify, stream_with_context
+from accessories import mongo
+from src.question_images import get_image_base64, get_question_image_url, inline_images_requested
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# 串流時每批從 MongoDB 取回的文件數
+STREAM_BATCH_SIZE = 200
+
+# 輸出欄位 -> exam 文件欄位
+CATALOGUE_FIELDS: Dict[str, str] = {
+    'id': '_id',
+    'type': 'type',
+    'school': 'school',
+    'department': 'department',
+    'year': 'year',
+    'question_number': 'question_number',
+    'question_text': 'question_text',
+    'options': 'options',
+    'answer': 'answer',
+    'answer_type': 'answer_type',
+    'image_file': 'image_file',
+    'detail-answer': 'detail-answer',
+    'key_points': 'key-points',
+    'difficulty level': 'difficulty level',
+    'images': 'image_file'
+}
+# 原本 /get-exam 回傳的欄位（未指定 fields 時使用）
+LEGACY_FIELDS = [field for field in CATALOGUE_FIELDS if field != 'id']
+
+# 篩選參數 -> exam 文件欄位
+FILTER_FIELDS: Dict[str, str] = {
+    'school': 'school',
+    'year': 'year',
+    'department': 'department',
+    'type': 'type',
+    'key_point': 'key-points'
+}
+
+
+def build_exam_filter(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """將篩選參數轉為 MongoDB 查詢（值為陣列時以 $in 比對）"""
+    query: Dict[str, Any] = {}
+    for param, field in FILTER_FIELDS.items():
+        value = (filters or {}).get(param)
+        if value in (None, '', []):
+            continue
+        query[field] = {'$in': value} if isinstance(value, list) else value
+    return query
+
+
+def parse_fields(fields: Any, default: List[str]) -> List[str]:
+    """解析要回傳的欄位（逗號分隔字串或陣列），忽略未知欄位"""
+    if not fields:
+        return default
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    selected = [field.strip() for field in fields if field and field.strip() in CATALOGUE_FIELDS]
+    return selected or default
+
+
+def _projection(fields: List[str]) -> Dict[str, int]:
+    projection = {CATALOGUE_FIELDS[field]: 1 for field in fields}
+    projection['_id'] = 1
+    return projection
+
+
+def _image_entries(image_files: Any, inline_images: bool) -> List[Dict[str, str]]:
+    """題目圖片引用（相容模式時附上 base64）"""
+    if isinstance(image_files, str):
+        image_files = [image_files]
+    entries = []
+    for image_filename in image_files or []:
+        image_url = get_question_image_url(image_filename)
+        if not image_url:
+            continue
+        entry = {'filename': image_filename, 'url': image_url}
+        if inline_images:
+            entry['data'] = get_image_base64(image_filename)
+        entries.append(entry)
+    return entries
+
+
+def serialize_exam(exam: Dict[str, Any], fields: List[str], inline_images: bool = False,
+                   key_points_as_text: bool = True) -> Dict[str, Any]:
+    """
+    將 exam 文件轉為目錄輸出格式
+
+    參數：
+    - key_points_as_text: 知識點陣列是否合併為逗號分隔字串
+    """
+    item: Dict[str, Any] = {}
+    for field in fields:
+        if field == 'id':
+            item['id'] = str(exam['_id'])
+        elif field == 'images':
+            # 與原本相同：只有題目帶圖片時才有 images 欄位
+            if exam.get('image_file'):
+                item['images'] = _image_entries(exam.get('image_file'), inline_images)
+        elif field == 'key_points' and key_points_as_text:
+            key_points = exam.get('key-points', [])
+            item['key_points'] = ', '.join(key_points) if isinstance(key_points, list) else key_points
+        else:
+            item[field] = exam.get(CATALOGUE_FIELDS[field])
+    return item
+
+
+def fetch_exam_page(filters: Optional[Dict[str, Any]], cursor: Optional[str], limit: int,
+                    fields: List[str], key_points_as_text: bool = True) -> Dict[str, Any]:
+    """
+    取得一頁題目（依 _id 遞增）
+
+    返回：
+    - {'exams', 'next_cursor', 'has_more'}
+    """
+    query = build_exam_filter(filters)
+    if cursor:
+        query['_id'] = {'$gt': ObjectId(cursor)}
+    docs = list(mongo.db.exam.find(query, _projection(fields)).sort('_id', 1).limit(limit + 1))
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    inline_images = inline_images_requested()
+    return {
+        'exams': [serialize_exam(doc, fields, inline_images, key_points_as_text) for doc in docs],
+        'next_cursor': str(docs[-1]['_id']) if has_more else None,
+        'has_more': has_more
+    }
+
+
+def iter_exams(filters: Optional[Dict[str, Any]], fields: List[str],
+               key_points_as_text: bool = True) -> Iterator[Dict[str, Any]]:
+    """依 _id 順序逐筆產生符合條件的題目（MongoDB 游標分批讀取）"""
+    inline_images = inline_images_requested()
+    docs = mongo.db.exam.find(build_exam_filter(filters), _projection(fields)).sort('_id', 1)
+    for doc in docs.batch_size(STREAM_BATCH_SIZE):
+        yield serialize_exam(doc, fields, inline_images, key_points_as_text)
+
+
+def _stream_json_list(items: Iterator[Dict[str, Any]], envelope: Dict[str, Any]) -> Iterator[str]:
+    """以串流輸出 {..envelope, "exams": [...]}，不在記憶體中組出整份清單"""
+    head = json.dumps(envelope, ensure_ascii=False)[:-1]
+    yield (head + ', ' if envelope else '{') + '"exams": ['
+    for index, item in enumerate(items):
+        yield (',' if index else '') + json.dumps(item, ensure_ascii=False)
+    yield ']}'
+
+
+def _stream_ndjson(items: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    for item in items:
+        yield json.dumps(item, ensure_ascii=False) + '\n'
+
+
+def exam_catalogue_response(params: Dict[str, Any], token: Optional[str] = None,
+                            key_points_as_text: bool = True):
+    """
+    依請求參數產生題庫目錄回應
+
+    參數（請求 JSON）：
+    - limit / cursor: 分頁大小與上一頁的 next_cursor；任一存在時使用分頁模式
+    - filters: {'school', 'year', 'department', 'type', 'key_point'}，值可為字串或陣列
+    - fields: 要回傳的欄位
+    - format: 'ndjson' 時逐行串流
+    - token: 放入回應的新 token（None 時不放）
+
+    返回：
+    - Flask 回應；參數錯誤時返回 400
+    """
+    filters = params.get('filters') or {}
+    cursor = params.get('cursor')
+    if cursor and not ObjectId.is_valid(cursor):
+        return jsonify({'message': '無效的 cursor'}), 400
+    envelope = {'token': token} if token is not None else {}
+
+    if params.get('format') == 'ndjson':
+        fields = parse_fields(params.get('fields'), ['id'] + LEGACY_FIELDS)
+        headers = {'X-Refresh-Token': token, 'Access-Control-Expose-Headers': 'X-Refresh-Token'} if token else {}
+        return Response(stream_with_context(_stream_ndjson(iter_exams(filters, fields, key_points_as_text))),
+                        mimetype='application/x-ndjson', headers=headers)
+
+    if params.get('limit') is not None or cursor:
+        try:
+            limit = min(max(int(params.get('limit') or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+        except (TypeError, ValueError):
+            return jsonify({'message': '無效的 limit'}), 400
+        fields = parse_fields(params.get('fields'), ['id'] + LEGACY_FIELDS)
+        page = fetch_exam_page(filters, cursor, limit, fields, key_points_as_text)
+        return jsonify({**envelope, **page}), 200
+
+    fields = parse_fields(params.get('fields'), LEGACY_FIELDS)
+    return Response(stream_with_context(_stream_json_list(iter_exams(filters, fields, key_points_as_text), envelope)),
+                    mimetype='application/json')
@@ -0,0 +1,161 @@
+"""
+題庫篩選索引（facet）- 以 MongoDB 聚合計算篩選選項並快取於 Redis
+"""
+import json
+from typing import Any, Dict, Iterable, Optional
+import redis
+from accessories import mongo, redis_client
+
+EXAM_FACETS_KEY = 'exam_facets:v1'
+# 快取保存時間（秒），作為漏掉失效通知時的保險
+EXAM_FACETS_TTL_SECONDS = 24 * 3600
+# 增量更新遇到並行寫入時的重試次數
+MAX_MERGE_RETRIES = 3
+
+# 不列入知識點篩選的值
+EXCLUDED_SUBJECTS = ['其他']
+_EMPTY_VALUES = [None, '']
+
+
+def _facet_pipeline():
+    """計算所有 facet 的聚合管線"""
+    not_empty = {'$nin': _EMPTY_VALUES}
+    return [
+        {'$project': {'_id': 0, 'school': 1, 'department': 1, 'year': 1, 'key-points': 1, 'key_points': 1}},
+        {'$facet': {
+            'schools': [{'$match': {'school': not_empty}}, {'$group': {'_id': '$school'}}],
+            'departments': [{'$match': {'department': not_empty}}, {'$group': {'_id': '$department'}}],
+            'years': [{'$match': {'year': not_empty}}, {'$group': {'_id': {'$toString': '$year'}}}],
+            # $unwind 對字串欄位視為單一元素陣列，與原本「陣列或字串」的處理一致
+            'subjects': [
+                {'$unwind': '$key-points'},
+                {'$match': {'key-points': {'$nin': _EMPTY_VALUES + EXCLUDED_SUBJECTS}}},
+                {'$group': {'_id': '$key-points', 'count': {'$sum': 1}}}
+            ],
+            'school_year_dept': [
+                {'$match': {'school': not_empty, 'year': not_empty, 'department': not_empty}},
+                {'$group': {
+                    '_id': {'school': '$school', 'year': {'$toString': '$year'}, 'department': '$department'},
+                    'count': {'$sum': 1}
+                }}
+            ],
+            # /materials/key_points 使用的 key_points 欄位
+            'key_points': [
+                {'$unwind': '$key_points'},
+                {'$match': {'key_points': {'$ne': None}}},
+                {'$group': {'_id': '$key_points'}}
+            ]
+        }}
+    ]
+
+
+def compute_exam_facets() -> Dict[str, Any]:
+    """以聚合管線重新計算所有 facet"""
+    result = next(mongo.db.exam.aggregate(_facet_pipeline(), allowDiskUse=True), {})
+    return {
+        'schools': sorted(row['_id'] for row in result.get('schools', [])),
+        'departments': sorted(row['_id'] for row in result.get('departments', [])),
+        'years': sorted(row['_id'] for row in result.get('years', [])),
+        'subjects': sorted(row['_id'] for row in result.get('subjects', [])),
+        'subject_counts': {row['_id']: row['count'] for row in result.get('subjects', [])},
+        'school_year_dept_counts': {
+            f"{row['_id']['school']}|{row['_id']['year']}|{row['_id']['department']}": row['count']
+            for row in result.get('school_year_dept', [])
+        },
+        'key_points': sorted(row['_id'] for row in result.get('key_points', []))
+    }
+
+
+def get_exam_facets() -> Dict[str, Any]:
+    """讀取 facet（快取未命中時重新計算並寫入 Redis）"""
+    try:
+        cached = redis_client.get(EXAM_FACETS_KEY)
+        if cached:
+            return json.loads(cached)
+    except Exception as e:
+        print(f"⚠️ 讀取題庫篩選快取失敗: {e}")
+
+    facets = compute_exam_facets()
+    try:
+        redis_client.setex(EXAM_FACETS_KEY, EXAM_FACETS_TTL_SECONDS, json.dumps(facets, ensure_ascii=False))
+    except Exception as e:
+        print(f"⚠️ 寫入題庫篩選快取失敗: {e}")
+    return facets
+
+
+def _add_sorted(values: list, value: Any):
+    if value not in values:
+        values.append(value)
+        values.sort()
+
+
+def _merge_exam(facets: Dict[str, Any], exam: Dict[str, Any]):
+    """將一道新題目合併進 facet（規則與聚合管線相同）"""
+    school, department, year = exam.get('school'), exam.get('department'), exam.get('year')
+    if school not in _EMPTY_VALUES:
+        _add_sorted(facets['schools'], school)
+    if department not in _EMPTY_VALUES:
+        _add_sorted(facets['departments'], department)
+    if year not in _EMPTY_VALUES:
+        _add_sorted(facets['years'], str(year))
+
+    subjects = exam.get('key-points')
+    for subject in subjects if isinstance(subjects, list) else [subjects]:
+        if subject in _EMPTY_VALUES or subject in EXCLUDED_SUBJECTS:
+            continue
+        _add_sorted(facets['subjects'], subject)
+        facets['subject_counts'][subject] = facets['subject_counts'].get(subject, 0) + 1
+
+    if school not in _EMPTY_VALUES and year not in _EMPTY_VALUES and department not in _EMPTY_VALUES:
+        combo = f"{school}|{year}|{department}"
+        facets['school_year_dept_counts'][combo] = facets['school_year_dept_counts'].get(combo, 0) + 1
+
+    key_points = exam.get('key_points')
+    for key_point in key_points if isinstance(key_points, list) else [key_points]:
+        if key_point is not None:
+            _add_sorted(facets['key_points'], key_point)
+
+
+def record_new_exams(exams: Iterable[Dict[str, Any]]):
+    """
+    新增題目後增量更新 facet 快取
+
+    快取不存在時不做任何事（下次讀取時會完整計算）；並行更新衝突時清除快取。
+    """
+    exams = list(exams)
+    if not exams:
+        return
+    try:
+        for _ in range(MAX_MERGE_RETRIES):
+            with redis_client.pipeline() as pipe:
+                try:
+                    pipe.watch(EXAM_FACETS_KEY)
+                    cached = pipe.get(EXAM_FACETS_KEY)
+                    if not cached:
+                        return
+                    facets = json.loads(cached)
+                    for exam in exams:
+                        _merge_exam(facets, exam)
+                    pipe.multi()
+                    pipe.setex(EXAM_FACETS_KEY, EXAM_FACETS_TTL_SECONDS, json.dumps(facets, ensure_ascii=False))
+                    pipe.execute()
+                    return
+                except redis.WatchError:
+                    continue
+        invalidate_exam_facets()
+    except Exception as e:
+        print(f"⚠️ 更新題庫篩選快取失敗，改為清除: {e}")
+        invalidate_exam_facets()
+
+
+def invalidate_exam_facets(client: Optional[redis.Redis] = None):
+    """清除 facet 快取（題目大量匯入、修改或刪除後呼叫）"""
+    try:
+        (client or redis_client).delete(EXAM_FACETS_KEY)
+    except Exception as e:
+        print(f"⚠️ 清除題庫篩選快取失敗: {e}")
+
+
+def invalidate_exam_facets_by_url(redis_url: str):
+    """供獨立執行的匯入工具使用（不經 Flask app）"""
+    invalidate_exam_facets(redis.Redis.from_url(redis_url))
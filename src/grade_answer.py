@@ -1,9 +1,11 @@
 import json
 import re
 import concurrent.futures
-from typing import List, Dict, Any, Tuple
-from tool.api_keys import get_api_key, get_api_keys_count
+import threading
+from typing import List, Dict, Any, Tuple, Callable, Optional
+from tool.api_keys import get_api_keys_count, lease_api_key
 from accessories import init_gemini
+from src.objective_grader import grade_objective_answer
 
 class AnswerGrader:
     """答案批改器 - 簡化版本"""
@@ -12,11 +14,59 @@ class AnswerGrader:
         # 初始化Gemini API
         self.model = init_gemini('gemini-2.5-flash')
     
-    def batch_grade_ai_questions(self, questions_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """批量評分AI題目 - 並行處理版本"""
+    def batch_grade_ai_questions(self, questions_data: List[Dict[str, Any]],
+                                 progress_callback: Optional[Callable[[int, int, str], None]] = None) -> List[Dict[str, Any]]:
+        """
+        批量評分題目 - 客觀題本地評分，其餘題目交由AI並行評分
+        
+        progress_callback(已完成題數, 總題數, 題目ID) 會在每題評分完成後被呼叫（可能來自工作執行緒）
+        """
         if not questions_data:
             return []
         
+        total_questions = len(questions_data)
+        completed = {'count': 0}
+        completed_lock = threading.Lock()
+        
+        def on_graded(question_id: str):
+            if not progress_callback:
+                return
+            with completed_lock:
+                completed['count'] += 1
+                done = completed['count']
+            try:
+                progress_callback(done, total_questions, question_id)
+            except Exception as e:
+                print(f"⚠️ 進度回報失敗: {e}")
+        
+        all_results = [None] * total_questions
+        ai_questions = []
+        ai_indices = []
+        
+        # 單選/多選/是非題直接以標準答案評分，無法確定解析者才送AI
+        for index, question_data in enumerate(questions_data):
+            local_result = grade_objective_answer(question_data)
+            if local_result:
+                all_results[index] = local_result
+                on_graded(local_result.get('question_id', ''))
+            else:
+                ai_questions.append(question_data)
+                ai_indices.append(index)
+        
+        local_count = len(questions_data) - len(ai_questions)
+        print(f"⚡ [本地評分] 客觀題本地評分 {local_count} 題，需AI評分 {len(ai_questions)} 題")
+        
+        if ai_questions:
+            ai_results = self._batch_grade_with_ai(ai_questions, on_graded)
+            for index, result in zip(ai_indices, ai_results):
+                all_results[index] = result
+        
+        # 過濾掉None值（如果有錯誤的話）
+        return [result for result in all_results if result is not None]
+    
+    def _batch_grade_with_ai(self, questions_data: List[Dict[str, Any]],
+                             on_graded: Optional[Callable[[str], None]] = None) -> List[Any]:
+        """AI並行評分 - 返回與輸入順序一致的結果（失敗者為 None）"""
         print(f"\n{'='*80}")
         print(f"🚀 [批量評分] 開始批量評分")
         print(f"{'='*80}")
@@ -55,14 +105,14 @@ class AnswerGrader:
                 questions_batch = questions_data[start_index:end_index]
                 batch_indices = list(range(start_index, end_index))  # 記錄原始索引
                 
-                print(f"   API 金鑰 {i+1}: 題目 {start_index+1}-{end_index} (共 {batch_size} 題)")
+                print(f"   批次 {i+1}: 題目 {start_index+1}-{end_index} (共 {batch_size} 題)")
                 
                 # 提交任務
                 future = executor.submit(
                     self._process_questions_batch, 
                     questions_batch, 
                     batch_indices,
-                    i
+                    on_graded
                 )
                 futures.append(future)
                 
@@ -88,19 +138,19 @@ class AnswerGrader:
                     import traceback
                     traceback.print_exc()
         
-        # 過濾掉None值（如果有錯誤的話）
-        final_results = [result for result in all_results if result is not None]
+        success_count = len([result for result in all_results if result is not None])
         
         print(f"\n{'='*80}")
         print(f"✅ 批量評分完成！")
-        print(f"   成功評分: {len(final_results)}/{total_questions} 題")
-        print(f"   失敗: {total_questions - len(final_results)} 題")
+        print(f"   成功評分: {success_count}/{total_questions} 題")
+        print(f"   失敗: {total_questions - success_count} 題")
         print(f"{'='*80}\n")
 
-        return final_results
+        return all_results
     
-    def _process_questions_batch(self, questions_batch: List[Dict], batch_indices: List[int], api_key_index: int) -> List[Dict]:
-        """處理一批題目（單個API金鑰）"""
+    def _process_questions_batch(self, questions_batch: List[Dict], batch_indices: List[int],
+                                 on_graded: Optional[Callable[[str], None]] = None) -> List[Dict]:
+        """處理一批題目（每題各自向排程器租用金鑰）"""
         results = []
         
         # 如果沒有題目，直接返回空結果
@@ -116,37 +166,40 @@ class AnswerGrader:
                 original_index = batch_indices[i]
                 question_id = question_data.get('question_id', 'Unknown')
                 
-                print(f"\n🔹 [API金鑰 {api_key_index+1}] 正在評分第 {original_index+1} 題 (ID: {question_id})")
-                
-                # 為這個批次創建專用的Gemini模型實例
-                batch_model = self._create_batch_model(api_key_index)
+                print(f"\n🔹 正在評分第 {original_index+1} 題 (ID: {question_id})")
                 
                 user_answer = question_data['user_answer']
                 question_type = question_data['question_type']
                 
-                is_correct, score, feedback = self._ai_grade_answer_with_model(
-                    batch_model,
-                    user_answer, 
-                    question_data.get('question_text', ''),
-                    question_data.get('correct_answer', ''),
-                    question_data.get('options', []),
-                    question_type
-                )
+                # 每題向排程器租用負載最低的健康金鑰，429/5xx 會讓該金鑰進入冷卻
+                with lease_api_key() as lease:
+                    batch_model = self._create_batch_model(lease.key)
+                    
+                    is_correct, score, feedback = self._ai_grade_answer_with_model(
+                        batch_model,
+                        user_answer, 
+                        question_data.get('question_text', ''),
+                        question_data.get('correct_answer', ''),
+                        question_data.get('options', []),
+                        question_type
+                    )
+                    # 評分函數會吞下例外並以 feedback['error'] 回報
+                    if isinstance(feedback, dict) and feedback.get('error'):
+                        lease.fail(feedback['error'])
                 
                 result = {
                     'question_id': question_data['question_id'],
                     'is_correct': is_correct,
                     'score': score,
                     'feedback': feedback,
-                    'original_index': original_index,  # 保持原始順序
-                    'api_key_used': api_key_index + 1  # 記錄使用的API金鑰
+                    'original_index': original_index  # 保持原始順序
                 }
                 results.append(result)
                 
                 print(f"   ✅ 題目 {original_index+1} 評分完成: {score} 分 ({'正確' if is_correct else '錯誤'})")
                 
             except Exception as e:
-                print(f"   ❌ API金鑰 {api_key_index+1} 評分題目 {batch_indices[i]+1} 失敗: {e}")
+                print(f"   ❌ 評分題目 {batch_indices[i]+1} 失敗: {e}")
                 import traceback
                 traceback.print_exc()
                 
@@ -156,44 +209,29 @@ class AnswerGrader:
                     'is_correct': False,
                     'score': 0,
                     'feedback': {'error': f'評分失敗: {str(e)}'},
-                    'original_index': batch_indices[i],
-                    'api_key_used': api_key_index + 1
+                    'original_index': batch_indices[i]
                 }
                 results.append(error_result)
+            
+            if on_graded:
+                on_graded(question_data.get('question_id', ''))
         
         print(f"\n{'─'*80}")
-        print(f"✅ [API 金鑰 {api_key_index+1}] 批次處理完成！成功 {len(results)} 題")
+        print(f"✅ 批次處理完成！成功 {len(results)} 題")
         print(f"{'─'*80}\n")
         
         return results
     
-    def _create_batch_model(self, api_key_index: int):
-        """為批次創建專用的Gemini模型實例"""
+    def _create_batch_model(self, api_key: str):
+        """獲取綁定指定API金鑰的Gemini模型實例"""
         try:
-            # 使用指定的API金鑰索引
-            api_key = self._get_api_key_by_index(api_key_index)
-            # 使用 accessories 中的 init_gemini 函數
-            model = init_gemini('gemini-2.5-flash')
+            # 使用 accessories 中的 init_gemini 函數，綁定此批次的金鑰（同金鑰共用 Client）
+            model = init_gemini('gemini-2.5-flash', api_key=api_key)
             return model
         except Exception as e:
             print(f"❌ 創建批次模型失敗: {e}")
             return self.model  # 回退到主模型
     
-    def _get_api_key_by_index(self, index: int) -> str:
-        """根據索引獲取特定的API金鑰"""
-        try:
-            from tool.api_keys import api_key_manager
-            # 獲取所有可用的API金鑰
-            all_keys = api_key_manager.api_keys
-            if 0 <= index < len(all_keys):
-                return all_keys[index]
-            else:
-                # 如果索引超出範圍，使用隨機選擇
-                return get_api_key()
-        except Exception as e:
-            print(f"⚠️ 獲取指定索引API金鑰失敗，使用隨機選擇: {e}")
-            return get_api_key()
-    
     def _describe_image(self, model, image_parts: List) -> str:
         """先讓 AI 詳細描述圖片內容"""
         try:
@@ -685,6 +723,7 @@ class AnswerGrader:
 # 創建全局實例
 grader = AnswerGrader()
 
-def batch_grade_ai_questions(questions_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def batch_grade_ai_questions(questions_data: List[Dict[str, Any]],
+                             progress_callback: Optional[Callable[[int, int, str], None]] = None) -> List[Dict[str, Any]]:
     """批量批改AI題目的便捷函數"""
-    return grader.batch_grade_ai_questions(questions_data)
+    return grader.batch_grade_ai_questions(questions_data, progress_callback)
@@ -0,0 +1,167 @@
+"""
+批改進度事件匯流排 - 以 Redis Stream 記錄批改進度事件，供 SSE 端點推送
+"""
+import json
+import time
+from typing import Any, Dict, Iterator, Optional
+from accessories import redis_client
+
+# 進度事件保留時間（秒）
+PROGRESS_TTL_SECONDS = 3600
+# 單一進度串流最多保留的事件數
+PROGRESS_STREAM_MAXLEN = 1000
+# SSE 心跳間隔（秒）
+HEARTBEAT_INTERVAL_SECONDS = 15
+# 單一 SSE 連線最長存活時間（秒），逾時後由前端自動重連續傳
+MAX_STREAM_SECONDS = 600
+
+# 批改流程階段數：1=試卷批改, 2=計算分數, 3=評判知識點, 4=生成學習計畫
+TOTAL_STAGES = 4
+
+
+def _stream_key(progress_id: str) -> str:
+    """獲取進度事件串流的 Redis key"""
+    return f"grading_progress:{progress_id}"
+
+
+def _decode(value: Any) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def publish_progress_event(progress_id: str, event: Dict[str, Any]) -> Optional[str]:
+    """寫入一筆進度事件，返回事件ID（Redis 不可用時返回 None，不影響批改流程）"""
+    if not progress_id:
+        return None
+    try:
+        event.setdefault('timestamp', time.time())
+        key = _stream_key(progress_id)
+        pipe = redis_client.pipeline()
+        pipe.xadd(key, {'data': json.dumps(event, ensure_ascii=False)},
+                  maxlen=PROGRESS_STREAM_MAXLEN, approximate=True)
+        pipe.expire(key, PROGRESS_TTL_SECONDS)
+        event_id, _ = pipe.execute()
+        return _decode(event_id)
+    except Exception as e:
+        print(f"⚠️ 發布批改進度失敗: {e}")
+        return None
+
+
+def update_progress_status(progress_id: str, is_completed: bool, current_stage: int, description: str,
+                           extra: Optional[Dict[str, Any]] = None):
+    """更新進度追蹤狀態（階段變更或完成），extra 會併入事件內容（例如完成時附上 result_id）"""
+    if is_completed:
+        event = {
+            'type': 'completion',
+            'message': description,
+            'current_stage': current_stage,
+            'stage_description': description,
+            'progress_percentage': 100,
+            'is_completed': True
+        }
+    else:
+        event = {
+            'type': 'progress_update',
+            'current_stage': current_stage,
+            'stage_description': description,
+            'progress_percentage': (current_stage / TOTAL_STAGES) * 100,
+            'is_completed': False
+        }
+    if extra:
+        event.update(extra)
+    publish_progress_event(progress_id, event)
+
+
+def publish_question_graded(progress_id: str, completed: int, total: int, question_id: str = ''):
+    """發布單題批改完成事件（進度落在第3階段區間內）"""
+    stage_start = (2 / TOTAL_STAGES) * 100
+    stage_span = (1 / TOTAL_STAGES) * 100
+    ratio = completed / total if total else 1
+    publish_progress_event(progress_id, {
+        'type': 'question_graded',
+        'current_stage': 3,
+        'stage_description': f'AI正在進行智能評分... ({completed}/{total})',
+        'completed_questions': completed,
+        'total_questions': total,
+        'question_id': question_id,
+        'progress_percentage': round(stage_start + stage_span * ratio, 1),
+        'is_completed': False
+    })
+
+
+def get_progress_status(progress_id: str) -> dict:
+    """獲取最新進度狀態"""
+    default_status = {
+        'current_stage': 1,  # 默認從第一階段開始
+        'is_completed': False,
+        'stage_description': '正在初始化...'
+    }
+    try:
+        entries = redis_client.xrevrange(_stream_key(progress_id), count=1)
+        if not entries:
+            return default_status
+        event_id, fields = entries[0]
+        status = json.loads(_decode(fields.get(b'data') or fields.get('data')))
+        status['event_id'] = _decode(event_id)
+        status['updated_at'] = status.get('timestamp')
+        return status
+    except Exception as e:
+        print(f"❌ 獲取進度狀態失敗: {e}")
+        return None
+
+
+def _format_sse(event: Dict[str, Any], event_id: Optional[str] = None) -> str:
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(event, ensure_ascii=False)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream_progress_events(progress_id: str, last_event_id: Optional[str] = None) -> Iterator[str]:
+    """
+    產生 SSE 事件流
+
+    參數：
+    - progress_id: 進度追蹤ID
+    - last_event_id: 前端最後收到的事件ID，提供時只推送其後的事件（斷線續傳）
+    """
+    yield _format_sse({'type': 'connected', 'message': '進度追蹤已連接', 'timestamp': time.time()})
+
+    key = _stream_key(progress_id)
+    cursor = last_event_id or '0'
+    deadline = time.time() + MAX_STREAM_SECONDS
+
+    try:
+        while time.time() < deadline:
+            response = redis_client.xread({key: cursor}, block=HEARTBEAT_INTERVAL_SECONDS * 1000, count=100)
+            if not response:
+                # 阻塞等待逾時：送出心跳註解保持連線
+                yield ': heartbeat\n\n'
+                continue
+
+            for _, entries in response:
+                for event_id, fields in entries:
+                    cursor = _decode(event_id)
+                    event = json.loads(_decode(fields.get(b'data') or fields.get('data')))
+                    yield _format_sse(event, cursor)
+                    if event.get('is_completed'):
+                        return
+    except Exception as e:
+        error_data = {
+            'type': 'error',
+            'message': f'進度追蹤錯誤: {str(e)}',
+            'timestamp': time.time()
+        }
+        yield _format_sse(error_data)
+
+
+def new_progress_id(user_email: str, requested_id: Optional[str] = None, prefix: str = 'progress') -> str:
+    """
+    產生進度追蹤ID
+
+    前端可預先產生 progress_id 並在送出前先訂閱 SSE，格式合法時直接沿用。
+    """
+    if isinstance(requested_id, str) and requested_id.startswith(f"{prefix}_") and len(requested_id) <= 200 \
+            and all(ch.isalnum() or ch in '_-.@' for ch in requested_id):
+        return requested_id
+    return f"{prefix}_{user_email}_{int(time.time())}"
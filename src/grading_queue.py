@@ -0,0 +1,183 @@
+"""
+批改工作佇列 - 將提交的作答排入 Redis 佇列，由獨立的批改 worker 執行批改
+"""
+import json
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+from flask import current_app, g, has_request_context, request
+from accessories import redis_client
+from src.grading_progress import publish_progress_event
+from src.redis_job_queue import RedisJobQueue, decode as _decode
+
+# 工作狀態保留時間（秒）
+JOB_TTL_SECONDS = 86400
+# 工作處理逾時（秒），超過視為 worker 已中斷，可重新排入佇列
+JOB_VISIBILITY_TIMEOUT_SECONDS = 900
+# 單一工作最多重試次數
+MAX_JOB_ATTEMPTS = 3
+
+grading_queue = RedisJobQueue('grading_jobs', JOB_VISIBILITY_TIMEOUT_SECONDS, '批改工作')
+
+# 工作類型 -> 批改函數 handler(user_email, submission, progress_id) -> dict
+_job_handlers: Dict[str, Callable[[str, Dict[str, Any], str], Dict[str, Any]]] = {}
+
+
+def register_job_handler(job_type: str, handler: Callable[[str, Dict[str, Any], str], Dict[str, Any]]):
+    """註冊批改工作處理函數（由各測驗模組在載入時註冊）"""
+    _job_handlers[job_type] = handler
+
+
+def _job_key(job_id: str) -> str:
+    """獲取批改工作的 Redis key"""
+    return f"grading_job:{job_id}"
+
+
+def is_async_grading_requested(data: Dict[str, Any]) -> bool:
+    """判斷本次提交是否使用非同步批改（請求參數優先，否則依設定 QUIZ_ASYNC_GRADING）"""
+    requested = data.get('async_grading')
+    if requested is None:
+        return bool(current_app.config.get('QUIZ_ASYNC_GRADING', False))
+    if isinstance(requested, str):
+        return requested.lower() in ('1', 'true', 'yes')
+    return bool(requested)
+
+
+def enqueue_grading_job(job_type: str, user_email: str, submission: Dict[str, Any], progress_id: str) -> Optional[str]:
+    """
+    將批改工作寫入佇列
+
+    返回：
+    - job_id；Redis 不可用時返回 None，由呼叫端改為同步批改
+    """
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    try:
+        key = _job_key(job_id)
+        pipe = redis_client.pipeline()
+        pipe.hset(key, mapping={
+            'job_id': job_id,
+            'job_type': job_type,
+            'user_email': user_email,
+            'progress_id': progress_id,
+            'status': 'queued',
+            'attempts': 0,
+            'payload': json.dumps(submission, ensure_ascii=False),
+            # worker 沒有請求上下文，記錄提交時的 API 網址供組成題目圖片等絕對 URL
+            'api_base_url': request.host_url if has_request_context() else '',
+            'created_at': now
+        })
+        pipe.expire(key, JOB_TTL_SECONDS)
+        grading_queue.push(job_id, pipe=pipe)
+        pipe.execute()
+    except Exception as e:
+        print(f"❌ 批改工作入列失敗: {e}")
+        return None
+
+    publish_progress_event(progress_id, {
+        'type': 'progress_update',
+        'current_stage': 1,
+        'stage_description': '已收到作答，等待批改中...',
+        'progress_percentage': 0,
+        'is_completed': False,
+        'job_id': job_id
+    })
+    print(f"📥 批改工作已入列: {job_id} ({job_type}, {user_email})")
+    return job_id
+
+
+def get_grading_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """獲取批改工作狀態（不含作答內容），不存在時返回 None"""
+    try:
+        raw = redis_client.hgetall(_job_key(job_id))
+    except Exception as e:
+        print(f"❌ 獲取批改工作狀態失敗: {e}")
+        return None
+    if not raw:
+        return None
+
+    job = {_decode(k): _decode(v) for k, v in raw.items()}
+    job.pop('payload', None)
+    if job.get('result'):
+        job['result'] = json.loads(job['result'])
+    for field in ('created_at', 'started_at', 'finished_at'):
+        if job.get(field):
+            job[field] = float(job[field])
+    job['attempts'] = int(job.get('attempts', 0))
+    return job
+
+
+def _summarize_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """只保留結果摘要（詳細作答結果已寫入資料庫，由結果頁查詢）"""
+    data = result.get('data') or {}
+    return {k: v for k, v in data.items() if k not in ('detailed_results', 'grading_stages')}
+
+
+def _fail_job(job_id: str, progress_id: str, message: str):
+    redis_client.hset(_job_key(job_id), mapping={
+        'status': 'failed',
+        'error': message,
+        'finished_at': time.time()
+    })
+    publish_progress_event(progress_id, {
+        'type': 'error',
+        'message': message,
+        'stage_description': message,
+        'is_completed': True,
+        'job_id': job_id
+    })
+
+
+def process_grading_job(job_id: str):
+    """執行單一批改工作（需在 Flask app context 中呼叫）"""
+    key = _job_key(job_id)
+    raw = redis_client.hgetall(key)
+    if not raw:
+        print(f"⚠️ 批改工作不存在或已過期: {job_id}")
+        grading_queue.ack(job_id)
+        return
+
+    job = {_decode(k): _decode(v) for k, v in raw.items()}
+    progress_id = job.get('progress_id', '')
+    attempts = int(job.get('attempts', 0)) + 1
+    redis_client.hset(key, mapping={'status': 'processing', 'attempts': attempts, 'started_at': time.time()})
+
+    g.api_base_url = job.get('api_base_url', '')
+    handler = _job_handlers.get(job.get('job_type'))
+    retry = False
+    try:
+        if not handler:
+            raise ValueError(f"未知的批改工作類型: {job.get('job_type')}")
+        result = handler(job.get('user_email'), json.loads(job.get('payload') or '{}'), progress_id)
+        if result.get('success'):
+            redis_client.hset(key, mapping={
+                'status': 'completed',
+                'result': json.dumps(_summarize_result(result), ensure_ascii=False, default=str),
+                'finished_at': time.time()
+            })
+            print(f"✅ 批改工作完成: {job_id}")
+        else:
+            _fail_job(job_id, progress_id, result.get('message', '批改失敗'))
+            print(f"❌ 批改工作失敗: {job_id} - {result.get('message')}")
+    except Exception as e:
+        if attempts < MAX_JOB_ATTEMPTS:
+            print(f"⚠️ 批改工作異常，稍後重試 ({attempts}/{MAX_JOB_ATTEMPTS}): {job_id} - {e}")
+            redis_client.hset(key, 'status', 'queued')
+            retry = True
+        else:
+            _fail_job(job_id, progress_id, f'批改失敗: {str(e)}')
+            print(f"❌ 批改工作失敗: {job_id} - {e}")
+    finally:
+        if retry:
+            grading_queue.retry(job_id)
+        else:
+            grading_queue.ack(job_id)
+
+
+def _process_member(member: Any):
+    process_grading_job(_decode(member))
+
+
+def run_grading_workers(app, concurrency: int = 4):
+    """啟動批改 worker（阻塞直到收到中斷訊號）"""
+    grading_queue.run_workers(app, _process_member, concurrency, 'grading-worker')
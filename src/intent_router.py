@@ -0,0 +1,247 @@
+"""
+本地意圖路由 - 常見需求不經過主代理人規劃
+
+主代理人每則訊息至少要呼叫一次 LLM 選擇工具、再呼叫一次整理回答。
+簽到、查行事曆、今日行程、隨機測驗、最新消息、學習進度、網站導覽這類
+意圖明確的訊息，改由本地規則判斷後直接呼叫對應工具：
+- 先比對關鍵字 / 正則規則
+- 規則未命中時，以字元 n-gram TF-IDF 比對範例句與工具說明，
+  分數與領先幅度都足夠時才視為可信
+- 分類器只能命中唯讀意圖（查行事曆、消息、學習分析、網站導覽）；
+  簽到、出題等會寫入資料的意圖只接受錨定的規則比對，且訊息帶否定或疑問語氣時不執行
+- 帶有新增、修改、刪除等需要抽取參數的訊息一律交回主代理人
+"""
+import logging
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 分類器判定為可信的最低相似度，以及與第二名的最小差距
+MIN_CLASSIFIER_SCORE = 0.5
+MIN_CLASSIFIER_MARGIN = 0.15
+# 超過此長度的訊息通常包含多個需求或細節，交給主代理人
+MAX_ROUTABLE_LENGTH = 30
+
+# 需要從訊息抽取參數的操作，不走快速路徑
+AGENT_ONLY_PATTERN = re.compile(r'(新增|加入|修改|更改|改成|刪除|取消|提醒|設定|目標)')
+# 會寫入資料的意圖：否定（不要簽到）或疑問（簽到了嗎）語氣時不直接執行
+NEGATION_PATTERN = re.compile(r'(不要|不用|不想|不必|別|勿|沒有要)')
+QUESTION_PATTERN = re.compile(r'(嗎|呢|了沒|有沒有|是否|幾|什麼|怎麼|[?？])')
+
+QUIZ_NO_ANSWER_HINT = "題型隨機，只顯示題目和選項，不要顯示正確答案"
+
+
+def _line_id(user_id: str) -> str:
+    """移除 line_ 前綴，取得純粹的 LINE ID"""
+    return user_id[len('line_'):] if user_id.startswith('line_') else user_id
+
+
+# 意圖定義：platform 對應的工具名稱、規則、範例句與工具參數
+# read_only 為 True 的意圖才能由分類器命中，其餘只接受規則比對
+INTENTS: List[Dict[str, Any]] = [
+    {
+        'name': 'checkin',
+        'platform': 'linebot',
+        'tool': 'linebot_checkin_tool',
+        'read_only': False,
+        'patterns': [r'^(我要|幫我)?(今天|今日|每日)?(簽到|打卡)$'],
+        'examples': ['簽到', '我要簽到', '幫我打卡', '每日簽到', '今天簽到'],
+        'args': lambda message, user_id: {'line_id': _line_id(user_id)}
+    },
+    {
+        'name': 'today_events',
+        'platform': 'linebot',
+        'tool': 'linebot_calendar_view_tool',
+        'read_only': True,
+        'patterns': [r'(今天|今日).*(行程|事件|行事曆|安排|計畫|要做什麼)'],
+        'examples': ['今天有什麼行程', '今天的行事曆', '我今天要做什麼', '今日事件'],
+        'args': lambda message, user_id: {'line_id': _line_id(user_id), 'today_only': True}
+    },
+    {
+        'name': 'calendar',
+        'platform': 'linebot',
+        'tool': 'linebot_calendar_view_tool',
+        'read_only': True,
+        'patterns': [r'^(查看|查詢|顯示|列出|看)?(我的)?(行事曆|行程|學習計畫)(有哪些|列表)?$'],
+        'examples': ['查看行事曆', '我的行程有哪些', '列出所有行程', '行事曆'],
+        'args': lambda message, user_id: {'line_id': _line_id(user_id), 'today_only': False}
+    },
+    {
+        'name': 'random_quiz',
+        'platform': 'linebot',
+        'tool': 'linebot_quiz_generator_tool',
+        'read_only': False,
+        'patterns': [r'^隨機(測驗|出題|題目)$', r'^(來|給我|出)(一|1)?(題|道)(題目|測驗)?$'],
+        'examples': ['隨機測驗', '來一題', '給我一道題目', '隨機出題'],
+        'args': lambda message, user_id: {'requirements': f"{message}（{QUIZ_NO_ANSWER_HINT}）"}
+    },
+    {
+        'name': 'news',
+        'platform': 'linebot',
+        'tool': 'linebot_news_exam_tool',
+        'read_only': True,
+        'patterns': [r'^(最新)?(消息|新聞|考試資訊)$', r'有(什麼|沒有)(最新)?(消息|新聞)'],
+        'examples': ['最新消息', '有什麼新聞', '考試資訊'],
+        'args': lambda message, user_id: {'query': message}
+    },
+    {
+        'name': 'learning_progress',
+        'platform': 'linebot',
+        'tool': 'linebot_learning_analysis_tool',
+        'read_only': True,
+        'patterns': [r'^(我的)?學習(進度|狀況|分析|成效)$', r'我(的)?學得(怎麼樣|如何)'],
+        'examples': ['我的學習進度', '學習狀況', '我學得怎麼樣', '學習成效'],
+        'args': lambda message, user_id: {'input_text': f"用戶ID: {user_id}\n{message}"}
+    },
+    {
+        'name': 'random_quiz',
+        'platform': 'web',
+        'tool': 'quiz_generator_tool',
+        'read_only': False,
+        'patterns': [r'^隨機(測驗|出題|考卷)$'],
+        'examples': ['隨機測驗', '幫我隨機出一份考卷', '隨機出題'],
+        'args': lambda message, user_id: {'requirements': message}
+    },
+    {
+        'name': 'navigation',
+        'platform': 'web',
+        'tool': 'website_guide_tool',
+        'read_only': True,
+        'patterns': [r'^(網站)?(導覽|功能介紹)$', r'網站(有)?(哪些|什麼)功能', r'(怎麼|如何)使用(這個)?(網站|系統)'],
+        'examples': ['網站導覽', '網站有哪些功能', '怎麼使用這個網站', '功能介紹'],
+        'args': lambda message, user_id: {'query': message}
+    }
+]
+
+_compiled_patterns = {id(intent): [re.compile(p) for p in intent['patterns']] for intent in INTENTS}
+
+# platform -> (vectorizer, 句向量矩陣, 每列對應的意圖)
+_classifiers: Dict[str, Tuple[Any, Any, List[Dict[str, Any]]]] = {}
+_classifier_lock = threading.Lock()
+
+
+def _platform_intents(platform: str) -> List[Dict[str, Any]]:
+    return [intent for intent in INTENTS if intent['platform'] == platform]
+
+
+def _classifiable_intents(platform: str) -> List[Dict[str, Any]]:
+    """分類器可命中的意圖（只含唯讀意圖，寬鬆比對不會觸發寫入）"""
+    return [intent for intent in _platform_intents(platform) if intent['read_only']]
+
+
+def _blocked_by_guards(intent: Dict[str, Any], text: str) -> bool:
+    """會寫入資料的意圖遇到否定或疑問語氣時不執行"""
+    if intent['read_only']:
+        return False
+    return bool(NEGATION_PATTERN.search(text) or QUESTION_PATTERN.search(text))
+
+
+def _build_classifier(platform: str, tool_descriptions: Dict[str, str]):
+    """以範例句與工具說明訓練字元 n-gram TF-IDF（中文不需斷詞）"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    corpus, labels = [], []
+    for intent in _classifiable_intents(platform):
+        for sentence in intent['examples'] + [tool_descriptions.get(intent['tool'], '')]:
+            if sentence:
+                corpus.append(sentence)
+                labels.append(intent)
+    if not corpus:
+        return None
+    vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=(1, 2))
+    matrix = vectorizer.fit_transform(corpus)
+    return vectorizer, matrix, labels
+
+
+def _get_classifier(platform: str, tool_descriptions: Dict[str, str]):
+    classifier = _classifiers.get(platform)
+    if classifier is not None:
+        return classifier
+    with _classifier_lock:
+        if platform not in _classifiers:
+            _classifiers[platform] = _build_classifier(platform, tool_descriptions)
+    return _classifiers[platform]
+
+
+def classify_intent(message: str, platform: str,
+                    tool_descriptions: Optional[Dict[str, str]] = None) -> Optional[Tuple[Dict[str, Any], float]]:
+    """
+    判斷訊息意圖
+
+    返回：
+    - (意圖, 信心分數)；無法可信判斷時返回 None
+    """
+    text = message.strip().lstrip('@').strip()
+    if not text or len(text) > MAX_ROUTABLE_LENGTH or AGENT_ONLY_PATTERN.search(text):
+        return None
+
+    # 1. 規則比對
+    for intent in _platform_intents(platform):
+        if any(pattern.search(text) for pattern in _compiled_patterns[id(intent)]):
+            if _blocked_by_guards(intent, text):
+                return None
+            return intent, 1.0
+
+    # 2. TF-IDF 分類（scikit-learn 不可用時略過）
+    try:
+        classifier = _get_classifier(platform, tool_descriptions or {})
+    except ImportError:
+        return None
+    if classifier is None:
+        return None
+
+    vectorizer, matrix, labels = classifier
+    scores = (matrix @ vectorizer.transform([text]).T).toarray().ravel()
+    best_by_intent: Dict[int, Tuple[Dict[str, Any], float]] = {}
+    for intent, score in zip(labels, scores):
+        key = id(intent)
+        if key not in best_by_intent or score > best_by_intent[key][1]:
+            best_by_intent[key] = (intent, float(score))
+    ranked = sorted(best_by_intent.values(), key=lambda item: item[1], reverse=True)
+    best_intent, best_score = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    if best_intent['read_only'] and best_score >= MIN_CLASSIFIER_SCORE and best_score - runner_up >= MIN_CLASSIFIER_MARGIN:
+        return best_intent, best_score
+    return None
+
+
+def route_message(message: str, user_id: str, platform: str, tools: List[Any]) -> Optional[Dict[str, Any]]:
+    """
+    嘗試以快速路徑處理訊息
+
+    參數：
+    - tools: 平台主代理人的工具清單（依名稱找到要直接呼叫的工具）
+
+    返回：
+    - {'intent', 'tool', 'score', 'content'}；不適用或工具執行失敗時返回 None，由主代理人處理
+    """
+    tools_by_name: Dict[str, Any] = {t.name: t for t in tools}
+    tool_descriptions = {name: t.description for name, t in tools_by_name.items()}
+
+    result = classify_intent(message, platform, tool_descriptions)
+    if not result:
+        return None
+    intent, score = result
+
+    tool = tools_by_name.get(intent['tool'])
+    if tool is None:
+        return None
+
+    args_builder: Callable[[str, str], Dict[str, Any]] = intent['args']
+    try:
+        content = tool.invoke(args_builder(message.strip().lstrip('@').strip(), user_id))
+    except Exception as e:
+        logger.warning(f"⚠️ 快速路徑工具執行失敗，改由主代理人處理: {intent['tool']} - {e}")
+        return None
+    if not content or not str(content).strip():
+        return None
+
+    logger.info(f"⚡ 快速路徑: {intent['name']} -> {intent['tool']} (score={score:.2f})")
+    return {
+        'intent': intent['name'],
+        'tool': intent['tool'],
+        'score': score,
+        'content': str(content)
+    }
@@ -10,10 +10,17 @@ from datetime import datetime, timedelta
 from collections import defaultdict
 from flask import Blueprint, request, jsonify
 from sqlalchemy import text
-from accessories import sqldb, mongo, init_gemini, redis_client
+from accessories import sqldb, mongo, generate_gemini_content, redis_client
 from bson import ObjectId
 from src.api import get_user_info
 from src.quiz_generator import generate_quiz_by_ai
+from src.question_loader import load_question_map
+from src.exam_facets import record_new_exams, invalidate_exam_facets
+from src.question_pools import add_questions_to_pools, invalidate_question_pools
+from src.concept_mastery import (
+    CONCEPT_QUESTION_PROJECTION, question_concept_fields, get_user_concept_mastery, summarize_mastery_by_domain,
+    calculate_overall_mastery
+)
 
 # 設置日誌
 logger = logging.getLogger(__name__)
@@ -21,11 +28,24 @@ logger = logging.getLogger(__name__)
 # 創建藍圖
 analytics_bp = Blueprint('learning_analytics', __name__)
 
-def get_student_quiz_records(user_email: str) -> List[Dict]:
-    """獲取學生的答題記錄"""
+# init-data 的趨勢天數上限
+MAX_TREND_DAYS = 90
+# init-data 逐筆讀取答題紀錄的最短天數；混合掌握度的時間權重每日衰減 5%，
+# 90 天前的紀錄權重已低於 1%，因此只讀近期紀錄即可，載入時間不再隨全部答題數成長
+RECENT_RECORD_DAYS = 90
+# 連續學習天數與學習強度回溯的天數（以每日彙總計算）
+DAILY_ACTIVITY_DAYS = 365
+
+def get_student_quiz_records(user_email: str, since: Optional[datetime] = None) -> List[Dict]:
+    """
+    獲取學生的答題記錄
+
+    參數：
+    - since: 只取此時間之後的紀錄，None 表示全部
+    """
     try:
         # 查詢答題記錄，直接從 quiz_answers 表獲取
-        query = text("""
+        query = text(f"""
             SELECT 
                 qa.answer_id as answer_id,
                 qa.mongodb_question_id as question_id,
@@ -34,36 +54,25 @@ def get_student_quiz_records(user_email: str) -> List[Dict]:
                 qa.is_correct
             FROM quiz_answers qa
             WHERE qa.user_email = :user_email
+            {'AND qa.created_at >= :since' if since else ''}
             ORDER BY qa.created_at DESC
         """)
         
-        result = sqldb.session.execute(query, {"user_email": user_email})
+        params = {"user_email": user_email}
+        if since:
+            params["since"] = since
+        result = sqldb.session.execute(query, params)
         records = result.fetchall()
         
+        # 以單次 $in 查詢批次獲取題目詳細信息
+        question_map = load_question_map([row.question_id for row in records], CONCEPT_QUESTION_PROJECTION)
+        
         quiz_records = []
         for row in records:
-            # 從 MongoDB 獲取題目詳細信息
-            question_doc = mongo.db.exam.find_one({"_id": ObjectId(row.question_id)})
+            question_doc = question_map.get(str(row.question_id))
             if question_doc:
-                # 處理微概念數組
-                micro_concepts = question_doc.get('micro_concepts', [])
-                micro_concept_id = str(micro_concepts[0]) if micro_concepts else ''
-                
-                # 從key-points獲取領域信息
-                key_points = question_doc.get('key-points', '')
-                
-                # 獲取難度信息，處理不同的字段名
-                difficulty = (question_doc.get('difficulty level') or 
-                            question_doc.get('difficulty') or 
-                            question_doc.get('level') or 
-                            '中等')
-                
-                # 獲取領域信息 - 嘗試多個字段
-                domain_name = (question_doc.get('domain') or 
-                             question_doc.get('subject') or 
-                             question_doc.get('field') or 
-                             key_points or 
-                             '未知領域')
+                # 處理微概念、領域（key-points 等）與難度欄位
+                fields = question_concept_fields(question_doc)
                 
                 quiz_records.append({
                     'id': row.answer_id,
@@ -71,10 +80,10 @@ def get_student_quiz_records(user_email: str) -> List[Dict]:
                     'attempt_time': row.attempt_time.isoformat() + 'Z',
                     'time_spent': row.time_spent or 0,
                     'is_correct': bool(row.is_correct),
-                    'micro_concept_id': micro_concept_id,
-                    'domain_name': domain_name,  # 使用更準確的領域名稱
-                    'difficulty': difficulty,
-                    'key_points': key_points  # 保留原始key-points用於調試
+                    'micro_concept_id': fields['micro_concept_id'],
+                    'domain_name': fields['domain_name'],  # 使用更準確的領域名稱
+                    'difficulty': fields['difficulty'],
+                    'key_points': fields['key_points']  # 保留原始key-points用於調試
                 })
         
         logger.info(f"獲取到 {len(quiz_records)} 條答題紀錄")
@@ -91,6 +100,75 @@ def get_student_quiz_records(user_email: str) -> List[Dict]:
         logger.error(f"獲取學生答題紀錄失敗: {str(e)}")
         return []
 
+def get_daily_activity(user_email: str, days: int = DAILY_ACTIVITY_DAYS) -> List[Dict]:
+    """
+    獲取學生近 days 天的每日答題彙總（在 SQL 端分組，回傳筆數不超過 days）
+
+    返回：
+    - [{'date': 'YYYY-MM-DD', 'questions', 'correct', 'time_spent'}]，依日期新到舊
+    """
+    try:
+        result = sqldb.session.execute(text("""
+            SELECT DATE(created_at) AS day,
+                   COUNT(*) AS questions,
+                   SUM(is_correct) AS correct,
+                   SUM(COALESCE(answer_time_seconds, 0)) AS time_spent
+            FROM quiz_answers
+            WHERE user_email = :user_email AND created_at >= :since
+            GROUP BY DATE(created_at)
+            ORDER BY day DESC
+        """), {"user_email": user_email, "since": datetime.now() - timedelta(days=days)})
+        return [
+            {
+                'date': row.day.isoformat(),
+                'questions': int(row.questions or 0),
+                'correct': int(row.correct or 0),
+                'time_spent': int(row.time_spent or 0)
+            }
+            for row in result.fetchall()
+        ]
+    except Exception as e:
+        logger.error(f"獲取每日答題彙總失敗: {str(e)}")
+        return []
+
+def get_activity_totals(user_email: str) -> Dict[str, int]:
+    """
+    獲取學生全部作答歷史的學習天數與最長學習時段（在 SQL 端計算，只回傳一列）
+
+    學習時段規則與 calculate_longest_session 相同：相鄰作答間隔 30 分鐘內視為同一時段，累加答題時間。
+
+    返回：
+    - {'active_days': 有作答的天數, 'longest_session': 最長學習時段（分鐘）}
+    """
+    try:
+        row = sqldb.session.execute(text("""
+            SELECT COUNT(DISTINCT DATE(created_at)) AS active_days,
+                   (SELECT COALESCE(MAX(session_seconds), 0) FROM (
+                        SELECT SUM(time_spent) AS session_seconds
+                        FROM (
+                            SELECT time_spent, SUM(new_session) OVER (ORDER BY created_at, answer_id) AS session_no
+                            FROM (
+                                SELECT answer_id, created_at,
+                                       COALESCE(answer_time_seconds, 0) AS time_spent,
+                                       CASE WHEN TIMESTAMPDIFF(SECOND, LAG(created_at) OVER (ORDER BY created_at, answer_id), created_at) <= 1800
+                                            THEN 0 ELSE 1 END AS new_session
+                                FROM quiz_answers
+                                WHERE user_email = :user_email
+                            ) AS gaps
+                        ) AS sessions
+                        GROUP BY session_no
+                    ) AS session_totals) AS longest_session_seconds
+            FROM quiz_answers
+            WHERE user_email = :user_email
+        """), {"user_email": user_email}).fetchone()
+        return {
+            'active_days': int(row.active_days or 0),
+            'longest_session': int((row.longest_session_seconds or 0) / 60)
+        }
+    except Exception as e:
+        logger.error(f"獲取學習天數與學習時段失敗: {str(e)}")
+        return {'active_days': 0, 'longest_session': 0}
+
 def calculate_difficulty_statistics(quiz_records: List[Dict]) -> Dict[str, Any]:
     """計算各難度的統計數據"""
     if not quiz_records:
@@ -333,6 +411,23 @@ def calculate_difficulty_aware_mastery(quiz_records: List[Dict], concept_id: str
         difficulty_stats[difficulty]['total'] += 1
         if record['is_correct']:
             difficulty_stats[difficulty]['correct'] += 1
+    return calculate_difficulty_mastery_from_stats(difficulty_stats)
+
+def calculate_difficulty_mastery_from_stats(difficulty_stats: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+    """由各難度的作答統計 {難度: {'total', 'correct'}} 計算難度感知掌握度"""
+    if not any(stats['total'] for stats in difficulty_stats.values()):
+        return {
+            'overall_mastery': 0,
+            'difficulty_breakdown': {'簡單': 0, '中等': 0, '困難': 0},
+            'difficulty_analysis': {
+                'easy_mastery': 0,
+                'medium_mastery': 0,
+                'hard_mastery': 0,
+                'bottleneck_level': 'none',
+                'recommended_difficulty': '簡單'
+            }
+        }
+    
     # 計算各難度掌握度
     difficulty_breakdown = {}
     for difficulty in ['簡單', '中等', '困難']:
@@ -621,7 +716,7 @@ def init_data():
     try:
         # 獲取請求參數
         data = request.get_json() or {}
-        trend_days = data.get('trendDays', 7)
+        trend_days = min(max(int(data.get('trendDays', 7) or 7), 1), MAX_TREND_DAYS)
         
         # 從請求中獲取JWT token
         auth_header = request.headers.get('Authorization')
@@ -631,8 +726,11 @@ def init_data():
         token = auth_header.split(' ')[1]
         user_email = get_user_info(token, 'email')
         
-        # 獲取學生答題紀錄
-        quiz_records = get_student_quiz_records(user_email)
+        # 只逐筆讀取近期答題紀錄（歷史趨勢需要兩個週期）；全期統計改讀掌握度表與每日彙總
+        record_days = max(trend_days * 2, RECENT_RECORD_DAYS)
+        quiz_records = get_student_quiz_records(user_email, since=datetime.now() - timedelta(days=record_days))
+        daily_activity = get_daily_activity(user_email)
+        activity_totals = get_activity_totals(user_email)
         
         # 計算學習指標
         learning_metrics = calculate_learning_metrics(quiz_records)
@@ -642,24 +740,13 @@ def init_data():
         # 從MongoDB獲取所有領域
         all_domains = list(mongo.db.domain.find({}, {'name': 1, '_id': 1}))
         
-        # 基於答題記錄計算各領域掌握度
-        domain_stats = {}
-        
-        # 統計各領域的答題情況
-        for record in quiz_records:
-            domain_name = record.get('domain_name', '未知領域')
-            if domain_name not in domain_stats:
-                domain_stats[domain_name] = {
-                    'total': 0,
-                    'correct': 0,
-                    'wrong': 0
-                }
-            
-            domain_stats[domain_name]['total'] += 1
-            if record['is_correct']:
-                domain_stats[domain_name]['correct'] += 1
-            else:
-                domain_stats[domain_name]['wrong'] += 1
+        # 各領域/微概念/難度的答題統計改讀增量維護的掌握度表，不需重掃全部答題紀錄
+        mastery_rows = get_user_concept_mastery(user_email)
+        mastery_summary = summarize_mastery_by_domain(mastery_rows)
+        domain_stats = {
+            name: {'total': summary['total'], 'correct': summary['correct'], 'wrong': summary['wrong']}
+            for name, summary in mastery_summary.items()
+        }
         
         
         # 構建領域數據 - 包含所有領域，即使沒有答題記錄
@@ -697,8 +784,11 @@ def init_data():
                 domain_mastery = 0.0  # 沒有答題記錄時設為0
             
             # 計算該領域的難度感知掌握度
-            domain_records = [r for r in quiz_records if r.get('domain_name') == domain_name.split('（')[0]]
-            difficulty_aware_data = calculate_difficulty_aware_mastery(domain_records, domain_id)
+            simplified_domain_name = domain_name.split('（')[0]  # 取括號前的部分
+            domain_summary = mastery_summary.get(simplified_domain_name)
+            difficulty_aware_data = calculate_difficulty_mastery_from_stats(
+                dict(domain_summary['difficulty']) if domain_summary else {}
+            )
             
             
             # 從MongoDB獲取該領域下的小知識點（微概念）
@@ -714,33 +804,8 @@ def init_data():
             micro_concept_docs = list(mongo.db.micro_concept.find(micro_concepts_query, {'name': 1, '_id': 1, 'block_id': 1}))
             
             
-            # 統計每個微概念的答題情況
-            # 需要匹配簡化的領域名稱
-            simplified_domain_name = domain_name.split('（')[0]  # 取括號前的部分
-            domain_records = [r for r in quiz_records if r.get('domain_name') == simplified_domain_name]
-            micro_concept_stats = {}
-            for record in domain_records:
-                concept_id = record.get('micro_concept_id', '')
-                concept_name = record.get('micro_concept_name', '')
-                # 使用概念ID作為主要匹配方式
-                if concept_id and concept_id != 'None' and concept_id != '':
-                    if concept_id not in micro_concept_stats:
-                        micro_concept_stats[concept_id] = {'total': 0, 'correct': 0, 'wrong': 0}
-                    micro_concept_stats[concept_id]['total'] += 1
-                    if record['is_correct']:
-                        micro_concept_stats[concept_id]['correct'] += 1
-                    else:
-                        micro_concept_stats[concept_id]['wrong'] += 1
-                
-                # 也嘗試用概念名稱匹配（作為備選）
-                elif concept_name and concept_name != 'None' and concept_name != '':
-                    if concept_name not in micro_concept_stats:
-                        micro_concept_stats[concept_name] = {'total': 0, 'correct': 0, 'wrong': 0}
-                    micro_concept_stats[concept_name]['total'] += 1
-                    if record['is_correct']:
-                        micro_concept_stats[concept_name]['correct'] += 1
-                    else:
-                        micro_concept_stats[concept_name]['wrong'] += 1
+            # 每個微概念的答題統計
+            micro_concept_stats = dict(domain_summary['concepts']) if domain_summary else {}
             
             # 構建小知識點數據
             concepts = []
@@ -820,12 +885,12 @@ def init_data():
         
         # 構建總覽數據
         # 計算額外的統計數據
-        total_attempts = len(quiz_records)
-        correct_attempts = sum(1 for r in quiz_records if r['is_correct'])
+        total_attempts = sum(summary['total'] for summary in mastery_summary.values())
+        correct_attempts = sum(summary['correct'] for summary in mastery_summary.values())
         accuracy = correct_attempts / total_attempts if total_attempts > 0 else 0
         
         # 計算連續學習天數
-        consecutive_days = calculate_consecutive_days(quiz_records)
+        consecutive_days = calculate_consecutive_days_from_daily(daily_activity)
         
         # 計算本週已作答題數
         from datetime import timezone
@@ -836,17 +901,18 @@ def init_data():
         mastered_concepts = len([d for d in domains if d['mastery'] >= 0.8])
         learning_concepts = len([d for d in domains if 0.3 <= d['mastery'] < 0.8])
         
-        # 計算學習時間統計
-        total_study_time = calculate_total_study_time(quiz_records)
-        avg_daily_time = calculate_avg_daily_time(quiz_records)
-        longest_session = calculate_longest_session(quiz_records)
-        study_intensity = calculate_study_intensity(quiz_records)
+        # 計算學習時間統計（與總答題數相同，涵蓋全部作答歷史）
+        total_study_seconds = sum(row['total_time_seconds'] for row in mastery_rows)
+        total_study_time = round(total_study_seconds / 3600, 1)
+        avg_daily_time = int(total_study_seconds / 60 / activity_totals['active_days']) if activity_totals['active_days'] else 0
+        longest_session = activity_totals['longest_session']
+        study_intensity = calculate_study_intensity_from_daily(daily_activity)
         
         # 計算歷史數據用於趨勢分析
         historical_metrics = calculate_historical_metrics(quiz_records, trend_days)
         
         overview_data = {
-            'total_mastery': learning_metrics['overall_mastery'],
+            'total_mastery': calculate_overall_mastery(mastery_rows),
             'learning_velocity': learning_metrics['learning_velocity'],
             'retention_rate': learning_metrics['retention_rate'],
             'avg_time_per_concept': learning_metrics['avg_time_per_concept'],
@@ -864,6 +930,9 @@ def init_data():
             'avg_daily_time': avg_daily_time,
             'longest_session': longest_session,
             'study_intensity': study_intensity,
+            # learning_velocity / retention_rate / avg_time_per_concept / focus_score / recent_activity
+            # 與趨勢數據只由近 metrics_window_days 天的答題紀錄計算，其餘統計涵蓋全部作答歷史
+            'metrics_window_days': record_days,
             # 歷史數據用於趨勢計算
             'previous_learning_velocity': historical_metrics['learning_velocity'],
             'previous_retention_rate': historical_metrics['retention_rate'],
@@ -1157,7 +1226,8 @@ def generate_questions_with_key(task: Dict[str, Any]) -> Dict[str, Any]:
             'question_types': ['single-choice', 'multiple-choice', 'fill-in-the-blank', 'true-false'],
             'difficulty': difficulty,
             'question_count': question_count,
-            'exam_type': 'knowledge'
+            'exam_type': 'knowledge',
+            'api_key': api_key  # 綁定此任務分配到的金鑰，讓並行任務分散在不同配額
         }
         
         # 調用quiz_generator
@@ -1245,6 +1315,8 @@ def save_quiz_to_database(quiz_info: Dict[str, Any], questions: List[Dict], conc
         if exam_questions:
             try:
                 question_results = mongo.db.exam.insert_many(exam_questions)
+                record_new_exams(exam_questions)  # 增量更新題庫篩選快取
+                add_questions_to_pools(exam_questions)  # 增量加入組卷題目池
                 
                 # 創建SQL template（使用所有題目的ID）
                 question_ids = [str(q_id) for q_id in question_results.inserted_ids]
@@ -1267,6 +1339,9 @@ def save_quiz_to_database(quiz_info: Dict[str, Any], questions: List[Dict], conc
                         successful_ids.append(str(result.inserted_id))
                     except Exception as single_error:
                         continue
+                # insert_many 可能已部分寫入，直接清除題庫篩選快取與題目池
+                invalidate_exam_facets()
+                invalidate_question_pools()
                 
                 if successful_ids:
                     template_id = create_sql_template(successful_ids, {
@@ -1708,9 +1783,6 @@ def generate_ai_coach_analysis(overview_data: Dict, domains: List[Dict], quiz_re
         # 只有在快取不存在時才執行以下查詢
         logger.info(f"🔄 開始執行AI教練分析查詢流程...")
         
-        # 初始化Gemini模型
-        model = init_gemini('gemini-2.5-flash')
-        
         # 準備分析數據
         total_attempts = overview_data.get('total_attempts', 0)
         total_mastery = overview_data.get('total_mastery', 0)
@@ -1762,7 +1834,7 @@ def generate_ai_coach_analysis(overview_data: Dict, domains: List[Dict], quiz_re
 """
 
         # 調用Gemini API
-        response = model.generate_content(prompt)
+        response = generate_gemini_content(prompt)
         ai_analysis = response.text.strip()
         
         result = {
@@ -2289,8 +2361,7 @@ def generate_learning_path_recommendations(concept_id: str, concept_relations: D
 """
         
         # 調用Gemini API
-        model = init_gemini('gemini-2.5-flash')
-        response = model.generate_content(prompt)
+        response = generate_gemini_content(prompt)
         ai_response = response.text.strip()
         
         # 解析AI回應
@@ -2457,6 +2528,30 @@ def calculate_consecutive_days(quiz_records: List[Dict]) -> int:
     
     return consecutive_days
 
+def calculate_consecutive_days_from_daily(daily_activity: List[Dict]) -> int:
+    """以每日答題彙總計算連續學習天數（規則與 calculate_consecutive_days 相同）"""
+    from datetime import timezone
+    consecutive_days = 0
+    current_date = datetime.now(timezone.utc).date()
+    for day in sorted(daily_activity, key=lambda d: d['date'], reverse=True):
+        date_obj = datetime.strptime(day['date'], '%Y-%m-%d').date()
+        if date_obj == current_date or date_obj == current_date - timedelta(days=consecutive_days):
+            consecutive_days += 1
+            current_date = date_obj - timedelta(days=1)
+        else:
+            break
+    return consecutive_days
+
+def calculate_study_intensity_from_daily(daily_activity: List[Dict]) -> int:
+    """以每日答題彙總計算學習強度（規則與 calculate_study_intensity 相同）"""
+    from datetime import timezone
+    week_ago = (datetime.now(timezone.utc) - timedelta(days=7)).date().isoformat()
+    recent_days = [day for day in daily_activity if day['date'] >= week_ago and day['questions'] > 0]
+    if not recent_days:
+        return 0
+    avg_daily = sum(day['questions'] for day in recent_days) / len(recent_days)
+    return min(100, int((avg_daily / 10) * 100))
+
 def calculate_total_study_time(quiz_records: List[Dict]) -> float:
     """計算總學習時間（小時）"""
     if not quiz_records:
@@ -2821,9 +2916,6 @@ def generate_ai_diagnosis(concept_name: str, domain_name: str, mastery: float,
     """使用Gemini API生成AI診斷結果"""
     
     try:
-        # 初始化Gemini模型
-        model = init_gemini('gemini-2.5-flash')
-        
         # 準備診斷數據
         wrong_count = total_attempts - correct_attempts
         error_analysis = ""
@@ -3029,7 +3121,7 @@ def generate_ai_diagnosis(concept_name: str, domain_name: str, mastery: float,
 """
 
         # 調用Gemini API
-        response = model.generate_content(prompt)
+        response = generate_gemini_content(prompt)
         ai_response = response.text.strip()
         
         # 解析JSON響應
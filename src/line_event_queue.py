@@ -0,0 +1,111 @@
+"""
+LINE Webhook 事件佇列 - 去重後將每個事件排入 Redis 佇列，由 LINE worker 分派處理
+"""
+import json
+import time
+import uuid
+from typing import Any, Callable, Dict, List
+from accessories import redis_client
+from src.redis_job_queue import RedisJobQueue, decode as _decode
+
+# 已處理事件ID保留時間（秒），涵蓋 LINE 重送的時間範圍
+EVENT_DEDUP_TTL_SECONDS = 86400
+# 工作處理逾時（秒），超過視為 worker 已中斷，可重新排入佇列
+JOB_VISIBILITY_TIMEOUT_SECONDS = 300
+# 單一工作最多重試次數
+MAX_JOB_ATTEMPTS = 3
+
+line_event_queue = RedisJobQueue('line_events', JOB_VISIBILITY_TIMEOUT_SECONDS, 'LINE 事件')
+
+
+def _dedup_key(webhook_event_id: str) -> str:
+    """獲取事件去重的 Redis key"""
+    return f"line_event_seen:{webhook_event_id}"
+
+
+def _filter_new_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """以 SET NX 標記事件ID，返回尚未處理過的事件（沒有事件ID的一律視為新事件）"""
+    pipe = redis_client.pipeline()
+    ids = []
+    for event in events:
+        webhook_event_id = event.get('webhookEventId')
+        ids.append(webhook_event_id)
+        if webhook_event_id:
+            pipe.set(_dedup_key(webhook_event_id), 1, nx=True, ex=EVENT_DEDUP_TTL_SECONDS)
+    results = iter(pipe.execute())
+    return [event for event, webhook_event_id in zip(events, ids)
+            if not webhook_event_id or next(results)]
+
+
+def _new_job(event: Dict[str, Any]) -> str:
+    return json.dumps({
+        'job_id': uuid.uuid4().hex,
+        'event': event,
+        'attempts': 0,
+        'received_at': time.time()
+    }, ensure_ascii=False)
+
+
+def enqueue_line_webhook(body: str, signature: str) -> bool:
+    """
+    將已驗證簽章的 Webhook 事件逐一寫入佇列（只寫入尚未處理過的事件）
+
+    返回：
+    - True：已入列（或全部為重送事件而略過）
+    - False：body 無法解析或 Redis 不可用，由呼叫端改為同步處理
+    """
+    try:
+        events = json.loads(body).get('events', [])
+    except Exception as e:
+        print(f"⚠️ [Webhook] 無法解析事件內容: {e}")
+        return False
+
+    try:
+        new_events = _filter_new_events(events) if events else []
+        if len(new_events) < len(events):
+            print(f"🔁 [Webhook] 略過 {len(events) - len(new_events)} 個重送事件")
+        if new_events:
+            line_event_queue.push(*[_new_job(event) for event in new_events])
+        return True
+    except Exception as e:
+        print(f"❌ LINE 事件入列失敗: {e}")
+        return False
+
+
+def process_line_job(raw_job: Any, dispatch: Callable[[Dict[str, Any]], None]):
+    """
+    執行單一 LINE 事件工作（需在 Flask app context 中呼叫）
+
+    參數：
+    - raw_job: 佇列中的原始工作內容
+    - dispatch: 單一事件分派函數，通常為 src.linebot.dispatch_line_event(event)
+    """
+    job = json.loads(_decode(raw_job))
+    attempts = job.get('attempts', 0) + 1
+    retry_job = None
+    try:
+        if 'event' not in job:
+            # 舊格式工作（整個 body）：拆成每個事件一個工作，之後各自處理與重試
+            events = json.loads(job['body']).get('events', [])
+            if events:
+                line_event_queue.push(*[_new_job(event) for event in events])
+            return
+        dispatch(job['event'])
+    except Exception as e:
+        if attempts < MAX_JOB_ATTEMPTS:
+            print(f"⚠️ LINE 事件處理異常，稍後重試 ({attempts}/{MAX_JOB_ATTEMPTS}): {job.get('job_id')} - {e}")
+            job['attempts'] = attempts
+            retry_job = json.dumps(job, ensure_ascii=False)
+        else:
+            print(f"❌ LINE 事件處理失敗: {job.get('job_id')} - {e}")
+    finally:
+        if retry_job:
+            line_event_queue.retry(raw_job, retry_job)
+        else:
+            line_event_queue.ack(raw_job)
+
+
+def run_line_event_workers(app, dispatch: Callable[[Dict[str, Any]], None], concurrency: int = 4):
+    """啟動 LINE 事件 worker（阻塞直到收到中斷訊號）"""
+    line_event_queue.run_workers(app, lambda raw_job: process_line_job(raw_job, dispatch),
+                                 concurrency, 'line-worker')
@@ -4,7 +4,7 @@
 LINE Bot Blueprint - 只負責接收訊息、調用主代理人、回復訊息
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 import json
 import os
 import requests
@@ -19,12 +19,13 @@ from linebot.v3.messaging import (
     Configuration, ApiClient, MessagingApi, ReplyMessageRequest, 
     PushMessageRequest, TextMessage, FlexMessage, FlexContainer
 )
-from linebot.v3.webhooks import MessageEvent, TextMessageContent, PostbackEvent
+from linebot.v3.webhooks import Event, MessageEvent, TextMessageContent, PostbackEvent
+from linebot.v3.models.events import UnknownEvent
 
 # 本地模組導入
 backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, backend_dir)
-from tool.api_keys import get_api_key
+from tool.api_keys import lease_api_key
 
 # 創建 Blueprint
 linebot_bp = Blueprint('linebot', __name__)
@@ -41,6 +42,16 @@ configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
 handler = WebhookHandler(LINE_CHANNEL_SECRET)
 line_bot_api = MessagingApi(ApiClient(configuration))
 
+# (事件類型, 訊息類型) -> 處理函數，供 LINE worker 直接分派單一事件
+_line_event_handlers: Dict[tuple, Any] = {}
+
+def line_event_handler(event, message=None):
+    """註冊 LINE 事件處理函數（同時註冊到 WebhookHandler 與 LINE worker 的分派表）"""
+    def decorator(func):
+        _line_event_handlers[(event, message)] = func
+        return handler.add(event, message=message)(func)
+    return decorator
+
 # ===== 全局變數 =====
 # 移除 user_quiz_data，現在使用主代理人的記憶管理
 
@@ -52,6 +63,7 @@ import redis
 import random
 from accessories import redis_client, sqldb
 from sqlalchemy import text
+from src.line_event_queue import enqueue_line_webhook
 
 @linebot_bp.route('/generate-qr', methods=['POST', 'OPTIONS'])
 def generate_line_qr():
@@ -139,10 +151,12 @@ def check_line_binding():
         
         # 更新 MongoDB 中的用戶資料
         from accessories import mongo
+        from src.api import invalidate_user_cache
         result = mongo.db.user.update_one(
             {"email": student_email},
             {"$set": {"lineId": line_user_id}}
         )
+        invalidate_user_cache(student_email)
         
         if result.matched_count == 0:
             print(f"❌ 找不到用戶: {student_email}")
@@ -300,10 +314,12 @@ def handle_binding_command(user_id: str, binding_token: str, reply_token: str):
             
             # 更新 MongoDB 中的用戶資料
             from accessories import mongo
+            from src.api import invalidate_user_cache
             result = mongo.db.user.update_one(
                 {"email": user_email},
                 {"$set": {"lineId": user_id}}
             )
+            invalidate_user_cache(user_email)
             
             if result.matched_count > 0:
                 # 清除相關記錄
@@ -699,10 +715,12 @@ def handle_postback(event: PostbackEvent):
                     
                     # 更新 MongoDB 中的用戶資料
                     from accessories import mongo
+                    from src.api import invalidate_user_cache
                     result = mongo.db.user.update_one(
                         {"email": user_email},
                         {"$set": {"lineId": user_id}}
                     )
+                    invalidate_user_cache(user_email)
                     
                     if result.matched_count > 0:
                         # 清除相關記錄
@@ -743,12 +761,12 @@ def handle_postback(event: PostbackEvent):
         reply_text(event.reply_token, response)
 
 # ===== LINE Bot 事件處理 =====
-@handler.add(MessageEvent, message=TextMessageContent)
+@line_event_handler(MessageEvent, message=TextMessageContent)
 def handle_message_event(event):
     """LINE Bot 文字消息事件處理"""
     handle_message(event)
 
-@handler.add(PostbackEvent)
+@line_event_handler(PostbackEvent)
 def handle_postback_event(event):
     """LINE Bot 按鈕點擊事件處理"""
     handle_postback(event)
@@ -756,7 +774,7 @@ def handle_postback_event(event):
 # 添加 Follow 事件處理器
 from linebot.v3.webhooks import FollowEvent
 
-@handler.add(FollowEvent)
+@line_event_handler(FollowEvent)
 def handle_follow_event(event):
     """處理用戶加好友事件 - 支援自動綁定"""
     try:
@@ -942,7 +960,7 @@ def handle_follow_event(event):
 # 添加 Unfollow 事件處理器
 from linebot.v3.webhooks import UnfollowEvent
 
-@handler.add(UnfollowEvent)
+@line_event_handler(UnfollowEvent)
 def handle_unfollow_event(event):
     """處理用戶取消好友事件"""
     try:
@@ -976,6 +994,13 @@ def webhook():
         except Exception as parse_error:
             print(f"⚠️ [Webhook] 解析事件失敗（繼續處理）: {parse_error}")
         
+        if current_app.config.get('LINE_ASYNC_WEBHOOK', False):
+            # 先驗證簽章，再將事件寫入佇列由 LINE worker 處理，立即回應 LINE
+            handler.parser.parse(body, signature)
+            if enqueue_line_webhook(body, signature):
+                return jsonify({'status': 'OK'})
+            print(f"⚠️ [Webhook] 事件入列失敗，改為同步處理")
+        
         handler.handle(body, signature)
     except InvalidSignatureError:
         print(f"❌ [Webhook] Invalid signature")
@@ -988,24 +1013,46 @@ def webhook():
     
     return jsonify({'status': 'OK'})
 
-# ==================== LINE Bot 純邏輯函數 ====================
+def dispatch_line_event(event_data: Dict[str, Any]):
+    """
+    將單一已驗證的 Webhook 事件分派給註冊的處理函數（LINE worker 使用）
 
-def generate_quiz_question(requirements: str) -> str:
-    """生成測驗題目的純邏輯 - 調用 Gemini API"""
+    簽章已在 Webhook 入列前驗證，這裡不再經過 handler.handle。
+    對應規則與 WebhookHandler.handle 相同：先找「事件類型 + 訊息類型」，再找事件類型；
+    SDK 不認得的事件類型與 WebhookParser 一樣轉為 UnknownEvent。
+    """
     try:
-        from langchain_google_genai import ChatGoogleGenerativeAI
-        
-        api_key = get_api_key()
-        if not api_key:
-            return "❌ 無法獲取 Gemini API Key"
-        
-        # 初始化 Gemini
+        event = Event.from_dict(event_data)
+    except ValueError:
+        print(f"ℹ️ [LINE Worker] 未知的事件類型: {event_data.get('type')}")
+        event = UnknownEvent.new_from_json_dict(event_data)
+    func = None
+    if isinstance(event, MessageEvent):
+        func = _line_event_handlers.get((type(event), type(event.message)))
+    if func is None:
+        func = _line_event_handlers.get((type(event), None))
+    if func is None:
+        print(f"ℹ️ [LINE Worker] 沒有 {type(event).__name__} 的處理函數，略過")
+        return
+    func(event)
+
+# ==================== LINE Bot 純邏輯函數 ====================
+
+def _invoke_gemini(prompt: str, temperature: float = 0.7):
+    """以租約取得 API 金鑰呼叫 Gemini，並回報結果（429 / 5xx 會讓金鑰進入冷卻）"""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    
+    with lease_api_key() as lease:
         llm = ChatGoogleGenerativeAI(
             model="gemini-2.5-flash",
-            google_api_key=api_key,
-            temperature=0.7
+            google_api_key=lease.key,
+            temperature=temperature
         )
-        
+        return llm.invoke(prompt)
+
+def generate_quiz_question(requirements: str) -> str:
+    """生成測驗題目的純邏輯 - 調用 Gemini API"""
+    try:
         # 構建提示詞
         prompt = f"""請根據以下需求生成一道測驗題目：
 
@@ -1034,7 +1081,7 @@ def generate_quiz_question(requirements: str) -> str:
 請生成題目："""
         
         # 調用 Gemini API
-        response = llm.invoke(prompt)
+        response = _invoke_gemini(prompt, temperature=0.7)
         return response.content
         
     except Exception as e:
@@ -1044,19 +1091,6 @@ def generate_quiz_question(requirements: str) -> str:
 def generate_knowledge_point(query: str) -> str:
     """生成知識點的純邏輯 - 調用 Gemini API"""
     try:
-        from langchain_google_genai import ChatGoogleGenerativeAI
-        
-        api_key = get_api_key()
-        if not api_key:
-            return "❌ 無法獲取 Gemini API Key"
-        
-        # 初始化 Gemini
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            google_api_key=api_key,
-            temperature=0.8
-        )
-        
         # 構建提示詞
         if query and query.strip():
             # 根據用戶查詢生成相關知識
@@ -1131,7 +1165,7 @@ def generate_knowledge_point(query: str) -> str:
 請生成知識點："""
         
         # 調用 Gemini API
-        response = llm.invoke(prompt)
+        response = _invoke_gemini(prompt, temperature=0.8)
         content = response.content
         
         # 清理 HTML 和 Markdown 標記（以防萬一 AI 沒有遵守格式要求）
@@ -1162,18 +1196,6 @@ def generate_knowledge_point(query: str) -> str:
 def grade_answer(answer: str, correct_answer: str, question: str) -> str:
     """批改答案的純邏輯 - 調用 Gemini API"""
     try:
-        from langchain_google_genai import ChatGoogleGenerativeAI
-        
-        api_key = get_api_key()
-        if not api_key:
-            return "❌ 無法獲取 Gemini API Key"
-        
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            google_api_key=api_key,
-            temperature=0.3
-        )
-        
         # 如果沒有提供正確答案，讓 AI 根據題目判斷
         if not correct_answer and question:
             # 從題目中提取選項，讓 AI 判斷正確答案
@@ -1230,7 +1252,7 @@ def grade_answer(answer: str, correct_answer: str, question: str) -> str:
 
 💡 建議：可以進一步了解主鍵的設計原則和實務應用。"""
         
-        response = llm.invoke(prompt)
+        response = _invoke_gemini(prompt, temperature=0.3)
         result = response.content
         
         # 後處理：移除 markdown 格式，限制長度
@@ -1254,18 +1276,6 @@ def grade_answer(answer: str, correct_answer: str, question: str) -> str:
 def provide_tutoring(question: str, user_answer: str, correct_answer: str) -> str:
     """提供教學指導的純邏輯 - 調用 Gemini API"""
     try:
-        from langchain_google_genai import ChatGoogleGenerativeAI
-        
-        api_key = get_api_key()
-        if not api_key:
-            return "❌ 無法獲取 Gemini API Key"
-        
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            google_api_key=api_key,
-            temperature=0.7
-        )
-        
         prompt = f"""請作為 AI 導師，為以下問題提供教學指導：
 
 問題：{question}
@@ -1283,7 +1293,7 @@ def provide_tutoring(question: str, user_answer: str, correct_answer: str) -> st
 2. 內容要簡潔明瞭，適合 LINE Bot 顯示
 3. 包含適當的表情符號"""
         
-        response = llm.invoke(prompt)
+        response = _invoke_gemini(prompt, temperature=0.7)
         return response.content
         
     except Exception as e:
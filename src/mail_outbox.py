@@ -0,0 +1,236 @@
+"""
+郵件寄送佇列（outbox）- 郵件寫入 mail_outbox 資料表，由 mail worker 以共用 SMTP 連線分批寄送
+"""
+import smtplib
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import text
+from accessories import sqldb, mail
+
+# 單批取出的郵件數
+MAIL_BATCH_SIZE = 50
+# 沒有待寄郵件時的輪詢間隔（秒）
+MAIL_WORKER_POLL_SECONDS = 2
+# 單封郵件最多嘗試次數
+MAX_MAIL_ATTEMPTS = 5
+# 重試退避：首次 30 秒，之後加倍，最長 1 小時
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+# 狀態為 sending 超過此時間視為 worker 已中斷，可重新寄送
+SENDING_TIMEOUT_MINUTES = 10
+# SMTP 連線層級的錯誤：連線已失效，剩下的郵件不該再用這條連線寄送
+SMTP_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+
+def init_mail_tables():
+    """創建郵件相關資料表（啟動時呼叫一次）"""
+    try:
+        with sqldb.engine.connect() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS mail_info (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    sender VARCHAR(255) NOT NULL,
+                    receiver VARCHAR(255) NOT NULL,
+                    subject VARCHAR(255) NOT NULL,
+                    argument TEXT NULL,
+                    content TEXT NOT NULL,
+                    time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    due_time INT NOT NULL,
+                    mail_type INT NOT NULL
+                )
+            """))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS mail_outbox (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    recipient VARCHAR(255) NOT NULL,
+                    sender VARCHAR(255) NULL,
+                    subject VARCHAR(255) NOT NULL,
+                    body TEXT NULL,
+                    html MEDIUMTEXT NULL,
+                    status VARCHAR(20) NOT NULL DEFAULT 'pending',  -- pending / sending / sent / failed
+                    attempts INT NOT NULL DEFAULT 0,
+                    next_attempt_at DATETIME NOT NULL,
+                    locked_at DATETIME NULL,
+                    last_error TEXT NULL,
+                    created_at DATETIME NOT NULL,
+                    sent_at DATETIME NULL,
+                    INDEX idx_mail_outbox_due (status, next_attempt_at)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """))
+            conn.commit()
+        return True
+    except Exception as e:
+        print(f"❌ 初始化郵件資料表失敗: {e}")
+        return False
+
+
+def _build_message(recipient: str, subject: str, body: Optional[str], html: Optional[str],
+                   sender: Optional[str]) -> Message:
+    msg = Message(subject=subject, recipients=[recipient], body=body, html=html)
+    if sender:
+        msg.sender = sender
+    return msg
+
+
+def enqueue_mail(recipient: str, subject: str, body: Optional[str] = None, html: Optional[str] = None,
+                 sender: Optional[str] = None) -> Optional[int]:
+    """
+    寄送郵件：MAIL_USE_OUTBOX 啟用時寫入 outbox 由 mail worker 寄送，否則直接寄送
+
+    返回：
+    - outbox 郵件ID；直接寄送時返回 None
+    """
+    if current_app.config.get('MAIL_USE_OUTBOX', False):
+        now = datetime.now()
+        try:
+            with sqldb.engine.connect() as conn:
+                result = conn.execute(text("""
+                    INSERT INTO mail_outbox (recipient, sender, subject, body, html, next_attempt_at, created_at)
+                    VALUES (:recipient, :sender, :subject, :body, :html, :now, :now)
+                """), {
+                    'recipient': recipient,
+                    'sender': sender,
+                    'subject': subject,
+                    'body': body,
+                    'html': html,
+                    'now': now
+                })
+                conn.commit()
+                return result.lastrowid
+        except Exception as e:
+            print(f"⚠️ 郵件寫入 outbox 失敗，改為直接寄送: {e}")
+
+    mail.send(_build_message(recipient, subject, body, html, sender))
+    return None
+
+
+def _claim_due_mail(batch_size: int) -> List[Dict[str, Any]]:
+    """取出到期的待寄郵件並標記為 sending（SKIP LOCKED 讓多個 worker 不會取到同一封）"""
+    now = datetime.now()
+    stale_before = now - timedelta(minutes=SENDING_TIMEOUT_MINUTES)
+    with sqldb.engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT id, recipient, sender, subject, body, html, attempts
+            FROM mail_outbox
+            WHERE (status = 'pending' AND next_attempt_at <= :now)
+               OR (status = 'sending' AND locked_at < :stale_before)
+            ORDER BY next_attempt_at
+            LIMIT :limit
+            FOR UPDATE SKIP LOCKED
+        """), {'now': now, 'stale_before': stale_before, 'limit': batch_size}).mappings().all()
+        if rows:
+            conn.execute(text("""
+                UPDATE mail_outbox SET status = 'sending', locked_at = :now WHERE id = :id
+            """), [{'now': now, 'id': row['id']} for row in rows])
+        conn.commit()
+    return [dict(row) for row in rows]
+
+
+def _record_results(sent_ids: List[int], failures: List[Dict[str, Any]]):
+    """批次寫回寄送結果"""
+    now = datetime.now()
+    with sqldb.engine.connect() as conn:
+        if sent_ids:
+            conn.execute(text("""
+                UPDATE mail_outbox SET status = 'sent', sent_at = :now, locked_at = NULL WHERE id = :id
+            """), [{'now': now, 'id': mail_id} for mail_id in sent_ids])
+        if failures:
+            conn.execute(text("""
+                UPDATE mail_outbox
+                SET status = :status, attempts = :attempts, next_attempt_at = :next_attempt_at,
+                    last_error = :error, locked_at = NULL
+                WHERE id = :id
+            """), failures)
+        conn.commit()
+
+
+def _release_mail(mail_ids: List[int]):
+    """將已取出但未寄送的郵件放回 pending（不計入嘗試次數）"""
+    with sqldb.engine.connect() as conn:
+        conn.execute(text("""
+            UPDATE mail_outbox SET status = 'pending', locked_at = NULL WHERE id = :id
+        """), [{'id': mail_id} for mail_id in mail_ids])
+        conn.commit()
+
+
+def _failure(row: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+    attempts = row['attempts'] + 1
+    delay = min(RETRY_BASE_SECONDS * (2 ** (attempts - 1)), RETRY_MAX_SECONDS)
+    return {
+        'id': row['id'],
+        'status': 'failed' if attempts >= MAX_MAIL_ATTEMPTS else 'pending',
+        'attempts': attempts,
+        'next_attempt_at': datetime.now() + timedelta(seconds=delay),
+        'error': str(error)[:1000]
+    }
+
+
+def deliver_pending_mail(batch_size: int = MAIL_BATCH_SIZE) -> int:
+    """
+    寄送到期的郵件直到 outbox 清空（需在 Flask app context 中呼叫），返回寄出的數量
+
+    同一次呼叫內的所有批次共用一條 SMTP 連線。
+    """
+    delivered = 0
+    rows = _claim_due_mail(batch_size)
+    if not rows:
+        return 0
+
+    try:
+        with mail.connect() as connection:
+            while rows:
+                sent_ids, failures, unsent_ids = [], [], []
+                for index, row in enumerate(rows):
+                    try:
+                        connection.send(_build_message(row['recipient'], row['subject'], row['body'],
+                                                       row['html'], row['sender']))
+                        sent_ids.append(row['id'])
+                    except SMTP_CONNECTION_ERRORS as e:
+                        # 連線中斷：停止本輪寄送，剩下的郵件放回佇列，下一輪重新連線
+                        print(f"❌ SMTP 連線中斷，停止寄送: {e}")
+                        unsent_ids = [r['id'] for r in rows[index:]]
+                        break
+                    except Exception as e:
+                        print(f"⚠️ 郵件寄送失敗: {row['id']} -> {row['recipient']} - {e}")
+                        failures.append(_failure(row, e))
+                _record_results(sent_ids, failures)
+                delivered += len(sent_ids)
+                if unsent_ids:
+                    _release_mail(unsent_ids)
+                    rows = []
+                    break
+                rows = _claim_due_mail(batch_size)
+    except SMTP_CONNECTION_ERRORS as e:
+        # 無法建立連線（或關閉已中斷的連線）：已取出的郵件放回佇列，不計入嘗試次數
+        print(f"❌ SMTP 連線失敗: {e}")
+        if rows:
+            _release_mail([row['id'] for row in rows])
+    except Exception as e:
+        # 其他 SMTP 錯誤（例如認證失敗）：已取出但尚未寄送的郵件排入退避重試
+        print(f"❌ SMTP 連線失敗: {e}")
+        if rows:
+            _record_results([], [_failure(row, e) for row in rows])
+
+    if delivered:
+        print(f"📧 已寄出 {delivered} 封郵件")
+    return delivered
+
+
+def run_mail_worker(app, poll_seconds: int = MAIL_WORKER_POLL_SECONDS):
+    """啟動郵件寄送 worker（阻塞直到收到中斷訊號）"""
+    print("🚀 郵件寄送 worker 已啟動")
+    try:
+        while True:
+            try:
+                with app.app_context():
+                    delivered = deliver_pending_mail()
+            except Exception as e:
+                print(f"❌ 郵件寄送 worker 發生錯誤: {e}")
+                delivered = 0
+            if not delivered:
+                time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        print("🛑 收到中斷訊號，郵件寄送 worker 結束")
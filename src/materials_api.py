@@ -1,10 +1,13 @@
 from flask import Blueprint, jsonify, Response
 import os
 from accessories import mongo
+from src.exam_facets import get_exam_facets
 import markdown
 from bson.json_util import dumps
 import traceback
 from bson import ObjectId
+from werkzeug.security import safe_join
+from src.static_cache import send_cached_json_file
 
 # 建立 Blueprint
 materials_bp = Blueprint("materials", __name__)
@@ -27,19 +30,18 @@ def get_material(filename):
     if not filename.lower().endswith(".md"):
         filename += ".md"
 
-    filepath = os.path.join(MATERIALS_DIR, filename)
+    filepath = safe_join(MATERIALS_DIR, filename)
 
-    if not os.path.exists(filepath):
-        return jsonify({"error": "File not found"}), 404
-
-    # 讀取 Markdown
-    with open(filepath, "r", encoding="utf-8") as f:
-        md_content = f.read()
-
-    return jsonify({
+    # 經由記憶體快取讀取 Markdown（檔案修改後自動重新讀取，支援 ETag / 304 與壓縮）
+    response = send_cached_json_file(filepath, lambda md_content: {
         "filename": filename,
         "content": md_content
-    })
+    }) if filepath else None
+
+    if response is None:
+        return jsonify({"error": "File not found"}), 404
+
+    return response
 
 
 
@@ -65,16 +67,7 @@ def get_key_points():
     """
     從 mongodb exam 集合中抓取所有 key_points，去重後回傳
     """
-    exams = mongo.db.exam.find({}, {"key_points": 1})
-    key_points_set = set()
-    for exam in exams:
-        key_points = exam.get("key_points", [])
-        if isinstance(key_points, list):
-            for kp in key_points:
-                key_points_set.add(kp)
-        elif isinstance(key_points, str):
-            key_points_set.add(key_points)
-    return jsonify({"key_points": sorted(list(key_points_set))})
+    return jsonify({"key_points": get_exam_facets()["key_points"]})
 
 
 @materials_bp.route('/domain', methods=['GET'])
@@ -10,6 +10,13 @@ from typing import Dict, Any, List
 
 logger = logging.getLogger(__name__)
 
+# 每位用戶保留的最近訊息條數
+MAX_MEMORY_MESSAGES = 10
+# 記憶過期時間（30天）
+MEMORY_TTL_SECONDS = 30 * 24 * 60 * 60
+# 統計時每次 SCAN / pipeline 處理的 key 數量
+STATS_SCAN_BATCH = 500
+
 # Redis 客戶端（將在運行時初始化）
 _redis_client = None
 
@@ -34,6 +41,40 @@ def _get_memory_key(user_id: str) -> str:
     """獲取記憶的 Redis key"""
     return f"memory:{user_id}"
 
+def _decode_memory_list(memory_list) -> List[str]:
+    """解析 Redis 中 JSON 格式的記憶列表"""
+    memory = []
+    for msg in memory_list:
+        try:
+            if isinstance(msg, bytes):
+                msg_str = msg.decode('utf-8')
+            else:
+                msg_str = msg
+            memory.append(json.loads(msg_str))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            # 如果是舊格式（直接是字符串），直接使用
+            if isinstance(msg, bytes):
+                memory.append(msg.decode('utf-8'))
+            else:
+                memory.append(msg)
+    return memory
+
+def _append_message(user_id: str, message_data: str):
+    """
+    在一次往返中原子地寫入一條訊息
+    以 MULTI/EXEC pipeline 執行 rpush + ltrim + expire，不需先 llen 再決定是否截斷
+    """
+    redis_client = _get_redis()
+    memory_key = _get_memory_key(user_id)
+    message_json = json.dumps(message_data, ensure_ascii=False)
+    
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.rpush(memory_key, message_json)
+    # 只保留最新的 MAX_MEMORY_MESSAGES 條
+    pipe.ltrim(memory_key, -MAX_MEMORY_MESSAGES, -1)
+    pipe.expire(memory_key, MEMORY_TTL_SECONDS)
+    pipe.execute()
+
 def manage_user_memory(action: str, user_id: str = None) -> str:
     """管理用戶記憶
     
@@ -85,20 +126,7 @@ def _get_memory_summary(user_id: str) -> str:
             return "對話記憶摘要\n\n無對話記憶\n\n我們可以開始新的對話！"
         
         # 解析 JSON 格式的記憶
-        memory = []
-        for msg in memory_list:
-            try:
-                if isinstance(msg, bytes):
-                    msg_str = msg.decode('utf-8')
-                else:
-                    msg_str = msg
-                memory.append(json.loads(msg_str))
-            except (json.JSONDecodeError, UnicodeDecodeError):
-                # 如果是舊格式（直接是字符串），直接使用
-                if isinstance(msg, bytes):
-                    memory.append(msg.decode('utf-8'))
-                else:
-                    memory.append(msg)
+        memory = _decode_memory_list(memory_list)
         
         # 返回最近的對話記錄（最多10條，用於完整回答「我剛剛做了什麼」）
         recent_messages = memory[-min(10, len(memory)):]
@@ -128,25 +156,32 @@ def _clear_user_memory(user_id: str) -> str:
         return f"清除記憶失敗: {str(e)}"
 
 def _get_memory_stats() -> str:
-    """獲取記憶統計信息"""
+    """獲取記憶統計信息（以 SCAN 分批走訪，不使用會阻塞 Redis 的 KEYS）"""
     try:
         redis_client = _get_redis()
         
-        # 獲取所有記憶相關的 key
-        memory_keys = redis_client.keys("memory:*")
-        total_users = len(memory_keys)
         user_memories = {}
-        
-        for key in memory_keys:
-            if isinstance(key, bytes):
-                key_str = key.decode('utf-8')
-            else:
-                key_str = key
-            
-            user_id = key_str.replace("memory:", "")
-            memory_count = redis_client.llen(key_str)
-            user_memories[user_id] = memory_count
-        
+        batch = []
+        
+        def flush(keys):
+            # 每批 key 以一次 pipeline 取得條數
+            pipe = redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.llen(key)
+            for key, memory_count in zip(keys, pipe.execute()):
+                key_str = key.decode('utf-8') if isinstance(key, bytes) else key
+                if memory_count:
+                    user_memories[key_str.replace("memory:", "", 1)] = memory_count
+        
+        for key in redis_client.scan_iter(match="memory:*", count=STATS_SCAN_BATCH):
+            batch.append(key)
+            if len(batch) >= STATS_SCAN_BATCH:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+        
+        total_users = len(user_memories)
         stats_text = f"記憶統計\n\n總用戶數: {total_users}\n\n各用戶記憶條數:\n"
         
         if user_memories:
@@ -163,50 +198,14 @@ def _get_memory_stats() -> str:
 def add_user_message(user_id: str, message: str):
     """添加用戶訊息到記憶"""
     try:
-        redis_client = _get_redis()
-        memory_key = _get_memory_key(user_id)
-        
-        # 將訊息儲存為 JSON 格式
-        message_data = f"用戶: {message}"
-        message_json = json.dumps(message_data, ensure_ascii=False)
-        
-        # 使用 Redis list 的 rpush 添加訊息
-        redis_client.rpush(memory_key, message_json)
-        
-        # 限制記憶條數（保留最近10條）
-        memory_count = redis_client.llen(memory_key)
-        if memory_count > 10:
-            # 刪除最舊的訊息，保留最新的10條
-            redis_client.ltrim(memory_key, -10, -1)
-        
-        # 設置過期時間（30天）
-        redis_client.expire(memory_key, 30 * 24 * 60 * 60)
-        
+        _append_message(user_id, f"用戶: {message}")
     except Exception as e:
         logger.error(f"添加用戶訊息到記憶失敗: {e}")
 
 def add_ai_message(user_id: str, message: str):
     """添加AI回應到記憶"""
     try:
-        redis_client = _get_redis()
-        memory_key = _get_memory_key(user_id)
-        
-        # 將訊息儲存為 JSON 格式
-        message_data = f"助手: {message}"
-        message_json = json.dumps(message_data, ensure_ascii=False)
-        
-        # 使用 Redis list 的 rpush 添加訊息
-        redis_client.rpush(memory_key, message_json)
-        
-        # 限制記憶條數（保留最近10條）
-        memory_count = redis_client.llen(memory_key)
-        if memory_count > 10:
-            # 刪除最舊的訊息，保留最新的10條
-            redis_client.ltrim(memory_key, -10, -1)
-        
-        # 設置過期時間（30天）
-        redis_client.expire(memory_key, 30 * 24 * 60 * 60)
-        
+        _append_message(user_id, f"助手: {message}")
     except Exception as e:
         logger.error(f"添加AI回應到記憶失敗: {e}")
 
@@ -221,20 +220,7 @@ def get_user_memory(user_id: str) -> List[str]:
             return []
         
         # 解析 JSON 格式的記憶
-        memory = []
-        for msg in memory_list:
-            try:
-                if isinstance(msg, bytes):
-                    msg_str = msg.decode('utf-8')
-                else:
-                    msg_str = msg
-                memory.append(json.loads(msg_str))
-            except (json.JSONDecodeError, UnicodeDecodeError):
-                # 如果是舊格式（直接是字符串），直接使用
-                if isinstance(msg, bytes):
-                    memory.append(msg.decode('utf-8'))
-                else:
-                    memory.append(msg)
+        memory = _decode_memory_list(memory_list)
         
         return memory
     except Exception as e:
@@ -0,0 +1,136 @@
+"""
+MongoDB 索引清單與建立工具 - 啟動時建立索引，並以 explain 檢查熱門查詢是否命中索引
+
+手動檢查執行計畫：
+    python -m src.mongo_indexes
+"""
+from typing import Any, Dict, List
+from pymongo.errors import OperationFailure, PyMongoError
+from accessories import mongo
+
+# 索引清單：collection、keys（[(欄位, 方向)]）與 create_index 的其他選項
+INDEX_MANIFEST: List[Dict[str, Any]] = [
+    # 用戶：幾乎每個請求以 email 查詢，每個 LINE 事件以 lineId 查詢
+    {'collection': 'user', 'keys': [('email', 1)], 'name': 'uniq_user_email', 'unique': True},
+    {'collection': 'user', 'keys': [('lineId', 1)], 'name': 'idx_user_line_id', 'sparse': True},
+    # 考題：知識點測驗、考古題篩選、題型抽題
+    {'collection': 'exam', 'keys': [('key-points', 1)], 'name': 'idx_exam_key_points'},
+    {'collection': 'exam', 'keys': [('micro_concepts', 1)], 'name': 'idx_exam_micro_concepts'},
+    {'collection': 'exam', 'keys': [('school', 1), ('year', 1), ('department', 1)], 'name': 'idx_exam_school_year_dept'},
+    {'collection': 'exam', 'keys': [('type', 1)], 'name': 'idx_exam_type'},
+    {'collection': 'exam', 'keys': [('answer_type', 1), ('school', 1)], 'name': 'idx_exam_answer_type_school'},
+    # 教材筆記與劃記：以 (user, filename, type) 查詢，筆記依建立時間排序
+    {'collection': 'material_notes', 'keys': [('user', 1), ('filename', 1), ('type', 1), ('created_at', -1)],
+     'name': 'idx_notes_user_file_type_created'},
+    # 知識結構：以上層 ID 查詢
+    {'collection': 'block', 'keys': [('domain_id', 1)], 'name': 'idx_block_domain'},
+    {'collection': 'micro_concept', 'keys': [('block_id', 1)], 'name': 'idx_micro_concept_block'},
+    {'collection': 'micro_concept', 'keys': [('name', 1)], 'name': 'idx_micro_concept_name'},
+    # AI 導師學習進度
+    {'collection': 'learning_progress', 'keys': [('user_email', 1), ('session_id', 1), ('question_id', 1)],
+     'name': 'idx_progress_user_session_question'},
+]
+
+# 熱門查詢形狀：用於 explain 檢查（值僅作為範例，不影響執行計畫的選擇）
+QUERY_SHAPES: List[Dict[str, Any]] = [
+    {'collection': 'user', 'filter': {'email': 'user@example.com'}},
+    {'collection': 'user', 'filter': {'lineId': 'U0000000000'}},
+    {'collection': 'exam', 'filter': {'key-points': '資料庫'}},
+    {'collection': 'exam', 'filter': {'micro_concepts': '正規化'}},
+    {'collection': 'exam', 'filter': {'school': '國立臺灣大學', 'year': '113', 'department': '資訊管理學系'}},
+    {'collection': 'exam', 'filter': {'type': 'single'}},
+    {'collection': 'exam', 'filter': {'answer_type': 'single-choice', 'school': {'$ne': '測試學校(全題型)'}}},
+    {'collection': 'material_notes', 'filter': {'filename': 'a.md', 'user': 'user@example.com', 'type': 'note'},
+     'sort': [('created_at', -1)]},
+    {'collection': 'material_notes', 'filter': {'filename': 'a.md', 'user': 'user@example.com', 'type': 'highlight'}},
+    {'collection': 'block', 'filter': {'domain_id': None}},
+    {'collection': 'micro_concept', 'filter': {'block_id': {'$in': [None]}}},
+    {'collection': 'learning_progress', 'filter': {'user_email': 'user@example.com', 'session_id': 's', 'question_id': 'q'}},
+    {'collection': 'learning_progress', 'filter': {'user_email': 'user@example.com'}},
+]
+
+
+def ensure_mongo_indexes() -> Dict[str, Any]:
+    """
+    依 INDEX_MANIFEST 建立索引（已存在時不會重複建立）
+
+    返回：
+    - {'success': bool, 'created': [索引名稱], 'failed': [{'name', 'error'}]}
+    """
+    created, failed = [], []
+    for spec in INDEX_MANIFEST:
+        options = {k: v for k, v in spec.items() if k not in ('collection', 'keys')}
+        try:
+            mongo.db[spec['collection']].create_index(spec['keys'], **options)
+            created.append(spec['name'])
+        except OperationFailure as e:
+            # 常見原因：既有資料違反唯一索引、同名索引選項不同
+            print(f"⚠️ 建立索引失敗 {spec['collection']}.{spec['name']}: {e}")
+            failed.append({'name': spec['name'], 'error': str(e)})
+        except PyMongoError as e:
+            print(f"❌ 建立索引失敗 {spec['collection']}.{spec['name']}: {e}")
+            failed.append({'name': spec['name'], 'error': str(e)})
+
+    if created:
+        print(f"✅ MongoDB 索引檢查完成: {len(created)} 個")
+    return {'success': not failed, 'created': created, 'failed': failed}
+
+
+def _walk_plan(plan: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """取出執行計畫樹中的所有節點"""
+    nodes = [plan]
+    for child_key in ('inputStage', 'queryPlan'):
+        if isinstance(plan.get(child_key), dict):
+            nodes.extend(_walk_plan(plan[child_key]))
+    for child in plan.get('inputStages', []):
+        nodes.extend(_walk_plan(child))
+    return nodes
+
+
+def explain_query_shapes() -> List[Dict[str, Any]]:
+    """
+    以 explain 檢查 QUERY_SHAPES 的執行計畫
+
+    返回：
+    - [{'collection', 'filter', 'stages', 'index', 'collscan'}]
+    """
+    report = []
+    for shape in QUERY_SHAPES:
+        cursor = mongo.db[shape['collection']].find(shape['filter'])
+        if shape.get('sort'):
+            cursor = cursor.sort(shape['sort'])
+        entry = {'collection': shape['collection'], 'filter': shape['filter']}
+        try:
+            winning_plan = cursor.explain().get('queryPlanner', {}).get('winningPlan', {})
+            nodes = _walk_plan(winning_plan)
+            stages = [node['stage'] for node in nodes if node.get('stage')]
+            index_names = [node['indexName'] for node in nodes if node.get('indexName')]
+            entry.update({'stages': stages, 'index': index_names, 'collscan': 'COLLSCAN' in stages})
+        except PyMongoError as e:
+            entry.update({'stages': [], 'index': [], 'collscan': None, 'error': str(e)})
+        report.append(entry)
+    return report
+
+
+def print_explain_report(report: List[Dict[str, Any]]) -> bool:
+    """輸出 explain 結果，返回是否所有查詢都使用索引"""
+    all_indexed = True
+    for entry in report:
+        if entry.get('error'):
+            print(f"❌ {entry['collection']} {entry['filter']}: {entry['error']}")
+            all_indexed = False
+        elif entry['collscan']:
+            print(f"⚠️ COLLSCAN {entry['collection']} {entry['filter']} -> {' > '.join(entry['stages'])}")
+            all_indexed = False
+        else:
+            print(f"✅ {entry['collection']} {entry['filter']} -> {', '.join(entry['index'])}")
+    return all_indexed
+
+
+if __name__ == '__main__':
+    import sys
+    from app import app
+
+    with app.app_context():
+        ensure_mongo_indexes()
+        sys.exit(0 if print_explain_report(explain_query_shapes()) else 1)
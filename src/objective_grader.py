@@ -0,0 +1,241 @@
+"""
+客觀題本地評分引擎
+
+單選題、多選題、是非題的正確答案已存放於 exam 文件中，
+不需要呼叫 Gemini 即可評分。本模組負責將標準答案與學生答案正規化後直接比對：
+- 單選題：選項代號對應（a / (A) / A. xxx / 選項全文 皆視為同一選項）
+- 多選題：選項代號集合比對（順序無關）
+- 是非題：同義詞對照表（是/對/正確/O/T/True ...）
+
+只要任一方無法確定地正規化（例如標準答案為一段說明文字），
+即回傳 None，交由 AI 評分處理，確保不會誤判。
+"""
+import re
+from typing import Any, Dict, List, Optional, Set
+
+# 可在本地評分的題型
+OBJECTIVE_QUESTION_TYPES = {'single-choice', 'multiple-choice', 'true-false'}
+
+# 是非題同義詞表（皆已轉為小寫）
+TRUE_SYNONYMS = {
+    '是', '對', '正確', '真', '成立', 'o', '○', '〇', 'v', '√', '✓', '✔',
+    't', 'true', 'y', 'yes', 'correct', 'right', '1'
+}
+FALSE_SYNONYMS = {
+    '否', '錯', '錯誤', '假', '不對', '不正確', '不成立', 'x', '×', '✗', '✘',
+    'f', 'false', 'n', 'no', 'incorrect', 'wrong', '0'
+}
+
+# 選項代號格式：a / A / (A) / （A） / A. / A) / A: / A、 / 選項A
+_OPTION_LABEL_PATTERN = re.compile(
+    r'^\s*(?:選項\s*)?[\(（\[]?\s*([A-Za-z])\s*(?:[\)）\]]\s*[\.．:：、]?|[\.．:：、]|$)\s*(.*)$',
+    re.DOTALL
+)
+_MULTI_SPLIT_PATTERN = re.compile(r'[\s,，、;；/&和與]+')
+
+
+def _normalize_text(value: Any) -> str:
+    """去除空白與大小寫差異，供文字比對使用"""
+    return re.sub(r'\s+', '', str(value)).lower()
+
+
+def _split_option_label(text: Any) -> Optional[tuple]:
+    """拆出選項代號與內容，例如 '(B)Selection Sort' -> ('B', 'Selection Sort')"""
+    if not isinstance(text, str):
+        return None
+    match = _OPTION_LABEL_PATTERN.match(text.strip())
+    if not match:
+        return None
+    return match.group(1).upper(), match.group(2).strip()
+
+
+def _build_option_index(options: List[Any]) -> Dict[str, str]:
+    """建立「正規化選項內容 -> 選項代號」對照表"""
+    index = {}
+    if not isinstance(options, list):
+        return index
+    for i, option in enumerate(options):
+        if not isinstance(option, str) or not option.strip():
+            continue
+        label = chr(ord('A') + i) if i < 26 else None
+        split = _split_option_label(option)
+        content = option
+        if split and split[1]:
+            label, content = split
+        if label:
+            index[_normalize_text(content)] = label
+            index[_normalize_text(option)] = label
+    return index
+
+
+def _resolve_single_label(answer: Any, options: List[Any]) -> Optional[str]:
+    """將單一答案解析為選項代號，無法確定時回傳 None"""
+    if isinstance(answer, list):
+        if len(answer) != 1:
+            return None
+        answer = answer[0]
+    if isinstance(answer, int) and not isinstance(answer, bool):
+        # 前端以選項索引作答
+        if isinstance(options, list) and 0 <= answer < len(options):
+            return chr(ord('A') + answer)
+        return None
+    if not isinstance(answer, str) or not answer.strip():
+        return None
+
+    option_count = len(options) if isinstance(options, list) else 0
+    option_index = _build_option_index(options)
+
+    # 1. 完全等於某個選項（含代號或僅內容）
+    normalized = _normalize_text(answer)
+    if normalized in option_index:
+        return option_index[normalized]
+
+    # 2. 以選項代號開頭（a / (A) / A. xxx）
+    split = _split_option_label(answer)
+    if split:
+        label, content = split
+        if option_count and ord(label) - ord('A') >= option_count:
+            return None
+        # 代號後若附帶內容，需與該選項內容一致才採信
+        if content and option_index:
+            content_label = option_index.get(_normalize_text(content))
+            if content_label and content_label != label:
+                return None
+        return label
+    return None
+
+
+def _resolve_label_set(answer: Any, options: List[Any]) -> Optional[Set[str]]:
+    """將多選答案解析為選項代號集合，無法確定時回傳 None"""
+    if isinstance(answer, list):
+        items = answer
+    elif isinstance(answer, str):
+        stripped = answer.strip()
+        if not stripped:
+            return None
+        # 整串即為單一選項（選項全文、單一代號或「代號 + 該選項內容」）；
+        # 代號後接其他文字（如 "A、B、D"）時改以多選格式解析
+        single = _resolve_single_label(stripped, options)
+        split = _split_option_label(stripped)
+        if single and (not split or not split[1] or _normalize_text(split[1]) in _build_option_index(options)):
+            return {single}
+        # 緊湊寫法 "ABD" / "abd"
+        compact = re.sub(r'[\s,，、;；()（）\[\]]+', '', stripped)
+        option_count = len(options) if isinstance(options, list) else 0
+        if option_count and compact.isascii() and compact.isalpha() and len(compact) <= option_count:
+            items = list(compact)
+        else:
+            items = [part for part in _MULTI_SPLIT_PATTERN.split(stripped) if part]
+    else:
+        return None
+
+    labels = set()
+    for item in items:
+        label = _resolve_single_label(item, options)
+        if not label:
+            return None
+        labels.add(label)
+    return labels or None
+
+
+def _resolve_boolean(answer: Any, options: Optional[List[Any]] = None) -> Optional[bool]:
+    """將是非題答案解析為布林值（選項索引或代號先對應回選項內容），無法確定時回傳 None"""
+    if isinstance(answer, bool):
+        return answer
+    if isinstance(answer, list) and len(answer) == 1:
+        answer = answer[0]
+    if isinstance(options, list) and options:
+        # 例如選項為 ["是", "否"] 時，0 / "A" 代表「是」
+        label = _resolve_single_label(answer, options)
+        option = options[ord(label) - ord('A')] if label else None
+        if isinstance(option, str):
+            option_value = _resolve_boolean(option)
+            if option_value is not None:
+                return option_value
+    if not isinstance(answer, (str, int)):
+        return None
+    normalized = _normalize_text(answer).strip('。.!！')
+    # 去除選項代號前綴，例如 "(A)正確"
+    split = _split_option_label(str(answer))
+    if split and split[1]:
+        normalized_content = _normalize_text(split[1]).strip('。.!！')
+        if normalized_content in TRUE_SYNONYMS or normalized_content in FALSE_SYNONYMS:
+            normalized = normalized_content
+    if normalized in TRUE_SYNONYMS:
+        return True
+    if normalized in FALSE_SYNONYMS:
+        return False
+    return None
+
+
+def _build_result(question_data: Dict[str, Any], is_correct: bool, correct_display: str) -> Dict[str, Any]:
+    """組成與 AI 評分相同格式的結果"""
+    score = 100 if is_correct else 0
+    if is_correct:
+        feedback = {
+            'explanation': f'答案正確，正確答案為 {correct_display}',
+            'strengths': '正確掌握本題觀念',
+            'weaknesses': '無明顯需要改進之處',
+            'suggestions': '繼續保持，可嘗試更進階的題目'
+        }
+    else:
+        feedback = {
+            'explanation': f'答案錯誤，正確答案為 {correct_display}',
+            'strengths': '勇於嘗試，認真作答',
+            'weaknesses': '需要加強對相關概念的理解',
+            'suggestions': '建議複習相關章節，多做練習題'
+        }
+    return {
+        'question_id': question_data.get('question_id', ''),
+        'is_correct': is_correct,
+        'score': score,
+        'feedback': feedback,
+        'graded_by': 'local'
+    }
+
+
+def grade_objective_answer(question_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    以標準答案在本地評分客觀題
+
+    參數：
+    - question_data: 與 batch_grade_ai_questions 相同格式的題目資料
+
+    返回：
+    - 評分結果字典；若題型不適用或答案無法確定解析則返回 None（交由 AI 評分）
+    """
+    question_type = question_data.get('question_type', '')
+    if question_type not in OBJECTIVE_QUESTION_TYPES:
+        return None
+
+    user_answer = question_data.get('user_answer')
+    correct_answer = question_data.get('correct_answer')
+    options = question_data.get('options') or []
+    if isinstance(correct_answer, str):
+        correct_answer = correct_answer.strip()
+    if not correct_answer:
+        return None
+
+    try:
+        if question_type == 'true-false':
+            expected = _resolve_boolean(correct_answer, options)
+            actual = _resolve_boolean(user_answer, options)
+            if expected is None or actual is None:
+                return None
+            return _build_result(question_data, expected == actual, '是' if expected else '否')
+
+        if question_type == 'single-choice':
+            expected = _resolve_single_label(correct_answer, options)
+            actual = _resolve_single_label(user_answer, options)
+            if not expected or not actual:
+                return None
+            return _build_result(question_data, expected == actual, expected)
+
+        expected_set = _resolve_label_set(correct_answer, options)
+        actual_set = _resolve_label_set(user_answer, options)
+        if not expected_set or not actual_set:
+            return None
+        return _build_result(question_data, expected_set == actual_set, ''.join(sorted(expected_set)))
+    except Exception as e:
+        print(f"⚠️ 本地評分失敗，改用AI評分: {e}")
+        return None
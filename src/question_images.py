@@ -0,0 +1,83 @@
+"""
+題目圖片引用 - 產生帶內容版本的圖片 URL（相容模式為 base64 data URL）
+"""
+import base64
+import os
+from typing import Optional
+from urllib.parse import quote, urlencode
+from flask import current_app, g, has_request_context, request, url_for
+from src.static_cache import guess_image_mimetype, load_asset
+
+# 題目圖片目錄（src/picture）
+QUESTION_IMAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'picture')
+# 圖片端點（app.py 的 serve_static_image）與其路徑（無請求上下文時組成絕對 URL 使用，例如批改 worker）
+QUESTION_IMAGE_ENDPOINT = 'serve_static_image'
+QUESTION_IMAGE_PATH = '/static/images/'
+
+
+def _image_path(image_filename: str) -> Optional[str]:
+    """取得圖片檔案路徑，檔名不合法（例如含 ..）時返回 None"""
+    if not image_filename or not image_filename.strip():
+        return None
+    image_path = os.path.normpath(os.path.join(QUESTION_IMAGE_DIR, image_filename))
+    if not image_path.startswith(QUESTION_IMAGE_DIR + os.sep):
+        return None
+    return image_path
+
+
+def inline_images_requested() -> bool:
+    """是否使用相容模式內嵌 base64（請求參數 inline_images 優先於 QUIZ_INLINE_IMAGES 設定）"""
+    if has_request_context():
+        flag = request.args.get('inline_images')
+        if flag is not None:
+            return flag.lower() in ('1', 'true', 'yes')
+    return current_app.config.get('QUIZ_INLINE_IMAGES', False)
+
+
+def get_image_base64(image_filename: str) -> Optional[str]:
+    """讀取圖片檔案並轉換為 base64 編碼（檔案內容經由靜態快取，不重複讀取磁碟）"""
+    try:
+        image_path = _image_path(image_filename)
+        if not image_path:
+            return None
+        asset = load_asset(image_path, guess_image_mimetype(image_filename))
+        return base64.b64encode(asset.body).decode('utf-8') if asset else None
+    except Exception as e:
+        print(f"讀取圖片時發生錯誤: {str(e)}")
+        return None
+
+
+def get_question_image_url(image_filename: str, width: Optional[int] = None) -> Optional[str]:
+    """取得帶內容版本的圖片 URL，檔案不存在時返回 None"""
+    image_path = _image_path(image_filename)
+    if not image_path:
+        return None
+    asset = load_asset(image_path, guess_image_mimetype(image_filename))
+    if asset is None:
+        return None
+    params = {'v': asset.version}
+    if width:
+        params['w'] = width
+    if has_request_context():
+        return url_for(QUESTION_IMAGE_ENDPOINT, filename=image_filename, _external=True, **params)
+    # 前端與 API 不同來源，相對路徑會被解析到前端網域，因此需帶上 API 網址：
+    # 優先使用設定的 API_BASE_URL，其次為批改工作記錄的提交請求網址
+    api_base_url = (current_app.config.get('API_BASE_URL') or g.get('api_base_url') or '').rstrip('/')
+    if not api_base_url:
+        print(f"⚠️ 未設定 API_BASE_URL，題目圖片改用相對路徑: {image_filename}")
+    return f"{api_base_url}{QUESTION_IMAGE_PATH}{quote(image_filename)}?{urlencode(params)}"
+
+
+def get_question_image_src(image_filename: str) -> Optional[str]:
+    """
+    取得可直接放入 <img src> 的圖片來源
+
+    返回：
+    - 預設為帶版本的圖片 URL；相容模式為 data URL；檔案不存在時返回 None
+    """
+    if inline_images_requested():
+        image_base64 = get_image_base64(image_filename)
+        if not image_base64:
+            return None
+        return f"data:{guess_image_mimetype(image_filename)};base64,{image_base64}"
+    return get_question_image_url(image_filename)
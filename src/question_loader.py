@@ -0,0 +1,87 @@
+"""
+題目批次載入工具 - 以單次 $in 查詢依指定順序取回題目（支援 ObjectId 與字串ID、欄位投影）
+"""
+from typing import Any, Dict, Iterable, List, Optional
+from bson import ObjectId
+from accessories import mongo
+
+# 組卷、批改與結果頁所需的題目欄位
+QUIZ_QUESTION_PROJECTION = {
+    'type': 1,
+    'school': 1,
+    'department': 1,
+    'year': 1,
+    'question_number': 1,
+    'question_text': 1,
+    'group_question_text': 1,
+    'options': 1,
+    'answer': 1,
+    'correct_answer': 1,
+    'answer_type': 1,
+    'image_file': 1,
+    'detail-answer': 1,
+    'explanation': 1,
+    'key-points': 1,
+    'key_points': 1,
+    'micro_concepts': 1,
+    'topic': 1,
+    'difficulty': 1,
+    'difficulty level': 1,
+    'difficulty_level': 1,
+    'error_reason': 1,
+    'sub_questions': 1,
+    'created_at': 1,
+    'id': 1
+}
+
+
+def _id_candidates(question_id: Any) -> List[Any]:
+    """將題目ID展開為可能的 _id 值（ObjectId 與原始字串）"""
+    if question_id is None or question_id == '':
+        return []
+    if isinstance(question_id, ObjectId):
+        return [question_id, str(question_id)]
+    candidates = [question_id]
+    if isinstance(question_id, str) and ObjectId.is_valid(question_id):
+        candidates.insert(0, ObjectId(question_id))
+    return candidates
+
+
+def load_question_map(question_ids: Iterable[Any], projection: Optional[Dict[str, int]] = None,
+                      collection: str = 'exam') -> Dict[str, Dict[str, Any]]:
+    """
+    以單次 $in 查詢取回題目，返回 {str(_id): 題目文件} 對照表
+
+    參數：
+    - question_ids: 題目ID列表（ObjectId 或字串皆可）
+    - projection: MongoDB 欄位投影，None 表示取回完整文件
+    - collection: 題目所在的 collection 名稱
+    """
+    lookup_values = []
+    seen = set()
+    for question_id in question_ids or []:
+        for candidate in _id_candidates(question_id):
+            key = (type(candidate).__name__, str(candidate))
+            if key not in seen:
+                seen.add(key)
+                lookup_values.append(candidate)
+
+    if not lookup_values:
+        return {}
+
+    cursor = mongo.db[collection].find({'_id': {'$in': lookup_values}}, projection)
+    return {str(doc['_id']): doc for doc in cursor}
+
+
+def load_questions_by_ids(question_ids: Iterable[Any], projection: Optional[Dict[str, int]] = None,
+                          collection: str = 'exam') -> List[Optional[Dict[str, Any]]]:
+    """
+    依傳入順序批次載入題目
+
+    返回：
+    - 與 question_ids 等長的列表，找不到的題目以 None 佔位，方便呼叫端保留題號
+    """
+    question_ids = list(question_ids or [])
+    question_map = load_question_map(question_ids, projection, collection)
+    return [question_map.get(str(question_id)) if question_id not in (None, '') else None
+            for question_id in question_ids]
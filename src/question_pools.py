@@ -0,0 +1,244 @@
+"""
+題目池（question pool）- 以 Redis 集合預先索引題目ID，組卷時直接隨機抽題
+"""
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+import redis
+from pymongo.errors import PyMongoError
+from accessories import mongo, redis_client
+from src.question_loader import load_questions_by_ids
+
+POOL_PREFIX = 'question_pool:v1'
+# 目前世代指標；不存在時代表題目池尚未建立或已失效
+POOL_GENERATION_KEY = f'{POOL_PREFIX}:generation'
+POOL_BUILD_LOCK_KEY = f'{POOL_PREFIX}:build_lock'
+# 世代指標保存時間（秒），作為漏掉失效通知時的保險；集合本身多保留一小時，讓切換世代時進行中的抽題不落空
+POOL_TTL_SECONDS = 24 * 3600
+POOL_KEY_TTL_SECONDS = POOL_TTL_SECONDS + 3600
+POOL_BUILD_LOCK_SECONDS = 120
+# 多條件抽題的暫存集合保存時間（秒）
+TEMP_POOL_TTL_SECONDS = 30
+# 建立題目池時每批 pipeline 的題目數
+BUILD_BATCH_SIZE = 500
+
+# 題目池維度 -> exam 文件欄位（依序嘗試，取第一個有值的欄位）
+POOL_DIMENSIONS: Dict[str, tuple] = {
+    'key_point': ('key-points',),
+    'micro_concept': ('micro_concepts',),
+    'difficulty': ('difficulty level', 'difficulty_level', 'difficulty'),
+    'answer_type': ('answer_type',),
+    'school': ('school',)
+}
+ALL_POOL = 'all'
+_POOL_PROJECTION = {field: 1 for fields in POOL_DIMENSIONS.values() for field in fields}
+
+# 組卷請求的難度參數 -> 題目的難度值
+DIFFICULTY_LABELS = {'easy': '簡單', 'medium': '中等', 'hard': '困難'}
+
+
+class QuestionPoolUnavailable(Exception):
+    """題目池無法使用（Redis / MongoDB 錯誤或重建中），呼叫端應回退為 MongoDB 查詢"""
+
+
+def _decode(value: Any) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+
+def _pool_key(generation: str, dimension: str, value: Any = None) -> str:
+    if dimension == ALL_POOL:
+        return f'{POOL_PREFIX}:{generation}:{ALL_POOL}'
+    return f'{POOL_PREFIX}:{generation}:{dimension}:{value}'
+
+
+def _values_key(generation: str, dimension: str) -> str:
+    """各維度已出現的值（例如全部題型）"""
+    return f'{POOL_PREFIX}:{generation}:values:{dimension}'
+
+
+def _dimension_values(doc: Dict[str, Any], dimension: str) -> List[str]:
+    """取出題目在某維度的值（陣列欄位展開，忽略空值）"""
+    for field in POOL_DIMENSIONS[dimension]:
+        value = doc.get(field)
+        if value in (None, '', []):
+            continue
+        values = value if isinstance(value, list) else [value]
+        return [str(v) for v in values if v not in (None, '')]
+    return []
+
+
+def _add_docs(pipe, generation: str, docs: Iterable[Dict[str, Any]]):
+    """將題目加入指定世代的各個集合（只排入 pipeline，不執行）"""
+    touched = set()
+    for doc in docs:
+        question_id = str(doc['_id'])
+        key = _pool_key(generation, ALL_POOL)
+        pipe.sadd(key, question_id)
+        touched.add(key)
+        for dimension in POOL_DIMENSIONS:
+            for value in _dimension_values(doc, dimension):
+                key = _pool_key(generation, dimension, value)
+                pipe.sadd(key, question_id)
+                pipe.sadd(_values_key(generation, dimension), value)
+                touched.update((key, _values_key(generation, dimension)))
+    for key in touched:
+        pipe.expire(key, POOL_KEY_TTL_SECONDS)
+
+
+def build_question_pools() -> Optional[str]:
+    """
+    掃描 exam 集合建立新世代的題目池，完成後切換世代指標
+
+    返回：
+    - 新世代ID；其他程序正在重建時返回 None
+    """
+    lock_token = uuid.uuid4().hex
+    if not redis_client.set(POOL_BUILD_LOCK_KEY, lock_token, nx=True, ex=POOL_BUILD_LOCK_SECONDS):
+        return None
+
+    generation = uuid.uuid4().hex[:12]
+    try:
+        count = 0
+        batch = []
+        for doc in mongo.db.exam.find({}, _POOL_PROJECTION).batch_size(BUILD_BATCH_SIZE):
+            batch.append(doc)
+            if len(batch) >= BUILD_BATCH_SIZE:
+                with redis_client.pipeline(transaction=False) as pipe:
+                    _add_docs(pipe, generation, batch)
+                    pipe.execute()
+                count += len(batch)
+                batch = []
+        if batch:
+            with redis_client.pipeline(transaction=False) as pipe:
+                _add_docs(pipe, generation, batch)
+                pipe.execute()
+            count += len(batch)
+
+        redis_client.set(POOL_GENERATION_KEY, generation, ex=POOL_TTL_SECONDS)
+        print(f"✅ 題目池建立完成: {count} 題 (世代 {generation})")
+        return generation
+    finally:
+        if _decode(redis_client.get(POOL_BUILD_LOCK_KEY) or b'') == lock_token:
+            redis_client.delete(POOL_BUILD_LOCK_KEY)
+
+
+def _current_generation() -> str:
+    """取得目前世代，題目池不存在時先建立"""
+    try:
+        generation = redis_client.get(POOL_GENERATION_KEY)
+        if generation:
+            return _decode(generation)
+        generation = build_question_pools()
+    except redis.RedisError as e:
+        raise QuestionPoolUnavailable(f'Redis 錯誤: {e}')
+    except PyMongoError as e:
+        # 建立題目池時掃描 exam 失敗，本次改由呼叫端的 MongoDB 查詢處理
+        raise QuestionPoolUnavailable(f'建立題目池失敗: {e}')
+    if not generation:
+        raise QuestionPoolUnavailable('題目池重建中')
+    return generation
+
+
+def draw_question_ids(count: int, include: Optional[Dict[str, Any]] = None,
+                      exclude: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    從題目池隨機抽出不重複的題目ID
+
+    參數：
+    - count: 抽題數量（題目不足時返回全部符合的題目）
+    - include: {維度: 值}，題目需同時符合所有條件；None 或空字典表示全部題目
+    - exclude: {維度: 值}，排除符合任一條件的題目
+
+    返回：
+    - 題目ID字串列表（順序隨機）
+
+    例外：
+    - QuestionPoolUnavailable: 呼叫端應回退為 MongoDB 查詢
+    """
+    if count <= 0:
+        return []
+    generation = _current_generation()
+    include_keys = [_pool_key(generation, dimension, value) for dimension, value in (include or {}).items()]
+    exclude_keys = [_pool_key(generation, dimension, value) for dimension, value in (exclude or {}).items()]
+    if not include_keys:
+        include_keys = [_pool_key(generation, ALL_POOL)]
+
+    try:
+        if len(include_keys) == 1 and not exclude_keys:
+            return [_decode(member) for member in redis_client.srandmember(include_keys[0], count)]
+
+        temp_key = f'{POOL_PREFIX}:tmp:{uuid.uuid4().hex}'
+        with redis_client.pipeline(transaction=False) as pipe:
+            if len(include_keys) == 1:
+                pipe.sdiffstore(temp_key, include_keys + exclude_keys)
+            else:
+                pipe.sinterstore(temp_key, include_keys)
+                if exclude_keys:
+                    pipe.sdiffstore(temp_key, [temp_key] + exclude_keys)
+            pipe.expire(temp_key, TEMP_POOL_TTL_SECONDS)
+            pipe.srandmember(temp_key, count)
+            pipe.delete(temp_key)
+            results = pipe.execute()
+        return [_decode(member) for member in results[-2]]
+    except redis.RedisError as e:
+        raise QuestionPoolUnavailable(f'Redis 錯誤: {e}')
+
+
+def pool_values(dimension: str) -> List[str]:
+    """取得某維度目前所有的值（例如全部題型）"""
+    generation = _current_generation()
+    try:
+        return sorted(_decode(value) for value in redis_client.smembers(_values_key(generation, dimension)))
+    except redis.RedisError as e:
+        raise QuestionPoolUnavailable(f'Redis 錯誤: {e}')
+
+
+def draw_knowledge_questions(topic: str, count: int, difficulty: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    知識點測驗抽題
+
+    優先抽取同時符合知識點與難度的題目，不足時放寬為只依知識點，仍不足時從全部題目抽取
+    （與原本「知識點題目不足時改用全部題目」的行為一致）。
+    """
+    label = DIFFICULTY_LABELS.get(difficulty, difficulty)
+    candidates = [{'key_point': topic, 'difficulty': label}] if label else []
+    candidates += [{'key_point': topic}, None]
+    question_ids: List[str] = []
+    for include in candidates:
+        question_ids = draw_question_ids(count, include)
+        if len(question_ids) >= count:
+            break
+    return [doc for doc in load_questions_by_ids(question_ids) if doc]
+
+
+def add_questions_to_pools(docs: Iterable[Dict[str, Any]]):
+    """
+    新增題目後增量加入題目池（文件需已有 _id）
+
+    題目池不存在時不做任何事（下次抽題時會完整建立）；更新失敗時清除世代指標。
+    """
+    docs = [doc for doc in docs if doc.get('_id') is not None]
+    if not docs:
+        return
+    try:
+        generation = redis_client.get(POOL_GENERATION_KEY)
+        if not generation:
+            return
+        with redis_client.pipeline(transaction=False) as pipe:
+            _add_docs(pipe, _decode(generation), docs)
+            pipe.execute()
+    except Exception as e:
+        print(f"⚠️ 更新題目池失敗，改為清除: {e}")
+        invalidate_question_pools()
+
+
+def invalidate_question_pools(client: Optional[redis.Redis] = None):
+    """清除題目池（題目大量匯入、修改或刪除後呼叫；舊世代的集合會自行過期）"""
+    try:
+        (client or redis_client).delete(POOL_GENERATION_KEY)
+    except Exception as e:
+        print(f"⚠️ 清除題目池失敗: {e}")
+
+
+def invalidate_question_pools_by_url(redis_url: str):
+    """供獨立執行的匯入工具使用（不經 Flask app）"""
+    invalidate_question_pools(redis.Redis.from_url(redis_url))
@@ -5,12 +5,25 @@ from src.api import get_user_info, verify_token
 import jwt
 from datetime import datetime
 import random
-import base64
 import os
 import json
 from sqlalchemy import text
 from bson import ObjectId
 from src.grade_answer import batch_grade_ai_questions
+from src.grading_progress import (
+    update_progress_status, get_progress_status, publish_question_graded,
+    stream_progress_events, new_progress_id, TOTAL_STAGES
+)
+from src.concept_mastery import record_quiz_attempts
+from src.question_images import get_question_image_src
+from src.quiz_persistence import upsert_quiz_history, save_graded_answers
+from src.exam_catalogue import exam_catalogue_response
+from src.exam_facets import get_exam_facets
+from src.question_pools import draw_knowledge_questions, QuestionPoolUnavailable
+from src.question_loader import load_questions_by_ids, QUIZ_QUESTION_PROJECTION
+from src.grading_queue import (
+    enqueue_grading_job, get_grading_job, is_async_grading_requested, register_job_handler
+)
 import time
 import hashlib
 import logging
@@ -34,47 +47,34 @@ def get_quiz_from_database(quiz_ids: List[str]) -> dict:
                 'message': '沒有提供有效的template_id'
             }
         
-        # 先查詢SQL template獲取所有題目ID
+        # 一次查詢SQL template獲取所有題目ID與測驗資訊
         try:
-            from accessories import sqldb
-            from sqlalchemy import text
-            import json
-            
-            # 查詢SQL template獲取question_ids
             template_query = text("""
-                SELECT question_ids FROM quiz_templates 
+                SELECT question_ids, template_type, school, department, year, created_at
+                FROM quiz_templates 
                 WHERE id = :template_id
             """)
             
             with sqldb.engine.connect() as conn:
-                result = conn.execute(template_query, {'template_id': template_id})
-                template_row = result.fetchone()
-                
-                if not template_row:
-                    return {
-                        'success': False,
-                        'message': '找不到測驗模板'
-                    }
-                
-                question_ids_json = template_row[0]
-                question_ids = json.loads(question_ids_json)
-                
-                # 查詢所有題目
-                questions = []
-                for q_id in question_ids:
-                    try:
-                        object_id = ObjectId(q_id)
-                        question_doc = mongo.db.exam.find_one({"_id": object_id})
-                        if question_doc:
-                            questions.append(question_doc)
-                    except Exception as e:
-                        continue
+                template_row = conn.execute(template_query, {'template_id': template_id}).fetchone()
                 
-                if not questions:
-                    return {
-                        'success': False,
-                        'message': '沒有找到任何題目數據'
-                    }
+            if not template_row:
+                return {
+                    'success': False,
+                    'message': '找不到測驗模板'
+                }
+            
+            question_ids_json = template_row[0]
+            question_ids = json.loads(question_ids_json)
+            
+            # 單次 $in 查詢取回所有題目（保持原始順序）
+            questions = [doc for doc in load_questions_by_ids(question_ids, QUIZ_QUESTION_PROJECTION) if doc]
+            
+            if not questions:
+                return {
+                    'success': False,
+                    'message': '沒有找到任何題目數據'
+                }
                     
         except Exception as e:
             return {
@@ -125,43 +125,32 @@ def get_quiz_from_database(quiz_ids: List[str]) -> dict:
         # 從SQL模板獲取測驗信息
         template_info = {}
         try:
-            with sqldb.engine.connect() as conn:
-                template_query = text("""
-                    SELECT template_type, school, department, year, created_at
-                    FROM quiz_templates 
-                    WHERE id = :template_id
-                """)
-                
-                result = conn.execute(template_query, {'template_id': template_id})
-                template_row = result.fetchone()
-                
-                if template_row:
-                    template_type = template_row[0]
-                    school = template_row[1] or ''
-                    department = template_row[2] or ''
-                    year = template_row[3] or ''
-                    created_at = template_row[4]
-                    
-                    # 根據測驗類型生成標題
-                    if template_type == 'pastexam':
-                        quiz_title = f"{school} - {year}年 - {department}"
-                    else:  # knowledge
-                        topic = questions[0].get('key-points', '計算機概論') if questions else '計算機概論'
-                        quiz_title = f"{topic} - 知識測驗"
-                    
-                    template_info = {
-                        'title': quiz_title,
-                        'exam_type': template_type,
-                        'school': school,
-                        'department': department,
-                        'year': year,
-                        'topic': questions[0].get('key-points', '計算機概論') if questions else '計算機概論',
-                        'difficulty': questions[0].get('difficulty_level', 'medium') if questions else 'medium',
-                        'question_count': len(formatted_questions),
-                        'time_limit': 60,
-                        'total_score': len(formatted_questions) * 5,
-                        'created_at': created_at.isoformat() if created_at else datetime.now().isoformat()
-                    }
+            template_type = template_row[1]
+            school = template_row[2] or ''
+            department = template_row[3] or ''
+            year = template_row[4] or ''
+            created_at = template_row[5]
+            
+            # 根據測驗類型生成標題
+            if template_type == 'pastexam':
+                quiz_title = f"{school} - {year}年 - {department}"
+            else:  # knowledge
+                topic = questions[0].get('key-points', '計算機概論') if questions else '計算機概論'
+                quiz_title = f"{topic} - 知識測驗"
+            
+            template_info = {
+                'title': quiz_title,
+                'exam_type': template_type,
+                'school': school,
+                'department': department,
+                'year': year,
+                'topic': questions[0].get('key-points', '計算機概論') if questions else '計算機概論',
+                'difficulty': questions[0].get('difficulty_level', 'medium') if questions else 'medium',
+                'question_count': len(formatted_questions),
+                'time_limit': 60,
+                'total_score': len(formatted_questions) * 5,
+                'created_at': created_at.isoformat() if created_at else datetime.now().isoformat()
+            }
         except Exception as e:
             print(f"⚠️ 獲取模板信息失敗: {e}")
             # 使用默認信息
@@ -325,7 +314,7 @@ def init_quiz_tables():
 
 @quiz_bp.route('/submit-quiz', methods=['POST', 'OPTIONS'])
 def submit_quiz():
-    """提交測驗 API - 全AI評分版本"""
+    """提交測驗 API - 全AI評分版本（支援非同步批改）"""
     if request.method == 'OPTIONS':
         return jsonify({'token': None, 'message': 'CORS preflight'}), 200
     
@@ -338,12 +327,6 @@ def submit_quiz():
     # 獲取請求數據
     data = request.get_json()
     template_id = data.get('template_id')
-    answers = data.get('answers', {})
-    time_taken = data.get('time_taken', 0)
-    question_answer_times = data.get('question_answer_times', {})  # 新增：提取每題作答時間
-    frontend_questions = data.get('questions', [])  # 新增：提取前端發送的題目數據
-    
-    # 調試日誌
     
     if not template_id:
         return jsonify({
@@ -351,10 +334,58 @@ def submit_quiz():
             'message': '缺少考卷模板ID'
         }), 400
     
+    # 生成唯一的進度追蹤ID
+    progress_id = new_progress_id(user_email, data.get('progress_id'))
+    submission = {
+        'template_id': template_id,
+        'answers': data.get('answers', {}),
+        'time_taken': data.get('time_taken', 0),
+        'question_answer_times': data.get('question_answer_times', {}),  # 每題作答時間
+        'questions': data.get('questions', [])  # 前端發送的題目數據
+    }
+    
+    # 非同步模式：寫入批改佇列後立即返回，前端以 progress_id 訂閱 SSE 或查詢 job 狀態
+    if is_async_grading_requested(data):
+        job_id = enqueue_grading_job('quiz', user_email, submission, progress_id)
+        if job_id:
+            return jsonify({
+                'token': refresh_token(token),
+                'message': '測驗已提交，正在批改中',
+                'data': {
+                    'job_id': job_id,
+                    'progress_id': progress_id,
+                    'template_id': template_id,
+                    'status': 'queued'
+                }
+            }), 202
+        print("⚠️ 批改佇列不可用，改為同步批改")
+    
+    result = grade_quiz_submission(user_email, submission, progress_id)
+    if not result.get('success'):
+        return jsonify({
+            'token': None,
+            'message': result.get('message', '測驗批改失敗')
+        }), result.get('status_code', 500)
+    
+    return jsonify({
+        'token': refresh_token(token),
+        'message': '測驗提交成功',
+        'data': result['data']
+    })
+
 
+def grade_quiz_submission(user_email, submission, progress_id):
+    """
+    批改一份測驗作答並寫入 quiz_history / quiz_answers / quiz_errors
     
-    # 生成唯一的進度追蹤ID
-    progress_id = f"progress_{user_email}_{int(time.time())}"
+    由 /submit-quiz 同步呼叫，或由批改 worker 從佇列取出後呼叫。
+    返回 {'success': True, 'data': {...}}，失敗時返回 {'success': False, 'message': ..., 'status_code': ...}
+    """
+    template_id = submission.get('template_id')
+    answers = submission.get('answers', {})
+    time_taken = submission.get('time_taken', 0)
+    question_answer_times = submission.get('question_answer_times', {})
+    frontend_questions = submission.get('questions', [])
     
     # 階段1: 試卷批改 - 獲取題目數據
 
@@ -373,10 +404,11 @@ def submit_quiz():
         """), {'template_id': template_id_int}).fetchone()
         
         if not template:
-            return jsonify({
-                'token': None,
-                'message': '考卷模板不存在'
-            }), 404
+            return {
+                'success': False,
+                'message': '考卷模板不存在',
+                'status_code': 404
+            }
         
         # 從模板獲取題目ID列表
         question_ids = json.loads(template.question_ids)
@@ -391,13 +423,9 @@ def submit_quiz():
         else:
             # 從MongoDB exam集合獲取題目詳情
             questions = []
-            for i, question_id in enumerate(question_ids):
-                # 嘗試使用ObjectId查詢
-                exam_question = mongo.db.exam.find_one({"_id": ObjectId(question_id)})
-                if not exam_question:
-                    # 如果ObjectId查詢失敗，嘗試直接查詢
-                    exam_question = mongo.db.exam.find_one({"_id": question_id})
-                
+            # 單次 $in 查詢取回所有題目（保持原始順序）
+            exam_questions = load_questions_by_ids(question_ids, QUIZ_QUESTION_PROJECTION)
+            for i, (question_id, exam_question) in enumerate(zip(question_ids, exam_questions)):
                 if exam_question:
                     # 使用與 create-quiz 相同的題目處理邏輯
                     exam_type = exam_question.get('type', 'single')
@@ -461,21 +489,11 @@ def submit_quiz():
                             elif isinstance(group_image_file, str):
                                 group_image_filenames = [group_image_file]
                             
-                            # 將每個圖片檔案轉換為 base64
+                            # 取得每個圖片檔案的引用（帶版本的 URL，相容模式為 base64 data URL）
                             for group_image_filename in group_image_filenames:
-                                group_image_base64 = get_image_base64(group_image_filename)
-                                if group_image_base64:
-                                    # 判斷圖片格式
-                                    image_ext = os.path.splitext(group_image_filename)[1].lower()
-                                    mime_type = 'image/jpeg'
-                                    if image_ext in ['.png']:
-                                        mime_type = 'image/png'
-                                    elif image_ext in ['.gif']:
-                                        mime_type = 'image/gif'
-                                    elif image_ext in ['.webp']:
-                                        mime_type = 'image/webp'
-                                    
-                                    group_image_data_list.append(f"data:{mime_type};base64,{group_image_base64}")
+                                group_image_src = get_question_image_src(group_image_filename)
+                                if group_image_src:
+                                    group_image_data_list.append(group_image_src)
                             
                             # 如果只有一張圖片，直接返回字串；多張圖片返回陣列
                             if len(group_image_data_list) == 1:
@@ -534,21 +552,11 @@ def submit_quiz():
                             elif isinstance(image_file, str):
                                 image_filenames = [image_file]
                             
-                            # 將每個圖片檔案轉換為 base64
+                            # 取得每個圖片檔案的引用（帶版本的 URL，相容模式為 base64 data URL）
                             for image_filename in image_filenames:
-                                image_base64 = get_image_base64(image_filename)
-                                if image_base64:
-                                    # 判斷圖片格式
-                                    image_ext = os.path.splitext(image_filename)[1].lower()
-                                    mime_type = 'image/jpeg'
-                                    if image_ext in ['.png']:
-                                        mime_type = 'image/png'
-                                    elif image_ext in ['.gif']:
-                                        mime_type = 'image/gif'
-                                    elif image_ext in ['.webp']:
-                                        mime_type = 'image/webp'
-                                    
-                                    image_data_list.append(f"data:{mime_type};base64,{image_base64}")
+                                image_src = get_question_image_src(image_filename)
+                                if image_src:
+                                    image_data_list.append(image_src)
                             
                             # 如果只有一張圖片，直接返回字串；多張圖片返回陣列
                             if len(image_data_list) == 1:
@@ -820,7 +828,10 @@ def submit_quiz():
             ai_questions_data.append(ai_question_data)
         
         # 使用AI批改模組進行批量評分
-        ai_results = batch_grade_ai_questions(ai_questions_data)
+        ai_results = batch_grade_ai_questions(
+            ai_questions_data,
+            progress_callback=lambda done, total, qid: publish_question_graded(progress_id, done, total, qid)
+        )
         
         # 處理AI評分結果
         for i, result in enumerate(ai_results):
@@ -893,178 +904,36 @@ def submit_quiz():
         # 使用從測驗數據獲取的類型
         quiz_template_id = template_id_int  # 使用實際的模板ID
         
-        # 查找現有的quiz_history記錄
-        existing_record = conn.execute(text("""
-            SELECT id FROM quiz_history 
-            WHERE user_email = :user_email AND quiz_type = :quiz_type
-            ORDER BY created_at DESC LIMIT 1
-        """), {
-            'user_email': user_email,
-            'quiz_type': quiz_type
-        }).fetchone()
-        
-        if existing_record:
-            # 更新現有記錄
-            quiz_history_id = existing_record[0]
-            conn.execute(text("""
-                UPDATE quiz_history 
-                SET answered_questions = :answered_questions,
-                    correct_count = :correct_count,
-                    wrong_count = :wrong_count,
-                    accuracy_rate = :accuracy_rate,
-                    average_score = :average_score,
-                    total_time_taken = :time_taken,
-                    submit_time = :submit_time,
-                    status = 'completed'
-                WHERE id = :quiz_history_id
-            """), {
-                'answered_questions': answered_count,
-                'correct_count': correct_count,
-                'wrong_count': wrong_count,
-                'accuracy_rate': round(accuracy_rate, 2),
-                'average_score': round(average_score, 2),
-                'time_taken': time_taken,
-                                'submit_time': datetime.now(),
-                'quiz_history_id': quiz_history_id
-            })
-        else:
-            # 創建新記錄
-            # 對於AI生成的考卷，quiz_template_id設為NULL（資料庫允許NULL）
-            # 對於傳統考卷，使用整數template_id
-            db_quiz_template_id = None if quiz_template_id is None else quiz_template_id
-            
-            result = conn.execute(text("""
-                INSERT INTO quiz_history 
-                (quiz_template_id, user_email, quiz_type, total_questions, answered_questions,
-                 correct_count, wrong_count, accuracy_rate, average_score, total_time_taken, submit_time, status)
-                VALUES (:quiz_template_id, :user_email, :quiz_type, :total_questions, :answered_questions,
-                       :correct_count, :wrong_count, :accuracy_rate, :average_score, :total_time_taken, :submit_time, :status)
-            """), {
-                'quiz_template_id': db_quiz_template_id,
-                'user_email': user_email,
-                'quiz_type': quiz_type,
-                'total_questions': total_questions,
-                'answered_questions': answered_count,
-                'correct_count': correct_count,
-                'wrong_count': wrong_count,
-                'accuracy_rate': round(accuracy_rate, 2),
-                'average_score': round(average_score, 2),
-                'total_time_taken': time_taken,
-                'submit_time': datetime.now(),
-                'status': 'completed'
-            })
-            quiz_history_id = result.lastrowid
-        
-        # 儲存所有題目的用戶答案到 quiz_answers 表
-        # 1. 儲存已作答題目（AI評分結果）
-        for i, q_data in enumerate(answered_questions):
-            question = q_data['question']
-            user_answer = q_data['user_answer']
-            question_id = question.get('original_exam_id', '')
-            question_type = question.get('type', '')
-            
-            # 獲取AI評分結果
-            ai_result = q_data.get('ai_result', {})
-            is_correct = ai_result.get('is_correct', False)
-            score = ai_result.get('score', 0)
-            feedback = ai_result.get('feedback', {})
-            
-            # 獲取作答時間（秒數）
-            answer_time_seconds = q_data.get('answer_time_seconds', 0)
-            
-            # 處理 Group 題目的答案格式
-            if question_type == 'group':
-                # Group 題目的答案可能是陣列，需要轉換為字串
-                if isinstance(user_answer, list):
-                    user_answer_str = json.dumps(user_answer, ensure_ascii=False)
-                else:
-                    user_answer_str = str(user_answer)
-            else:
-                user_answer_str = str(user_answer)
-            
-            # 構建用戶答案資料
-            answer_data = {
-                'answer': user_answer_str,
-                'feedback': feedback  # 使用AI批改的feedback
-            }
-            
-            # 使用新的長答案存儲方法，保持數據完整性
-            stored_answer = _store_long_answer(user_answer_str, 'unknown', quiz_history_id, question_id, user_email)
-            
-            # 插入到 quiz_answers 表，包含feedback和作答時間
-            conn.execute(text("""
-                INSERT INTO quiz_answers 
-                (quiz_history_id, user_email, mongodb_question_id, user_answer, is_correct, score, feedback, answer_time_seconds)
-                VALUES (:quiz_history_id, :user_email, :mongodb_question_id, :user_answer, :is_correct, :score, :feedback, :answer_time_seconds)
-            """), {
-                'quiz_history_id': quiz_history_id,
-                'user_email': user_email,
-                'mongodb_question_id': question_id,
-                'user_answer': stored_answer,  # 使用存儲後的答案引用
-                'is_correct': is_correct,
-                'score': score,
-                'feedback': json.dumps(feedback),  # 將feedback轉換為JSON字符串
-                'answer_time_seconds': answer_time_seconds  # 每題作答時間（秒）
-            })
-        
-        # 2. 儲存未作答題目
-        for q_data in unanswered_questions:
-            i = q_data['index']
-            question = q_data['question']
-            question_id = question.get('original_exam_id', '')
-            
-            # 未作答題目：is_correct = False, score = 0
-            answer_data = {
-                'answer': '',
-                'feedback': {}
-            }
-            
-            # 插入到 quiz_answers 表
-            conn.execute(text("""
-                INSERT INTO quiz_answers 
-                (quiz_history_id, user_email, mongodb_question_id, user_answer, is_correct, score, answer_time_seconds)
-                VALUES (:quiz_history_id, :user_email, :mongodb_question_id, :user_answer, :is_correct, :score, :answer_time_seconds)
-            """), {
-                'quiz_history_id': quiz_history_id,
-                'user_email': user_email,
-                'mongodb_question_id': question_id,
-                'user_answer': '',  # 未作答題目答案為空
-                'is_correct': False,  # 未作答題目標記為錯誤
-                'score': 0,
-                'answer_time_seconds': 0
-            })
-        
-        # 保留原有的錯題儲存邏輯（向後兼容）
-        if wrong_questions:
-            for wrong_q in wrong_questions:
-                # 使用新的長答案存儲方法，保持數據完整性
-                stored_answer = _store_long_answer(wrong_q['user_answer'], 'unknown', quiz_history_id, 
-                                                wrong_q.get('original_exam_id', ''), user_email)
-                
-                conn.execute(text("""
-                    INSERT INTO quiz_errors 
-                    (quiz_history_id, user_email, mongodb_question_id, user_answer,
-                     score, time_taken)
-                    VALUES (:quiz_history_id, :user_email, :mongodb_question_id,
-                           :user_answer, :score, :time_taken)
-                """), {
-                    'quiz_history_id': quiz_history_id,
-                    'user_email': user_email,
-                    'mongodb_question_id': wrong_q.get('original_exam_id', ''),
-                    'user_answer': stored_answer,  # 使用存儲後的答案引用
-                    'score': wrong_q.get('score', 0),
-                    'time_taken': 0  # 簡化時間處理
-                })
-        
+        # quiz_history、所有作答與錯題在同一個交易中批次寫入
+        quiz_history_id = upsert_quiz_history(
+            conn, user_email, quiz_type, quiz_template_id, total_questions,
+            answered_count, correct_count, wrong_count, accuracy_rate, average_score, time_taken
+        )
+        save_graded_answers(conn, quiz_history_id, user_email, answered_questions,
+                            unanswered_questions, wrong_questions)
         conn.commit()
     
+    # 增量更新學生概念掌握度（學習分析頁直接讀取）
+    record_quiz_attempts(user_email, [
+        {
+            'question_id': q_data['question'].get('original_exam_id', ''),
+            'is_correct': q_data.get('ai_result', {}).get('is_correct', False),
+            'time_spent': q_data.get('answer_time_seconds', 0)
+        }
+        for q_data in answered_questions
+    ] + [
+        {'question_id': q_data['question'].get('original_exam_id', ''), 'is_correct': False, 'time_spent': 0}
+        for q_data in unanswered_questions
+    ])
 
     # 更新進度追蹤狀態為完成
-    update_progress_status(progress_id, True, 4, "AI批改完成！")
+    update_progress_status(progress_id, True, 4, "AI批改完成！", extra={
+        'quiz_history_id': quiz_history_id,
+        'result_id': f'result_{quiz_history_id}'
+    })
     
-    return jsonify({
-        'token': refresh_token(token),
-        'message': '測驗提交成功',
+    return {
+        'success': True,
         'data': {
             'template_id': template_id,  # 返回模板ID
             'quiz_history_id': quiz_history_id,  # 返回測驗歷史記錄ID
@@ -1099,36 +968,14 @@ def submit_quiz():
                 for q_data in answered_questions
             ]
         }
-    })
-
+    }
 
-# 舊的答案截斷方法已移除，現在使用長答案存儲方法保持數據完整性
 
+register_job_handler('quiz', grade_quiz_submission)
 
-# 進度追蹤存儲（簡單的內存存儲，生產環境建議使用 Redis）
-progress_storage = {}
 
-def update_progress_status(progress_id: str, is_completed: bool, current_stage: int, description: str):
-    """更新進度追蹤狀態"""
-    progress_storage[progress_id] = {
-        'is_completed': is_completed,
-        'current_stage': current_stage,
-        'stage_description': description,
-        'updated_at': time.time()
-    }
+# 舊的答案截斷方法已移除，現在使用長答案存儲方法保持數據完整性
 
-def get_progress_status(progress_id: str) -> dict:
-    """獲取進度追蹤狀態"""
-    try:
-        # 從進度追蹤存儲中獲取狀態
-        return progress_storage.get(progress_id, {
-            'current_stage': 1,  # 默認從第一階段開始
-            'is_completed': False,
-            'stage_description': '正在初始化...'
-        })
-    except Exception as e:
-        print(f"❌ 獲取進度狀態失敗: {e}")
-        return None
 
 def _parse_user_answer(user_answer):
     """解析用戶答案，支援多種格式，包括 LONG_ANSWER_ 引用"""
@@ -1164,93 +1011,6 @@ def _parse_user_answer(user_answer):
                 return user_answer
     return user_answer
 
-def _store_long_answer(user_answer: any, question_type: str, quiz_history_id: int, question_id: str, user_email: str) -> str:
-    """
-    存儲長答案到專門的表中，保持數據完整性
-    
-    參數：
-    - user_answer: 原始用戶答案
-    - question_type: 題目類型
-    - quiz_history_id: 測驗歷史ID
-    - question_id: 題目ID
-    - user_email: 用戶郵箱
-    
-    返回：
-    - 存儲引用ID或標識符
-    """
-    try:
-        answer_str = str(user_answer)
-        
-        # 如果答案不長，直接返回
-        if len(answer_str) <= 10000:
-            return answer_str
-        
-        # 對於長答案，存儲到專門的表中
-        with sqldb.engine.connect() as conn:
-            # 創建長答案存儲表（如果不存在）
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS long_answers (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    quiz_history_id INT NOT NULL,
-                    question_id VARCHAR(255) NOT NULL,
-                    user_email VARCHAR(255) NOT NULL,
-                    question_type VARCHAR(50) NOT NULL,
-                    full_answer LONGTEXT NOT NULL,
-                    answer_hash VARCHAR(64) NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    INDEX idx_quiz_question (quiz_history_id, question_id),
-                    INDEX idx_user (user_email)
-                )
-            """))
-            
-            # 計算答案的哈希值作為唯一標識
-            answer_hash = hashlib.md5(answer_str.encode()).hexdigest()
-            
-            # 檢查是否已經存儲過相同的答案
-            existing = conn.execute(text("""
-                SELECT id FROM long_answers 
-                WHERE quiz_history_id = :quiz_history_id AND question_id = :question_id
-            """), {
-                'quiz_history_id': quiz_history_id,
-                'question_id': question_id
-            }).fetchone()
-            
-            if existing:
-                # 如果已存在，返回引用標識
-                return f"LONG_ANSWER_{existing[0]}"
-            else:
-                # 存儲新的長答案
-                result = conn.execute(text("""
-                    INSERT INTO long_answers 
-                    (quiz_history_id, question_id, user_email, question_type, full_answer, answer_hash)
-                    VALUES (:quiz_history_id, :question_id, :user_email, :question_type, :full_answer, :answer_hash)
-                """), {
-                    'quiz_history_id': quiz_history_id,
-                    'question_id': question_id,
-                    'user_email': user_email,
-                    'question_type': question_type,
-                    'full_answer': answer_str,
-                    'answer_hash': answer_hash
-                })
-                
-                long_answer_id = conn.execute(text("SELECT LAST_INSERT_ID()")).scalar()
-                conn.commit()
-                return f"LONG_ANSWER_{long_answer_id}"
-                
-    except Exception as e:
-        print(f"❌ 存儲長答案失敗: {e}")
-        # 如果存儲失敗，返回截斷的答案（但保持數據完整性）
-        answer_str = str(user_answer)
-        if len(answer_str) > 10000:
-            # 返回截斷的答案，但添加錯誤標記
-            truncated_answer = answer_str[:9000] + "...[存儲失敗，答案已截斷]"
-            print(f"⚠️ 長答案存儲失敗，使用截斷方式: {len(answer_str)} -> {len(truncated_answer)} 字符")
-            return truncated_answer
-        else:
-            # 如果答案不長，直接返回
-            return answer_str
-
-
 @quiz_bp.route('/get-quiz-result/<result_id>', methods=['GET', 'OPTIONS'])
 def get_quiz_result(result_id):
     """根據結果ID獲取測驗結果 API - 優化版本"""
@@ -1372,17 +1132,18 @@ def get_quiz_result(result_id):
         all_questions = []
         errors = []
         
-        for i, question_id in enumerate(question_ids):
+        # 單次 $in 查詢取回所有題目（保持原始順序）
+        try:
+            exam_questions = load_questions_by_ids(question_ids, QUIZ_QUESTION_PROJECTION)
+        except Exception as e:
+            print(f"⚠️ 批次獲取題目詳情失敗: {e}")
+            exam_questions = [None] * len(question_ids)
+        
+        for i, (question_id, exam_question) in enumerate(zip(question_ids, exam_questions)):
 
             # 從MongoDB獲取題目詳情
             question_detail = {}
             try:
-                # 安全地處理 ObjectId 查詢
-                if isinstance(question_id, str) and len(question_id) == 24:
-                    exam_question = mongo.db.exam.find_one({"_id": ObjectId(question_id)})
-                else:
-                    exam_question = mongo.db.exam.find_one({"_id": question_id})
-                
                 if exam_question:
                     # 使用與 create-quiz 相同的題目處理邏輯
                     exam_type = exam_question.get('type', 'single')
@@ -1620,15 +1381,19 @@ def create_quiz():
             if not topic:
                 return jsonify({'token': None, 'message': '缺少知識點參數'}), 400
             
-            # 從MongoDB獲取符合條件的考題
-            # 使用正確的欄位名稱：key-points
-            query = {"key-points": topic}
-            available_exams = list(mongo.db.exam.find(query).limit(count * 2))
-            
-            if len(available_exams) < count:
-                available_exams = list(mongo.db.exam.find({}).limit(count))
-            
-            selected_exams = random.sample(available_exams, min(count, len(available_exams)))
+            try:
+                # 從題目池隨機抽題後一次取回題目
+                selected_exams = draw_knowledge_questions(topic, count, difficulty)
+            except QuestionPoolUnavailable as e:
+                print(f"⚠️ 題目池無法使用，改用 MongoDB 查詢: {e}")
+                # 使用正確的欄位名稱：key-points
+                query = {"key-points": topic}
+                available_exams = list(mongo.db.exam.find(query).limit(count * 2))
+                
+                if len(available_exams) < count:
+                    available_exams = list(mongo.db.exam.find({}).limit(count))
+                
+                selected_exams = random.sample(available_exams, min(count, len(available_exams)))
             quiz_title = f"{topic} - {difficulty} - {count}題"
             
             # 知識點測驗的學校、科系、年份
@@ -1729,21 +1494,11 @@ def create_quiz():
                         elif isinstance(sub_image, str):
                             sub_image_filenames = [sub_image]
                         
-                        # 將每個圖片檔案轉換為 base64
+                        # 取得每個圖片檔案的引用（帶版本的 URL，相容模式為 base64 data URL）
                         for sub_image_filename in sub_image_filenames:
-                            sub_image_base64 = get_image_base64(sub_image_filename)
-                            if sub_image_base64:
-                                # 判斷圖片格式
-                                image_ext = os.path.splitext(sub_image_filename)[1].lower()
-                                mime_type = 'image/jpeg'
-                                if image_ext in ['.png']:
-                                    mime_type = 'image/png'
-                                elif image_ext in ['.gif']:
-                                    mime_type = 'image/gif'
-                                elif image_ext in ['.webp']:
-                                    mime_type = 'image/webp'
-                                
-                                sub_image_data_list.append(f"data:{mime_type};base64,{sub_image_base64}")
+                            sub_image_src = get_question_image_src(sub_image_filename)
+                            if sub_image_src:
+                                sub_image_data_list.append(sub_image_src)
                     
                     # 如果只有一張圖片，直接返回字串；多張圖片返回陣列
                     if len(sub_image_data_list) == 1:
@@ -1791,21 +1546,11 @@ def create_quiz():
                     elif isinstance(group_image_file, str):
                         group_image_filenames = [group_image_file]
                     
-                    # 將每個圖片檔案轉換為 base64
+                    # 取得每個圖片檔案的引用（帶版本的 URL，相容模式為 base64 data URL）
                     for group_image_filename in group_image_filenames:
-                        group_image_base64 = get_image_base64(group_image_filename)
-                        if group_image_base64:
-                            # 判斷圖片格式
-                            image_ext = os.path.splitext(group_image_filename)[1].lower()
-                            mime_type = 'image/jpeg'
-                            if image_ext in ['.png']:
-                                mime_type = 'image/png'
-                            elif image_ext in ['.gif']:
-                                mime_type = 'image/gif'
-                            elif image_ext in ['.webp']:
-                                mime_type = 'image/webp'
-                            
-                            group_image_data_list.append(f"data:{mime_type};base64,{group_image_base64}")
+                        group_image_src = get_question_image_src(group_image_filename)
+                        if group_image_src:
+                            group_image_data_list.append(group_image_src)
                     
                     # 如果只有一張圖片，直接返回字串；多張圖片返回陣列
                     if len(group_image_data_list) == 1:
@@ -1864,21 +1609,11 @@ def create_quiz():
                     elif isinstance(image_file, str):
                         image_filenames = [image_file]
                     
-                    # 將每個圖片檔案轉換為 base64
+                    # 取得每個圖片檔案的引用（帶版本的 URL，相容模式為 base64 data URL）
                     for image_filename in image_filenames:
-                        image_base64 = get_image_base64(image_filename)
-                        if image_base64:
-                            # 判斷圖片格式
-                            image_ext = os.path.splitext(image_filename)[1].lower()
-                            mime_type = 'image/jpeg'
-                            if image_ext in ['.png']:
-                                mime_type = 'image/png'
-                            elif image_ext in ['.gif']:
-                                mime_type = 'image/gif'
-                            elif image_ext in ['.webp']:
-                                mime_type = 'image/webp'
-                            
-                            image_data_list.append(f"data:{mime_type};base64,{image_base64}")
+                        image_src = get_question_image_src(image_filename)
+                        if image_src:
+                            image_data_list.append(image_src)
                     
                     # 如果只有一張圖片，直接返回字串；多張圖片返回陣列
                     if len(image_data_list) == 1:
@@ -2041,34 +1776,11 @@ def create_quiz():
         print(f"❌ 創建測驗時發生錯誤: {str(e)}")
         return jsonify({'token': None, 'message': f'創建測驗失敗: {str(e)}'}), 500
 
-def get_image_base64(image_filename):
-    """讀取圖片檔案並轉換為 base64 編碼"""
-    try:
-        # 檢查檔案名稱是否為空
-        if not image_filename or not image_filename.strip():
-            return None
-        
-        # 取得當前檔案所在目錄，圖片在同層的 picture 資料夾
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        image_path = os.path.join(current_dir, 'picture', image_filename)
-        
-        if os.path.exists(image_path):
-            with open(image_path, 'rb') as image_file:
-                image_data = image_file.read()
-                base64_encoded = base64.b64encode(image_data).decode('utf-8')
-                return base64_encoded
-        else:
-            # print(f"圖片檔案不存在: {image_path}")
-            return None
-    except Exception as e:
-        print(f"讀取圖片時發生錯誤: {str(e)}")
-        return None
-
 # 删除 /get-quiz API - 前端不再使用，功能已被 create-quiz 替代
 
 @quiz_bp.route('/get-exam', methods=['POST', 'OPTIONS'])
 def get_exam():
-    """獲取所有考題數據"""
+    """獲取考題目錄（游標分頁 / 篩選 / 欄位投影 / 串流）"""
     if request.method == 'OPTIONS':
         return '', 204
     auth_header = request.headers.get('Authorization')
@@ -2091,41 +1803,9 @@ def get_exam():
         print(f"驗證token時發生錯誤: {str(e)}")
         return jsonify({'token': None, 'message': '認證失敗', 'code': 'AUTH_FAILED'}), 401
     
-    examdata = mongo.db.exam.find()
-    exam_list = []
-    for exam in examdata:
-        exam_dict = {
-             'type': exam.get('type'),
-                    'school': exam.get('school'),
-                    'department': exam.get('department'),
-                    'year': exam.get('year'),
-                    'question_number': exam.get('question_number'),
-                    'question_text': exam.get('question_text'),
-                    'options': exam.get('options'),
-                    'answer': exam.get('answer'),
-                    'answer_type': exam.get('answer_type'),
-                    'image_file': exam.get('image_file'),
-                    'detail-answer': exam.get('detail-answer'),
-                    'key_points': ', '.join(exam.get('key-points', [])) if isinstance(exam.get('key-points', []), list) else exam.get('key-points', ''),
-                    'difficulty level': exam.get('difficulty level'),
-        }
-        
-        # 處理圖片檔案
-        if exam_dict['image_file']:
-            image_data_list = []
-            for image_filename in exam_dict['image_file']:
-                image_base64 = get_image_base64(image_filename)
-                if image_base64:
-                    image_data_list.append({
-                        'filename': image_filename,
-                        'data': image_base64
-                    })
-            exam_dict['images'] = image_data_list
-        
-        exam_list.append(exam_dict)
- 
-    return jsonify({'token': refresh_token(token), 'exams': exam_list}), 200
-
+    # 支援游標分頁、篩選、欄位投影與 NDJSON 串流；未帶分頁參數時維持原本格式（串流輸出）
+    params = request.get_json(silent=True) or {}
+    return exam_catalogue_response(params, token=refresh_token(token), key_points_as_text=True)
 
 @quiz_bp.route('/get-exam-filters', methods=['POST', 'OPTIONS'])
 def get_exam_filters():
@@ -2153,70 +1833,18 @@ def get_exam_filters():
         return jsonify({'token': None, 'message': '認證失敗', 'code': 'AUTH_FAILED'}), 401
     
     try:
-        # 只查詢需要的欄位，不包含題目內容和圖片
-        examdata = mongo.db.exam.find(
-            {},
-            {
-                'school': 1,
-                'department': 1,
-                'year': 1,
-                'key-points': 1,
-                '_id': 0
-            }
-        )
-        
-        # 使用集合來去重並收集資料
-        schools = set()
-        departments = set()
-        years = set()
-        subjects = set()
-        subject_count_map = {}
-        
-        # 統計每個學校-年度-系所組合的題目數量
-        school_year_dept_count = {}
+        # 從 Redis 中的 facet 索引讀取（未命中時以聚合管線計算一次）
+        facets = get_exam_facets()
         
-        for exam in examdata:
-            # 收集學校
-            if exam.get('school'):
-                schools.add(exam.get('school'))
-            
-            # 收集系所
-            if exam.get('department'):
-                departments.add(exam.get('department'))
-            
-            # 收集年度
-            if exam.get('year'):
-                years.add(str(exam.get('year')))
-            
-            # 收集知識點/科目
-            key_points = exam.get('key-points', [])
-            if isinstance(key_points, list):
-                for subject in key_points:
-                    if subject and subject != '其他':
-                        subjects.add(subject)
-                        subject_count_map[subject] = subject_count_map.get(subject, 0) + 1
-            elif key_points and key_points != '其他':
-                subjects.add(key_points)
-                subject_count_map[key_points] = subject_count_map.get(key_points, 0) + 1
-            
-            # 統計學校-年度-系所組合的題目數量
-            school = exam.get('school', '')
-            year = str(exam.get('year', ''))
-            dept = exam.get('department', '')
-            if school and year and dept:
-                key = f"{school}|{year}|{dept}"
-                school_year_dept_count[key] = school_year_dept_count.get(key, 0) + 1
-        
-        # 轉換為排序後的列表
         result = {
             'token': refresh_token(token),
             'filters': {
-                'schools': sorted(list(schools)),
-                'departments': sorted(list(departments)),
-                'years': sorted(list(years)),
-                'subjects': sorted(list(subjects)),
-                'subject_counts': subject_count_map,
-                'school_year_dept_counts': school_year_dept_count
+                'schools': facets['schools'],
+                'departments': facets['departments'],
+                'years': facets['years'],
+                'subjects': facets['subjects'],
+                'subject_counts': facets['subject_counts'],
+                'school_year_dept_counts': facets['school_year_dept_counts']
             }
         }
         
@@ -2303,24 +1931,28 @@ def get_grading_progress(template_id):
 
 @quiz_bp.route('/quiz-progress/<progress_id>', methods=['GET'])
 def get_quiz_progress(progress_id):
-    """獲取測驗進度 API - 用於前端實時查詢進度"""
+    """獲取測驗進度 API - 用於前端查詢目前進度"""
     try:
-
         # 解析progress_id獲取用戶信息
-        if not progress_id.startswith('progress_'):
+        if not progress_id.startswith(('progress_', 'ai_progress_')):
             return jsonify({'error': '無效的進度ID'}), 400
         
-        # 模擬進度狀態（實際應該從數據庫獲取）
+        progress_status = get_progress_status(progress_id)
+        if progress_status is None:
+            return jsonify({'success': False, 'error': '進度服務暫時無法使用'}), 503
+        
+        current_stage = progress_status.get('current_stage', 1)
         progress_data = {
             'progress_id': progress_id,
-            'current_stage': 3,  # 當前階段：1=試卷批改, 2=計算分數, 3=評判知識點, 4=生成學習計畫
-            'total_stages': 4,
-            'stage_name': '評判知識點',
-            'stage_description': 'AI正在進行智能評分...',
-            'progress_percentage': 75,  # 75%完成
-            'is_completed': False,
-            'estimated_time_remaining': 30,  # 預計剩餘時間（秒）
-            'last_updated': time.time()
+            'current_stage': current_stage,  # 當前階段：1=試卷批改, 2=計算分數, 3=評判知識點, 4=生成學習計畫
+            'total_stages': TOTAL_STAGES,
+            'stage_description': progress_status.get('stage_description', ''),
+            'progress_percentage': progress_status.get('progress_percentage', 0),
+            'completed_questions': progress_status.get('completed_questions'),
+            'total_questions': progress_status.get('total_questions'),
+            'is_completed': progress_status.get('is_completed', False),
+            'last_event_id': progress_status.get('event_id'),
+            'last_updated': progress_status.get('updated_at')
         }
         
         return jsonify({
@@ -2338,74 +1970,58 @@ def get_quiz_progress(progress_id):
 
 @quiz_bp.route('/quiz-progress-sse/<progress_id>', methods=['GET'])
 def quiz_progress_sse(progress_id):
-    """測驗進度 Server-Sent Events API - 實時推送進度更新"""
-    def generate_progress_events():
-        # 設置SSE headers
-        yield 'data: {"type": "connected", "message": "進度追蹤已連接"}\n\n'
-        
-        # 檢查進度追蹤狀態
-        progress_status = get_progress_status(progress_id)
-        
-        if progress_status and progress_status.get('is_completed'):
-            # 如果AI批改已經完成，直接發送完成消息
-            completion_data = {
-                'type': 'completion',
-                'message': 'AI批改完成！',
-                'progress_percentage': 100,
-                'is_completed': True,
-                'timestamp': time.time()
-            }
-            yield f'data: {json.dumps(completion_data, ensure_ascii=False)}\n\n'
-            return
-        
-        # 如果還沒完成，發送當前進度
-        current_stage = progress_status.get('current_stage', 1) if progress_status else 1
-        stage_descriptions = {
-            1: '正在獲取題目數據...',
-            2: '正在分類題目...',
-            3: 'AI正在進行智能評分...',
-            4: '正在統計結果...'
-        }
-        
-        progress_data = {
-            'type': 'progress_update',
-            'current_stage': current_stage,
-            'stage_description': stage_descriptions.get(current_stage, '處理中...'),
-            'progress_percentage': (current_stage / 4) * 100,
-            'is_completed': False,
-            'timestamp': time.time()
-        }
-        
-        yield f'data: {json.dumps(progress_data, ensure_ascii=False)}\n\n'
-        
-        # 等待一下，然後檢查是否完成
-        time.sleep(1)
-        
-        # 再次檢查完成狀態
-        progress_status = get_progress_status(progress_id)
-        if progress_status and progress_status.get('is_completed'):
-            completion_data = {
-                'type': 'completion',
-                'message': 'AI批改完成！',
-                'progress_percentage': 100,
-                'is_completed': True,
-                'timestamp': time.time()
-            }
-            yield f'data: {json.dumps(completion_data, ensure_ascii=False)}\n\n'
+    """測驗進度 Server-Sent Events API - 事件到達即推送，支援 Last-Event-ID 續傳"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    
     # 設置SSE響應headers
     response = Response(
-        generate_progress_events(),
+        stream_progress_events(progress_id, last_event_id),
         mimetype='text/event-stream',
         headers={
             'Cache-Control': 'no-cache',
             'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no',
             'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Cache-Control'
+            'Access-Control-Allow-Headers': 'Cache-Control, Last-Event-ID'
         }
     )
     
     return response
 
+
+@quiz_bp.route('/grading-job/<job_id>', methods=['GET'])
+def get_grading_job_status(job_id):
+    """獲取非同步批改工作狀態 API - 完成後返回 result_id 供前端跳轉結果頁"""
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({'error': '缺少授權token'}), 401
+    
+    user_email = verify_token(token.split(" ")[1])
+    if not user_email:
+        return jsonify({'error': '無效的token'}), 401
+    
+    job = get_grading_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': '批改工作不存在或已過期'}), 404
+    
+    # 只能查看自己的批改工作
+    if job.get('user_email') != user_email:
+        return jsonify({'success': False, 'error': '無權限查看此批改工作'}), 403
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'job_id': job_id,
+            'status': job.get('status'),  # queued / processing / completed / failed
+            'progress_id': job.get('progress_id'),
+            'attempts': job.get('attempts'),
+            'result': job.get('result'),
+            'error': job.get('error'),
+            'created_at': job.get('created_at'),
+            'finished_at': job.get('finished_at')
+        }
+    })
+
 @quiz_bp.route('/get-long-answer/<answer_id>', methods=['GET'])
 def get_long_answer(answer_id: str):
 
@@ -17,6 +17,41 @@ import re
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+def _invoke_gemini(prompt: str, api_key: Optional[str] = None,
+                   temperature: float = 0.7, top_p: float = 0.8):
+    """
+    呼叫 Gemini 生成內容，並向金鑰管理器回報結果（429 / 5xx 會讓金鑰進入冷卻）
+
+    未指定 api_key 時以租約取得負載最低的健康金鑰；指定時（例如並行任務綁定的金鑰）直接使用並回報結果
+    """
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from tool.api_keys import lease_api_key, report_api_key_result
+
+    def invoke(key: str):
+        llm = ChatGoogleGenerativeAI(
+            model="gemini-2.5-flash",
+            google_api_key=key,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=40,
+            max_output_tokens=8192,  # 增加到8192以避免截斷
+            convert_system_message_to_human=True
+        )
+        return llm.invoke(prompt)
+
+    if not api_key:
+        with lease_api_key() as lease:
+            return invoke(lease.key)
+    try:
+        response = invoke(api_key)
+    except Exception as e:
+        report_api_key_result(api_key, error=e)
+        raise
+    report_api_key_result(api_key)
+    return response
+
+
 class SmartQuizGenerator:
     """智能AI考卷生成器 - 無備用題目，純AI生成"""
     
@@ -54,11 +89,12 @@ class SmartQuizGenerator:
                 - school: 學校 (考古題用)
                 - year: 年份 (考古題用)
                 - department: 科系 (考古題用)
+                - api_key: 指定使用的 API 金鑰（並行出題時由呼叫端分配，可省略）
         
         Returns:
             生成的考卷數據
         """
-        logger.info(f"🚀 開始智能生成考卷，需求: {requirements}")
+        logger.info(f"🚀 開始智能生成考卷，需求: { {k: v for k, v in requirements.items() if k != 'api_key'} }")
         
         # 驗證需求
         validated_req = self._validate_requirements(requirements)
@@ -140,6 +176,8 @@ class SmartQuizGenerator:
         """
         try:
             from accessories import mongo
+            from src.exam_facets import record_new_exams
+            from src.question_pools import add_questions_to_pools
             
             # 檢查 mongo 對象是否可用
             if mongo is None or mongo.db is None:
@@ -201,6 +239,8 @@ class SmartQuizGenerator:
             # 直接保存題目作為獨立文檔，不需要測驗文檔
             if formatted_questions:
                 question_results = mongo.db.exam.insert_many(formatted_questions)
+                record_new_exams(formatted_questions)  # 增量更新題庫篩選快取
+                add_questions_to_pools(formatted_questions)  # 增量加入組卷題目池
                 
                 # 創建SQL template（使用所有題目的ID）
                 question_ids = [str(q_id) for q_id in question_results.inserted_ids]
@@ -343,37 +383,11 @@ class SmartQuizGenerator:
             try:
                 logger.info(f"🔄 第 {question_number} 題，第 {attempt + 1} 次嘗試")
                 
-                # 直接初始化LLM，避免循環導入問題
-                from langchain_google_genai import ChatGoogleGenerativeAI
-                import sys
-                import os
-                
-                # 添加tool目錄到路徑
-                tool_path = os.path.join(os.path.dirname(__file__), '..', 'tool')
-                if tool_path not in sys.path:
-                    sys.path.append(tool_path)
-                
-                from api_keys import get_api_key
-                
-                # 初始化LLM
-                api_key = get_api_key()
-                llm = ChatGoogleGenerativeAI(
-                    model="gemini-2.5-flash",
-                    google_api_key=api_key,
-                    temperature=0.7,
-                    top_p=0.8,
-                    top_k=40,
-                    max_output_tokens=8192,  # 增加到8192以避免截斷
-                    convert_system_message_to_human=True
-                )
-                
-                # LLM已經初始化完成
-                
                 # 構建動態提示詞
                 prompt = self._build_dynamic_prompt(topic, difficulty, question_type, selected_text, requirements)
                 
                 # 調用AI生成
-                response = llm.invoke(prompt)
+                response = _invoke_gemini(prompt, api_key=(requirements or {}).get('api_key'))
                 response_text = response.content if hasattr(response, 'content') else str(response)
                 
                 logger.info(f"📝 AI回應長度: {len(response_text)} 字符")
@@ -439,35 +453,11 @@ class SmartQuizGenerator:
             try:
                 logger.info(f"🔄 基於內容生成第 {question_number} 題，第 {attempt + 1} 次嘗試")
                 
-                # 直接初始化LLM，避免循環導入問題
-                from langchain_google_genai import ChatGoogleGenerativeAI
-                import sys
-                import os
-                
-                # 添加tool目錄到路徑
-                tool_path = os.path.join(os.path.dirname(__file__), '..', 'tool')
-                if tool_path not in sys.path:
-                    sys.path.append(tool_path)
-                
-                from api_keys import get_api_key
-                
-                # 初始化LLM
-                api_key = get_api_key()
-                llm = ChatGoogleGenerativeAI(
-                    model="gemini-2.5-flash",
-                    google_api_key=api_key,
-                    temperature=0.7,
-                    top_p=0.8,
-                    top_k=40,
-                    max_output_tokens=8192,
-                    convert_system_message_to_human=True
-                )
-                
                 # 構建基於內容的動態提示詞
                 prompt = self._build_content_based_prompt(selected_text, difficulty, question_type)
                 
                 # 調用AI生成
-                response = llm.invoke(prompt)
+                response = _invoke_gemini(prompt)
                 response_text = response.content if hasattr(response, 'content') else str(response)
                 
                 logger.info(f"📝 基於內容AI回應長度: {len(response_text)} 字符")
@@ -1601,35 +1591,11 @@ class SimilarQuizGenerator:
             try:
                 logger.info(f"🔄 相似題目生成，第 {attempt + 1} 次嘗試")
                 
-                # 初始化LLM
-                from langchain_google_genai import ChatGoogleGenerativeAI
-                import sys
-                import os
-                
-                # 添加tool目錄到路徑
-                tool_path = os.path.join(os.path.dirname(__file__), '..', 'tool')
-                if tool_path not in sys.path:
-                    sys.path.append(tool_path)
-                
-                from api_keys import get_api_key
-                
-                # 初始化LLM
-                api_key = get_api_key()
-                llm = ChatGoogleGenerativeAI(
-                    model="gemini-2.5-flash",
-                    google_api_key=api_key,
-                    temperature=0.8,  # 提高創造性
-                    top_p=0.9,
-                    top_k=40,
-                    max_output_tokens=8192,
-                    convert_system_message_to_human=True
-                )
-                
                 # 構建相似題目專用的提示詞
                 prompt = self._build_similar_question_prompt(selected_text, topic, difficulty, question_type)
                 
                 # 調用AI生成
-                response = llm.invoke(prompt)
+                response = _invoke_gemini(prompt, temperature=0.8, top_p=0.9)
                 response_text = response.content if hasattr(response, 'content') else str(response)
                 
                 logger.info(f"📝 相似題目AI回應長度: {len(response_text)} 字符")
@@ -1854,6 +1820,8 @@ class SimilarQuizGenerator:
         """將相似題目保存到MongoDB數據庫"""
         try:
             from accessories import mongo
+            from src.exam_facets import record_new_exams
+            from src.question_pools import add_questions_to_pools
             
             # 檢查 mongo 對象是否可用
             if mongo is None or mongo.db is None:
@@ -1885,6 +1853,8 @@ class SimilarQuizGenerator:
             
             if result.inserted_id:
                 logger.info(f"✅ 相似題目已保存到數據庫，ID: {result.inserted_id}")
+                record_new_exams([quiz_doc])  # 增量更新題庫篩選快取
+                add_questions_to_pools([quiz_doc])  # 增量加入組卷題目池
                 
                 # 創建SQL template
                 template_id = create_sql_template_for_quiz(quiz_id, quiz_doc)
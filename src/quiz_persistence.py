@@ -0,0 +1,192 @@
+"""
+測驗批改結果寫入 - 在呼叫端的交易中批次寫入作答紀錄與錯題
+"""
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from sqlalchemy import text
+
+# 超過此長度的答案存入 long_answers，quiz_answers 只保留引用
+LONG_ANSWER_THRESHOLD = 10000
+LONG_ANSWER_TRUNCATE_LENGTH = 9000
+
+_INSERT_ANSWERS_SQL = text("""
+    INSERT INTO quiz_answers
+    (quiz_history_id, user_email, mongodb_question_id, user_answer, is_correct, score, feedback, answer_time_seconds)
+    VALUES (:quiz_history_id, :user_email, :mongodb_question_id, :user_answer, :is_correct, :score, :feedback, :answer_time_seconds)
+""")
+
+_INSERT_ERRORS_SQL = text("""
+    INSERT INTO quiz_errors
+    (quiz_history_id, user_email, mongodb_question_id, user_answer, score, time_taken)
+    VALUES (:quiz_history_id, :user_email, :mongodb_question_id, :user_answer, :score, :time_taken)
+""")
+
+
+def serialize_user_answer(question: Dict[str, Any], user_answer: Any) -> str:
+    """將用戶答案轉為字串（Group 題目的陣列答案轉為 JSON）"""
+    if question.get('type', '') == 'group' and isinstance(user_answer, list):
+        return json.dumps(user_answer, ensure_ascii=False)
+    return str(user_answer)
+
+
+def store_long_answer(conn, user_answer: Any, question_type: str, quiz_history_id: int,
+                      question_id: str, user_email: str) -> str:
+    """
+    長答案存入 long_answers（使用呼叫端的連線，與測驗記錄同一交易）
+
+    返回：
+    - 短答案直接返回原字串；長答案返回 LONG_ANSWER_{id} 引用
+    """
+    answer_str = str(user_answer)
+    if len(answer_str) <= LONG_ANSWER_THRESHOLD:
+        return answer_str
+
+    try:
+        existing = conn.execute(text("""
+            SELECT id FROM long_answers
+            WHERE quiz_history_id = :quiz_history_id AND question_id = :question_id
+        """), {
+            'quiz_history_id': quiz_history_id,
+            'question_id': question_id
+        }).fetchone()
+        if existing:
+            return f"LONG_ANSWER_{existing[0]}"
+
+        result = conn.execute(text("""
+            INSERT INTO long_answers
+            (quiz_history_id, question_id, user_email, question_type, full_answer, answer_hash)
+            VALUES (:quiz_history_id, :question_id, :user_email, :question_type, :full_answer, :answer_hash)
+        """), {
+            'quiz_history_id': quiz_history_id,
+            'question_id': question_id,
+            'user_email': user_email,
+            'question_type': question_type,
+            'full_answer': answer_str,
+            'answer_hash': hashlib.md5(answer_str.encode()).hexdigest()
+        })
+        return f"LONG_ANSWER_{result.lastrowid}"
+    except Exception as e:
+        # 存儲失敗時返回截斷的答案，並加上錯誤標記
+        print(f"❌ 存儲長答案失敗: {e}")
+        truncated_answer = answer_str[:LONG_ANSWER_TRUNCATE_LENGTH] + "...[存儲失敗，答案已截斷]"
+        print(f"⚠️ 長答案存儲失敗，使用截斷方式: {len(answer_str)} -> {len(truncated_answer)} 字符")
+        return truncated_answer
+
+
+def upsert_quiz_history(conn, user_email: str, quiz_type: str, quiz_template_id: Optional[int],
+                        total_questions: int, answered_count: int, correct_count: int, wrong_count: int,
+                        accuracy_rate: float, average_score: float, time_taken: int) -> int:
+    """更新用戶同類型的最新測驗記錄，沒有時新增，返回 quiz_history_id"""
+    existing_record = conn.execute(text("""
+        SELECT id FROM quiz_history
+        WHERE user_email = :user_email AND quiz_type = :quiz_type
+        ORDER BY created_at DESC LIMIT 1
+    """), {
+        'user_email': user_email,
+        'quiz_type': quiz_type
+    }).fetchone()
+
+    stats = {
+        'answered_questions': answered_count,
+        'correct_count': correct_count,
+        'wrong_count': wrong_count,
+        'accuracy_rate': round(accuracy_rate, 2),
+        'average_score': round(average_score, 2),
+        'total_time_taken': time_taken,
+        'submit_time': datetime.now()
+    }
+
+    if existing_record:
+        quiz_history_id = existing_record[0]
+        conn.execute(text("""
+            UPDATE quiz_history
+            SET answered_questions = :answered_questions,
+                correct_count = :correct_count,
+                wrong_count = :wrong_count,
+                accuracy_rate = :accuracy_rate,
+                average_score = :average_score,
+                total_time_taken = :total_time_taken,
+                submit_time = :submit_time,
+                status = 'completed'
+            WHERE id = :quiz_history_id
+        """), {**stats, 'quiz_history_id': quiz_history_id})
+        return quiz_history_id
+
+    # AI 生成的考卷 quiz_template_id 為 NULL，傳統考卷使用整數模板ID
+    result = conn.execute(text("""
+        INSERT INTO quiz_history
+        (quiz_template_id, user_email, quiz_type, total_questions, answered_questions,
+         correct_count, wrong_count, accuracy_rate, average_score, total_time_taken, submit_time, status)
+        VALUES (:quiz_template_id, :user_email, :quiz_type, :total_questions, :answered_questions,
+               :correct_count, :wrong_count, :accuracy_rate, :average_score, :total_time_taken, :submit_time, 'completed')
+    """), {
+        **stats,
+        'quiz_template_id': quiz_template_id,
+        'user_email': user_email,
+        'quiz_type': quiz_type,
+        'total_questions': total_questions
+    })
+    return result.lastrowid
+
+
+def save_graded_answers(conn, quiz_history_id: int, user_email: str,
+                        answered_questions: List[Dict[str, Any]],
+                        unanswered_questions: List[Dict[str, Any]],
+                        wrong_questions: List[Dict[str, Any]],
+                        serialize_answer: Callable[[Dict[str, Any], Any], str] = serialize_user_answer):
+    """
+    批次寫入所有題目的作答與錯題（不 commit，由呼叫端提交整個交易）
+
+    參數：
+    - answered_questions: 已作答題目，需含 ai_result
+    - unanswered_questions: 未作答題目（記錄為錯誤、0 分）
+    - wrong_questions: 錯題資訊
+    - serialize_answer: 用戶答案轉字串的函數
+    """
+    answer_rows = []
+    for q_data in answered_questions:
+        question = q_data['question']
+        question_id = question.get('original_exam_id', '')
+        ai_result = q_data.get('ai_result', {})
+        answer_str = serialize_answer(question, q_data['user_answer'])
+        answer_rows.append({
+            'quiz_history_id': quiz_history_id,
+            'user_email': user_email,
+            'mongodb_question_id': question_id,
+            'user_answer': store_long_answer(conn, answer_str, 'unknown', quiz_history_id, question_id, user_email),
+            'is_correct': ai_result.get('is_correct', False),
+            'score': ai_result.get('score', 0),
+            'feedback': json.dumps(ai_result.get('feedback', {})),
+            'answer_time_seconds': q_data.get('answer_time_seconds', 0)
+        })
+    for q_data in unanswered_questions:
+        answer_rows.append({
+            'quiz_history_id': quiz_history_id,
+            'user_email': user_email,
+            'mongodb_question_id': q_data['question'].get('original_exam_id', ''),
+            'user_answer': '',
+            'is_correct': False,
+            'score': 0,
+            'feedback': None,
+            'answer_time_seconds': 0
+        })
+
+    error_rows = []
+    for wrong_q in wrong_questions or []:
+        question_id = wrong_q.get('original_exam_id', '')
+        error_rows.append({
+            'quiz_history_id': quiz_history_id,
+            'user_email': user_email,
+            'mongodb_question_id': question_id,
+            'user_answer': store_long_answer(conn, wrong_q['user_answer'], 'unknown', quiz_history_id,
+                                             question_id, user_email),
+            'score': wrong_q.get('score', 0),
+            'time_taken': 0
+        })
+
+    if answer_rows:
+        conn.execute(_INSERT_ANSWERS_SQL, answer_rows)
+    if error_rows:
+        conn.execute(_INSERT_ERRORS_SQL, error_rows)
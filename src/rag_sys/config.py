@@ -132,6 +132,13 @@ SEARCH_CONFIG = {
     "force_return_results": True
 }
 
+# 查詢翻譯模式（嵌入模型為多語言模型，中文問題可直接檢索）
+# off: 不翻譯；auto: 以本地語言偵測判斷，只有嵌入模型不支援的語言才翻譯；always: 每次翻譯成英文
+QUERY_TRANSLATION_MODE = os.getenv("RAG_QUERY_TRANSLATION", "auto")
+
+# 嵌入模型可直接處理的查詢語言（langdetect 語言代碼）
+EMBEDDING_QUERY_LANGUAGES = {"en", "zh-tw", "zh-cn", "ja", "ko"}
+
 # =============================================================================
 # 語言配置
 # =============================================================================
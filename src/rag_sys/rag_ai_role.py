@@ -11,9 +11,16 @@ import re
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 import logging
-import chromadb
-from chromadb.config import Settings
-from accessories import init_gemini
+from accessories import generate_gemini_content
+from .vector_store import get_chroma_client, get_collection, get_embedding_function
+from .config import QUERY_TRANSLATION_MODE, EMBEDDING_QUERY_LANGUAGES
+
+try:
+    from langdetect import detect, DetectorFactory, LangDetectException
+    DetectorFactory.seed = 0  # 固定偵測結果
+    LANGDETECT_AVAILABLE = True
+except ImportError:
+    LANGDETECT_AVAILABLE = False
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO)
@@ -556,22 +563,42 @@ def enhance_prompt_with_knowledge(prompt: str, question: str) -> str:
         logger.error(f"❌ RAG增強失敗: {e}")
         return prompt
 
+def needs_query_translation(query: str) -> bool:
+    """
+    判斷檢索前是否需要翻譯查詢
+    嵌入模型為多語言模型，只有偵測到不支援的語言時才呼叫 LLM 翻譯
+    """
+    if QUERY_TRANSLATION_MODE == 'always':
+        return True
+    if QUERY_TRANSLATION_MODE != 'auto' or not LANGDETECT_AVAILABLE:
+        return False
+    try:
+        return detect(query) not in EMBEDDING_QUERY_LANGUAGES
+    except LangDetectException:
+        # 過短或無文字內容的查詢，直接檢索
+        return False
+
 def search_knowledge(query: str, top_k: int = 5) -> List[Dict[str, Any]]:
     """
     從向量資料庫檢索知識 - 真正的RAG檢索
-    自動將中文問題翻譯成英文進行檢索
+    使用與建庫相同的多語言嵌入模型在本地向量化查詢，中文問題不需先翻譯
     """
     try:
         client, collection = init_vector_database()
         if not collection:
             return []
         
-        # 1. 先將中文問題翻譯成英文（因為向量資料庫是英文教材）
-        english_query = translate_to_english(query)
+        # 1. 只有嵌入模型不支援的語言才翻譯成英文
+        search_query = query
+        if needs_query_translation(query):
+            english_query = translate_to_english(query)
+            if english_query and not english_query.startswith("Translation failed"):
+                search_query = english_query
         
-        # 2. 執行相似性搜索
+        # 2. 本地向量化查詢並執行相似性搜索
+        query_embeddings = get_embedding_function()([search_query])
         results = collection.query(
-            query_texts=[english_query],
+            query_embeddings=query_embeddings,
             n_results=top_k
         )
         
@@ -592,15 +619,14 @@ def search_knowledge(query: str, top_k: int = 5) -> List[Dict[str, Any]]:
         return []
 
 def translate_to_english(text: str) -> str:
-    # 使用Gemini進行翻譯
-    model = init_gemini(model_name = 'gemini-2.5-flash')
+    # 使用Gemini進行翻譯（僅在 needs_query_translation 判斷需要時使用）
     prompt = f"""請將以下中文問題翻譯成英文，保持專業術語的準確性：
 
 中文問題：{text}
 
 請只返回英文翻譯，不要添加任何解釋或額外文字。"""
     
-    response = model.generate_content(prompt)
+    response = generate_gemini_content(prompt)
     
     # 檢查回應是否有效
     if not response or not hasattr(response, 'text'):
@@ -973,27 +999,10 @@ def clean_ai_response(ai_response: str) -> str:
 # ==================== 初始化函數 ====================
 
 def init_vector_database():
-    """初始化向量資料庫"""
+    """獲取向量資料庫（行程內共用的 Client 與集合）"""
     try:
-        import os
-        
-        # 獲取當前文件的絕對路徑
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        # 構建向量資料庫的絕對路徑
-        db_path = os.path.join(current_dir, "data", "knowledge_db", "chroma_db")
-        
-        
-        chroma_client = chromadb.PersistentClient(
-            path=db_path,
-            settings=Settings(anonymized_telemetry=False)
-        )
-        
-        # 獲取或創建集合
-        collection = chroma_client.get_or_create_collection(
-            name="textbook_knowledge",  # 使用有數據的集合
-            metadata={"hnsw:space": "cosine"}
-        )
-        
+        chroma_client = get_chroma_client()
+        collection = get_collection("textbook_knowledge")  # 使用有數據的集合
         return chroma_client, collection
         
     except Exception as e:
@@ -1004,10 +1013,6 @@ def init_vector_database():
 def call_gemini_api(prompt: str) -> str:
     """調用Gemini API"""
     try:
-        model = init_gemini(model_name = 'gemini-2.5-flash')
-        if not model:
-            return "抱歉，AI服務暫時不可用，請稍後再試。"
-        
         # 設置生成參數，確保回應完整
         generation_config = {
             'max_output_tokens': 8192,  # 增加最大輸出長度，確保完整回答（特別是錯題解析）
@@ -1016,7 +1021,7 @@ def call_gemini_api(prompt: str) -> str:
             'top_k': 40
         }
         
-        response = model.generate_content(prompt, generation_config=generation_config)
+        response = generate_gemini_content(prompt, generation_config=generation_config)
         logger.info(f"📥 Gemini API回應接收，類型: {type(response).__name__}")
         
         # 檢查回應是否有效
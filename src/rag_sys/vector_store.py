@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量資料庫管理器 - 行程內共用的 ChromaDB Client、Collection 與嵌入模型
+"""
+
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import chromadb
+from chromadb.config import Settings
+
+from .config import CHROMA_DB_PATH, EMBEDDING_MODEL
+
+logger = logging.getLogger(__name__)
+
+# 已知集合的建立參數
+KNOWN_COLLECTIONS = {
+    "textbook_knowledge": {"hnsw:space": "cosine"},
+    "website_knowledge": {"hnsw:space": "cosine", "description": "網站功能知識庫"}
+}
+
+_lock = threading.RLock()
+_clients: Dict[str, Any] = {}
+_collections: Dict[Tuple[str, str], Any] = {}
+_embedding_functions: Dict[str, Any] = {}
+
+
+def get_chroma_client(db_path: str = CHROMA_DB_PATH):
+    """獲取指定路徑的共用 ChromaDB Client"""
+    db_path = os.path.abspath(db_path)
+    client = _clients.get(db_path)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(db_path)
+        if client is None:
+            os.makedirs(db_path, exist_ok=True)
+            client = chromadb.PersistentClient(
+                path=db_path,
+                settings=Settings(anonymized_telemetry=False)
+            )
+            _clients[db_path] = client
+            logger.info(f"✅ ChromaDB Client 已建立: {db_path}")
+    return client
+
+
+def get_collection(name: str, db_path: str = CHROMA_DB_PATH, metadata: Optional[Dict[str, Any]] = None):
+    """
+    獲取（不存在時建立）共用的 Collection
+
+    Args:
+        name: 集合名稱
+        db_path: 向量資料庫路徑
+        metadata: 建立集合時使用的 metadata，None 時使用 KNOWN_COLLECTIONS 的設定
+    """
+    cache_key = (os.path.abspath(db_path), name)
+    collection = _collections.get(cache_key)
+    if collection is not None:
+        return collection
+    with _lock:
+        collection = _collections.get(cache_key)
+        if collection is None:
+            collection = get_chroma_client(db_path).get_or_create_collection(
+                name=name,
+                metadata=metadata or KNOWN_COLLECTIONS.get(name)
+            )
+            _collections[cache_key] = collection
+    return collection
+
+
+def get_embedding_function(model_name: str = EMBEDDING_MODEL):
+    """獲取預先載入的句向量模型（與建庫時使用的 EMBEDDING_MODEL 相同）"""
+    embedding_function = _embedding_functions.get(model_name)
+    if embedding_function is not None:
+        return embedding_function
+    with _lock:
+        embedding_function = _embedding_functions.get(model_name)
+        if embedding_function is None:
+            from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
+            try:
+                import torch
+                device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            except ImportError:
+                device = 'cpu'
+            embedding_function = SentenceTransformerEmbeddingFunction(model_name=model_name, device=device)
+            # 實際編碼一次，確保模型權重已載入
+            embedding_function(["warm up"])
+            _embedding_functions[model_name] = embedding_function
+            logger.info(f"✅ 嵌入模型已載入: {model_name} ({device})")
+    return embedding_function
+
+
+def reset_vector_store():
+    """清除快取（重建向量資料庫後呼叫，下次存取時重新開啟）"""
+    with _lock:
+        _collections.clear()
+        _clients.clear()
+
+
+def warm_up_vector_store(load_embedding: bool = True):
+    """啟動時預先開啟已知集合並載入嵌入模型，失敗時只記錄警告"""
+    for name in KNOWN_COLLECTIONS:
+        try:
+            get_collection(name)
+        except Exception as e:
+            logger.warning(f"⚠️ 預先開啟集合 {name} 失敗: {e}")
+    if load_embedding:
+        try:
+            get_embedding_function()
+        except Exception as e:
+            logger.warning(f"⚠️ 預先載入嵌入模型失敗: {e}")
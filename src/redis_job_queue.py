@@ -0,0 +1,134 @@
+"""
+Redis 可靠工作佇列 - 批改工作與 LINE 事件 worker 共用的 pending / processing 佇列
+"""
+import time
+import threading
+from typing import Any, Callable, Optional
+from accessories import redis_client
+
+# worker 阻塞等待新工作的秒數
+WORKER_POLL_SECONDS = 5
+
+
+def decode(value: Any) -> Any:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class RedisJobQueue:
+    """
+    以兩個 Redis List 與一個 Hash 組成的工作佇列
+
+    - {name}:pending：等待處理的工作
+    - {name}:processing：已被 worker 取出、尚未完成的工作
+    - {name}:claims：processing 中每個工作被取出的時間，逾時視為 worker 已中斷，重新排入 pending
+    """
+
+    def __init__(self, name: str, visibility_timeout: int, label: str):
+        self.pending_key = f'{name}:pending'
+        self.processing_key = f'{name}:processing'
+        self.claims_key = f'{name}:claims'
+        self.visibility_timeout = visibility_timeout
+        self.label = label
+
+    def push(self, *members: Any, pipe=None):
+        """將工作排入 pending 佇列（可傳入 pipeline 與其他寫入一併執行）"""
+        (pipe or redis_client).lpush(self.pending_key, *members)
+
+    def claim(self, timeout: int = WORKER_POLL_SECONDS) -> Optional[Any]:
+        """阻塞取出一個工作並記錄領取時間，逾時無工作時返回 None"""
+        member = redis_client.blmove(self.pending_key, self.processing_key, timeout, 'RIGHT', 'LEFT')
+        if member:
+            redis_client.hset(self.claims_key, member, time.time())
+        return member
+
+    def ack(self, member: Any):
+        """工作完成（或放棄），從 processing 佇列移除"""
+        pipe = redis_client.pipeline()
+        pipe.lrem(self.processing_key, 1, member)
+        pipe.hdel(self.claims_key, member)
+        pipe.execute()
+
+    def retry(self, member: Any, new_member: Any = None):
+        """將工作移出 processing 並重新排入 pending（new_member 為更新後的工作內容）"""
+        pipe = redis_client.pipeline()
+        pipe.lrem(self.processing_key, 1, member)
+        pipe.hdel(self.claims_key, member)
+        pipe.lpush(self.pending_key, new_member if new_member is not None else member)
+        pipe.execute()
+
+    def requeue_stalled(self) -> int:
+        """將處理逾時的工作移回 pending 佇列，返回重新排入的數量"""
+        requeued = 0
+        now = time.time()
+        try:
+            claims = redis_client.hgetall(self.claims_key)
+            for member in redis_client.lrange(self.processing_key, 0, -1):
+                claimed_at = claims.get(member)
+                if claimed_at is None:
+                    # 剛取出、尚未記錄領取時間（或 worker 恰好在兩者之間中斷）：視為新領取，從現在起計時
+                    redis_client.hsetnx(self.claims_key, member, now)
+                    continue
+                if now - float(decode(claimed_at)) < self.visibility_timeout:
+                    continue
+                # LREM 成功才排回，避免多個程序重複排入同一工作
+                if redis_client.lrem(self.processing_key, 1, member):
+                    pipe = redis_client.pipeline()
+                    pipe.hdel(self.claims_key, member)
+                    pipe.rpush(self.pending_key, member)
+                    pipe.execute()
+                    requeued += 1
+        except Exception as e:
+            print(f"⚠️ 檢查逾時{self.label}失敗: {e}")
+        if requeued:
+            print(f"🔁 已重新排入 {requeued} 個逾時的{self.label}")
+        return requeued
+
+    def _worker_loop(self, app, process: Callable[[Any], None], stop_event: threading.Event):
+        while not stop_event.is_set():
+            try:
+                member = self.claim()
+            except Exception as e:
+                print(f"❌ 讀取{self.label}佇列失敗: {e}")
+                time.sleep(WORKER_POLL_SECONDS)
+                continue
+            if not member:
+                continue
+            with app.app_context():
+                process(member)
+
+    def _reaper_loop(self, app, stop_event: threading.Event):
+        interval = max(1, self.visibility_timeout // 2)
+        while not stop_event.wait(interval):
+            with app.app_context():
+                self.requeue_stalled()
+
+    def run_workers(self, app, process: Callable[[Any], None], concurrency: int, thread_prefix: str):
+        """
+        啟動 worker 執行緒與逾時檢查執行緒（阻塞直到收到中斷訊號）
+
+        參數：
+        - process: 處理單一工作的函數，參數為佇列中的原始內容，需自行呼叫 ack / retry
+        """
+        with app.app_context():
+            self.requeue_stalled()
+
+        stop_event = threading.Event()
+        threads = []
+        for i in range(max(1, concurrency)):
+            thread = threading.Thread(target=self._worker_loop, args=(app, process, stop_event),
+                                      name=f"{thread_prefix}-{i}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        reaper = threading.Thread(target=self._reaper_loop, args=(app, stop_event),
+                                  name=f"{thread_prefix}-reaper", daemon=True)
+        reaper.start()
+        print(f"🚀 {self.label} worker 已啟動，併發數: {len(threads)}")
+
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print(f"🛑 收到中斷訊號，等待進行中的{self.label}完成...")
+            stop_event.set()
+            for thread in threads:
+                thread.join()
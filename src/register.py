@@ -1,8 +1,8 @@
 from werkzeug.security import generate_password_hash
-from flask_mail import Message
 from flask import jsonify, request, redirect, url_for, Blueprint, current_app
 import uuid
-from accessories import mail, redis_client, mongo, save_json_to_mongo
+from accessories import redis_client, mongo, save_json_to_mongo
+from src.mail_outbox import enqueue_mail
 from bson.objectid import ObjectId
 register_bp = Blueprint('register', __name__)
 
@@ -11,9 +11,8 @@ def register():
     if request.method == 'OPTIONS':
         return '', 204
     def send_verification_email(email, verification_link):
-        msg = Message("Please verify your email", recipients=[email])
-        msg.body = f"Click the link to verify your email: {verification_link}"
-        mail.send(msg)
+        enqueue_mail(email, "Please verify your email",
+                     body=f"Click the link to verify your email: {verification_link}")
     data = request.get_json()
     name = data.get("name")
     email = data.get("email")
@@ -0,0 +1,113 @@
+"""
+背景排程器 - 以 Redis 租約鎖選出唯一的 leader 執行週期性工作
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, List, Tuple
+import schedule
+from accessories import redis_client
+
+LEADER_LOCK_KEY = 'scheduler:leader'
+# leader 租約長度（秒）
+LEADER_LEASE_SECONDS = 30
+# 續約 / 嘗試取得鎖的間隔（秒），需小於租約長度
+LEADER_RENEW_SECONDS = 10
+# 排程迴圈的檢查間隔（秒）
+TICK_SECONDS = 1
+
+# 只在鎖仍屬於自己時續約 / 釋放
+_RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaderLock:
+    """Redis 租約鎖：同一時間只有一個實例持有"""
+
+    def __init__(self, key: str = LEADER_LOCK_KEY, lease_seconds: int = LEADER_LEASE_SECONDS):
+        self.key = key
+        self.lease_seconds = lease_seconds
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._renew_script = None
+        self._release_script = None
+
+    def acquire_or_renew(self) -> bool:
+        """已是 leader 時續約，否則嘗試取得鎖，返回目前是否為 leader"""
+        try:
+            if self.is_leader:
+                if self._renew_script is None:
+                    self._renew_script = redis_client.register_script(_RENEW_LUA)
+                renewed = self._renew_script(keys=[self.key], args=[self.instance_id, self.lease_seconds])
+                if not renewed:
+                    print(f"⚠️ 排程器 leader 租約已失效: {self.instance_id}")
+                self.is_leader = bool(renewed)
+            else:
+                acquired = redis_client.set(self.key, self.instance_id, nx=True, ex=self.lease_seconds)
+                if acquired:
+                    print(f"👑 排程器成為 leader: {self.instance_id}")
+                self.is_leader = bool(acquired)
+        except Exception as e:
+            print(f"❌ 排程器 leader 鎖操作失敗: {e}")
+            self.is_leader = False
+        return self.is_leader
+
+    def release(self):
+        """釋放鎖（僅在自己持有時），讓其他實例立即接手"""
+        if not self.is_leader:
+            return
+        try:
+            if self._release_script is None:
+                self._release_script = redis_client.register_script(_RELEASE_LUA)
+            self._release_script(keys=[self.key], args=[self.instance_id])
+        except Exception as e:
+            print(f"⚠️ 釋放排程器 leader 鎖失敗: {e}")
+        self.is_leader = False
+
+
+def run_scheduler(app, jobs: List[Tuple[int, Callable[[], None]]], stop_event: threading.Event = None):
+    """
+    執行排程迴圈（阻塞）
+
+    參數：
+    - jobs: [(間隔分鐘, 工作函數), ...]，工作在 Flask app context 中執行
+    - stop_event: 設定後結束迴圈並釋放 leader 鎖
+    """
+    stop_event = stop_event or threading.Event()
+    scheduler = schedule.Scheduler()
+    for interval_minutes, job in jobs:
+        scheduler.every(interval_minutes).minutes.do(job)
+
+    lock = LeaderLock()
+    next_renew_at = 0.0
+    try:
+        while not stop_event.is_set():
+            now = time.time()
+            if now >= next_renew_at:
+                lock.acquire_or_renew()
+                next_renew_at = now + LEADER_RENEW_SECONDS
+            if lock.is_leader:
+                with app.app_context():
+                    scheduler.run_pending()
+            stop_event.wait(TICK_SECONDS)
+    finally:
+        lock.release()
+
+
+def start_scheduler_thread(app, jobs: List[Tuple[int, Callable[[], None]]]) -> threading.Thread:
+    """在背景執行緒啟動排程器（單一行程部署時使用，仍受 leader 鎖保護）"""
+    thread = threading.Thread(target=run_scheduler, args=(app, jobs), name="scheduler", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,260 @@
+"""
+靜態檔案快取 - 圖片與教材的記憶體快取、ETag 驗證與預先壓縮
+"""
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import stat as stat_module
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+from flask import Response, current_app, request
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# 記憶體快取總容量上限（位元組，含壓縮版本）
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+# 單一檔案超過此大小不放入快取，直接讀取
+MAX_CACHED_FILE_BYTES = 8 * 1024 * 1024
+# 小於此大小的內容不壓縮
+MIN_COMPRESS_BYTES = 1024
+# 內容版本（?v=）使用的雜湊長度
+VERSION_LENGTH = 12
+# 帶版本參數的資源快取一年
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# 允許的圖片縮圖寬度（限制變體數量，避免任意尺寸佔滿快取）
+IMAGE_VARIANT_WIDTHS = (320, 640, 1024)
+
+COMPRESSIBLE_MIME_PREFIXES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+# mimetypes 無法判斷時使用的圖片 MIME 類型
+IMAGE_MIME_MAP = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.svg': 'image/svg+xml'
+}
+
+
+def guess_image_mimetype(filename: str) -> str:
+    """判斷圖片的 MIME 類型，無法判斷時預設為 image/jpeg"""
+    mime_type, _ = mimetypes.guess_type(filename)
+    if mime_type:
+        return mime_type
+    ext = os.path.splitext(filename)[1].lower()
+    return IMAGE_MIME_MAP.get(ext, 'image/jpeg')
+
+
+class CachedAsset:
+    """快取中的單一資源（原始內容與壓縮版本）"""
+
+    def __init__(self, body: bytes, mimetype: str, mtime: float, size: int):
+        self.body = body
+        self.mimetype = mimetype
+        self.mtime = mtime
+        self.size = size
+        digest = hashlib.sha256(body).hexdigest()
+        self.version = digest[:VERSION_LENGTH]
+        self.etag = digest[:32]
+        self.last_modified = datetime.fromtimestamp(int(mtime), tz=timezone.utc)
+        self.variants: Dict[str, bytes] = {}
+        if len(body) >= MIN_COMPRESS_BYTES and mimetype.startswith(COMPRESSIBLE_MIME_PREFIXES):
+            if BROTLI_AVAILABLE:
+                compressed = brotli.compress(body)
+                if len(compressed) < len(body):
+                    self.variants['br'] = compressed
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.variants['gzip'] = compressed
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.body) + sum(len(v) for v in self.variants.values())
+
+
+_cache: "OrderedDict[str, CachedAsset]" = OrderedDict()
+_cache_bytes = 0
+_lock = threading.Lock()
+
+
+def _store(cache_key: str, asset: CachedAsset):
+    global _cache_bytes
+    with _lock:
+        previous = _cache.pop(cache_key, None)
+        if previous is not None:
+            _cache_bytes -= previous.nbytes
+        _cache[cache_key] = asset
+        _cache_bytes += asset.nbytes
+        # 超過容量時淘汰最久未使用的資源
+        while _cache_bytes > MAX_CACHE_BYTES and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= evicted.nbytes
+
+
+def load_asset(filepath: str, mimetype: str, render: Optional[Callable[[bytes], bytes]] = None,
+               cache_key: Optional[str] = None) -> Optional[CachedAsset]:
+    """
+    讀取檔案並返回快取資源，檔案不存在時返回 None
+
+    參數：
+    - render: 將原始檔案內容轉換為回應內容的函數（例如包成 JSON）
+    - cache_key: 同一檔案有不同 render 時用來區分快取
+    """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    if not stat_module.S_ISREG(stat.st_mode):
+        return None
+
+    cache_key = cache_key or f"{mimetype}:{filepath}"
+    with _lock:
+        asset = _cache.get(cache_key)
+        if asset is not None and asset.mtime == stat.st_mtime and asset.size == stat.st_size:
+            _cache.move_to_end(cache_key)
+            return asset
+
+    with open(filepath, 'rb') as f:
+        raw = f.read()
+    asset = CachedAsset(render(raw) if render else raw, mimetype, stat.st_mtime, stat.st_size)
+    if stat.st_size <= MAX_CACHED_FILE_BYTES:
+        _store(cache_key, asset)
+    return asset
+
+
+def get_image_version(filepath: str) -> Optional[str]:
+    """獲取圖片內容版本（用於產生 ?v= 參數），檔案不存在時返回 None"""
+    asset = load_asset(filepath, guess_image_mimetype(filepath))
+    return asset.version if asset else None
+
+
+def _choose_encoding(asset: CachedAsset) -> Optional[str]:
+    accepted = request.accept_encodings
+    for encoding in ('br', 'gzip'):
+        if encoding in asset.variants and accepted[encoding]:
+            return encoding
+    return None
+
+
+def _is_not_modified(asset: CachedAsset, etag: str) -> bool:
+    if_none_match = request.if_none_match
+    if if_none_match:
+        return if_none_match.contains(etag) or if_none_match.contains(asset.etag) or if_none_match.star_tag
+    if_modified_since = request.if_modified_since
+    return if_modified_since is not None and asset.last_modified <= if_modified_since
+
+
+def make_cached_response(asset: CachedAsset, max_age: Optional[int] = None,
+                         version: Optional[str] = None) -> Response:
+    """
+    依請求標頭產生回應（304、壓縮版本或原始內容），並設定快取標頭
+
+    參數：
+    - version: 判斷 ?v= 是否相符時使用的版本（縮圖等衍生內容使用原始檔案的版本）
+    """
+    encoding = _choose_encoding(asset)
+    etag = f"{asset.etag}-{encoding}" if encoding else asset.etag
+
+    if request.args.get('v') == (version or asset.version):
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    else:
+        if max_age is None:
+            max_age = current_app.config.get('STATIC_CACHE_MAX_AGE', 0)
+        cache_control = f'public, max-age={max_age}' if max_age else 'no-cache'
+
+    if _is_not_modified(asset, etag):
+        response = Response(status=304)
+    else:
+        response = Response(asset.variants[encoding] if encoding else asset.body, mimetype=asset.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(etag)
+    response.last_modified = asset.last_modified
+    response.headers['Cache-Control'] = cache_control
+    if asset.variants:
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def send_cached_file(filepath: str, mimetype: str, max_age: Optional[int] = None) -> Optional[Response]:
+    """以快取提供靜態檔案，檔案不存在時返回 None"""
+    asset = load_asset(filepath, mimetype)
+    if asset is None:
+        return None
+    return make_cached_response(asset, max_age)
+
+
+def send_cached_json_file(filepath: str, build_payload: Callable[[str], dict],
+                          max_age: Optional[int] = None) -> Optional[Response]:
+    """
+    以快取提供由文字檔產生的 JSON 回應，檔案不存在時返回 None
+
+    參數：
+    - build_payload: 以檔案文字內容建立 JSON 物件的函數
+    """
+    def render(raw: bytes) -> bytes:
+        payload = build_payload(raw.decode('utf-8'))
+        return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+    asset = load_asset(filepath, 'application/json', render=render, cache_key=f"json:{filepath}")
+    if asset is None:
+        return None
+    return make_cached_response(asset, max_age)
+
+
+def _snap_variant_width(width: int) -> int:
+    """將要求的寬度對齊到允許的縮圖寬度（取不小於要求的最小值）"""
+    for allowed in IMAGE_VARIANT_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return IMAGE_VARIANT_WIDTHS[-1]
+
+
+def _resize_image(raw: bytes, width: int) -> bytes:
+    """等比例縮小圖片到指定寬度，原圖不大於該寬度時返回原內容"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(raw)) as img:
+        if img.width <= width:
+            return raw
+        image_format = img.format or 'PNG'
+        resized = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+        if image_format == 'JPEG' and resized.mode not in ('RGB', 'L'):
+            resized = resized.convert('RGB')
+        output = io.BytesIO()
+        resized.save(output, format=image_format, optimize=True)
+        return output.getvalue()
+
+
+def send_cached_image(filepath: str, mimetype: str, width: Optional[int] = None,
+                      max_age: Optional[int] = None) -> Optional[Response]:
+    """
+    以快取提供圖片，可指定縮圖寬度，檔案不存在時返回 None
+
+    縮圖需要 Pillow；無法縮放（未安裝或格式不支援）時提供原圖。
+    """
+    original = load_asset(filepath, mimetype)
+    if original is None:
+        return None
+    if not width or width <= 0 or mimetype == 'image/svg+xml':
+        return make_cached_response(original, max_age)
+
+    width = _snap_variant_width(width)
+    try:
+        variant = load_asset(filepath, mimetype, render=lambda raw: _resize_image(raw, width),
+                             cache_key=f"w{width}:{filepath}")
+    except Exception as e:
+        print(f"⚠️ 圖片縮放失敗，改提供原圖: {filepath} - {e}")
+        variant = None
+    return make_cached_response(variant or original, max_age, version=original.version)
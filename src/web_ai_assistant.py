@@ -24,6 +24,7 @@ from langchain.agents import create_tool_calling_agent, AgentExecutor
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from tool.api_keys import get_api_key
 from accessories import refresh_token
+from src.intent_router import route_message
 
 # LINE Bot 工具導入
 from src.linebot import (
@@ -50,6 +51,17 @@ llm = None
 tools = []
 agent_executor = None
 
+# 每個平台只建立一次主代理人（工具集、提示詞模板與 LLM 綁定在行程內共用）
+# 每次請求的狀態（user_id、對話記憶）在呼叫時透過 input 與線程本地變量注入
+_platform_executors: Dict[str, AgentExecutor] = {}
+_agent_lock = threading.Lock()
+
+# 代理人執行過程是否輸出詳細日誌（預設關閉，除錯時以環境變數開啟）
+AGENT_VERBOSE = os.getenv('WEB_AI_AGENT_VERBOSE', 'false').lower() == 'true'
+
+# 是否啟用本地意圖路由快速路徑
+INTENT_ROUTER_ENABLED = os.getenv('WEB_AI_INTENT_ROUTER', 'true').lower() == 'true'
+
 # ==================== 初始化代理人相關函數 ====================
 
 def get_google_api_key():
@@ -112,7 +124,7 @@ def create_platform_specific_agent(platform: str = "web"):
         platform_executor = AgentExecutor(
             agent=platform_agent,
             tools=platform_tools,
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             handle_parsing_errors=True,
             return_intermediate_steps=True,  # 啟用 intermediate_steps 以便提取工具結果
             max_iterations=10  # 增加迭代次數，允許AI完成複雜任務
@@ -124,18 +136,42 @@ def create_platform_specific_agent(platform: str = "web"):
         logger.error(f"❌ 創建 {platform} 平台主代理人失敗: {e}")
         raise
 
+def get_platform_agent(platform: str = "web"):
+    """獲取平台主代理人（首次使用時建立並快取，之後的請求直接共用）"""
+    platform = "linebot" if platform == "linebot" else "web"
+    executor = _platform_executors.get(platform)
+    if executor is not None:
+        return executor
+    
+    with _agent_lock:
+        executor = _platform_executors.get(platform)
+        if executor is None:
+            executor = create_platform_specific_agent(platform)
+            _platform_executors[platform] = executor
+            logger.info(f"✅ {platform} 平台主代理人已建立並快取")
+    return executor
+
+def reset_platform_agents():
+    """清除已快取的主代理人與 LLM（更換 API Key 或調整工具後呼叫）"""
+    global llm, tools, agent_executor
+    with _agent_lock:
+        _platform_executors.clear()
+        llm = None
+        tools = []
+        agent_executor = None
+
 # ==================== 核心處理函數 ====================
 
 def get_web_ai_service():
     """獲取Web AI服務 - 延遲初始化"""
     global llm, tools, agent_executor
     
+    if agent_executor is None:
+        agent_executor = get_platform_agent("web")
     if llm is None:
         llm = init_llm()
     if not tools:
-        tools = get_platform_specific_tools("web")
-    if agent_executor is None:
-        agent_executor = create_platform_specific_agent("web")
+        tools = agent_executor.tools
     
     return {
         'llm': llm,
@@ -163,6 +199,7 @@ def get_platform_specific_tools(platform: str = "web"):
             create_linebot_calendar_add_tool(),
             create_linebot_calendar_update_tool(),
             create_linebot_calendar_delete_tool(),
+            create_linebot_checkin_tool(),
             create_memory_tool()
         ]
     else:
@@ -322,11 +359,12 @@ def get_platform_specific_system_prompt(platform: str = "web") -> str:
 7. linebot_goal_add_tool(line_id, goal) - 新增學習目標
 8. linebot_goal_delete_tool(line_id, goal_index) - 刪除學習目標
 9. linebot_news_exam_tool(query) - 最新消息/考試資訊
-10. linebot_calendar_view_tool(line_id) - 查看行事曆
+10. linebot_calendar_view_tool(line_id, today_only) - 查看行事曆（today_only=True 只看今天）
 11. linebot_calendar_add_tool(line_id, title, content, event_date) - 新增行事曆事件
 12. linebot_calendar_update_tool(line_id, event_id, title, content, event_date) - 修改行事曆事件
 13. linebot_calendar_delete_tool(line_id, event_id) - 刪除行事曆事件
-14. memory_tool(action, user_id) - 記憶管理（可選使用，系統已自動提供對話上下文）
+14. linebot_checkin_tool(line_id) - 每日簽到
+15. memory_tool(action, user_id) - 記憶管理（可選使用，系統已自動提供對話上下文）
 
 ---
 重要：上下文管理
@@ -581,8 +619,8 @@ def process_message(message: str, user_id: str = "default", platform: str = "web
                 # 若解釋流程失敗，退回主代理人
                 pass
 
-        # 根據平台創建對應的主代理人
-        platform_executor = create_platform_specific_agent(platform)
+        # 獲取平台對應的主代理人（已快取，不會每次重建）
+        platform_executor = get_platform_agent(platform)
         
         if platform_executor is None:
             logger.error("❌ 無法創建平台特定代理人")
@@ -592,6 +630,23 @@ def process_message(message: str, user_id: str = "default", platform: str = "web
                 'timestamp': datetime.now().isoformat()
             }
         
+        # 意圖明確的常見需求（簽到、行事曆、隨機測驗等）直接呼叫工具，不經過主代理人規劃
+        if INTENT_ROUTER_ENABLED:
+            fast_result = route_message(message, user_id, platform, platform_executor.tools)
+            if fast_result:
+                response = fast_result['content']
+                try:
+                    add_ai_message(user_id, response)
+                except Exception as e:
+                    logger.warning(f"添加AI回應到記憶失敗: {e}")
+                return {
+                    'success': True,
+                    'content': response,
+                    'message': response,
+                    'intent': fast_result['intent'],
+                    'timestamp': datetime.now().isoformat()
+                }
+        
         # 使用平台特定的主代理人處理
         # 對於 LINE Bot，將 user_id 和詳細時間信息包含在 input 中，讓工具能獲取到
         if platform == "linebot":
@@ -1160,18 +1215,36 @@ def create_linebot_calendar_view_tool():
     from langchain_core.tools import tool
     
     @tool
-    def linebot_calendar_view_tool(line_id: str) -> str:
+    def linebot_calendar_view_tool(line_id: str, today_only: bool = False) -> str:
         """LINE Bot 行事曆查看工具 - 查看學習計畫
         
         Args:
             line_id: LINE 用戶 ID
+            today_only: 是否只查看今天的事件（用戶問「今天有什麼行程」時為 True）
         """
         from src.dashboard import get_calendar_for_linebot
         
-        return get_calendar_for_linebot(line_id)
+        return get_calendar_for_linebot(line_id, today_only)
     
     return linebot_calendar_view_tool
 
+def create_linebot_checkin_tool():
+    """創建 LINE Bot 每日簽到工具"""
+    from langchain_core.tools import tool
+    
+    @tool
+    def linebot_checkin_tool(line_id: str) -> str:
+        """LINE Bot 每日簽到工具 - 用戶要簽到、打卡時調用
+        
+        Args:
+            line_id: LINE 用戶 ID
+        """
+        from src.dashboard import checkin_for_linebot
+        
+        return checkin_for_linebot(line_id)
+    
+    return linebot_checkin_tool
+
 def create_linebot_calendar_add_tool():
     """創建 LINE Bot 行事曆新增工具"""
     from langchain_core.tools import tool
@@ -6,7 +6,6 @@
 """
 
 import logging
-import os
 from typing import List, Dict, Any, Optional
 import json
 
@@ -14,7 +13,7 @@ logger = logging.getLogger(__name__)
 
 try:
     import chromadb
-    from chromadb.config import Settings
+    from src.rag_sys.vector_store import get_chroma_client, get_collection
     CHROMADB_AVAILABLE = True
 except ImportError:
     CHROMADB_AVAILABLE = False
@@ -29,26 +28,9 @@ def init_chromadb_knowledge_collection():
         raise RuntimeError("ChromaDB 未安裝，請安裝：pip install chromadb")
     
     try:
-        # 獲取當前文件的絕對路徑
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        # 構建向量資料庫的絕對路徑
-        db_path = os.path.join(current_dir, "rag_sys", "data", "knowledge_db", "chroma_db")
-        
-        # 確保目錄存在
-        os.makedirs(db_path, exist_ok=True)
-        
-        chroma_client = chromadb.PersistentClient(
-            path=db_path,
-            settings=Settings(anonymized_telemetry=False)
-        )
-        
-        # 獲取或創建集合
-        collection = chroma_client.get_or_create_collection(
-            name="website_knowledge",
-            metadata={"hnsw:space": "cosine", "description": "網站功能知識庫"}
-        )
-        
-        logger.info("✅ ChromaDB 網站知識庫集合初始化成功")
+        # 使用行程內共用的 Client 與集合，不再每次重新開啟向量資料庫
+        chroma_client = get_chroma_client()
+        collection = get_collection("website_knowledge")
         return chroma_client, collection
     except Exception as e:
         logger.error(f"❌ ChromaDB 知識庫初始化失敗: {e}")
@@ -0,0 +1,48 @@
+"""意圖路由：會寫入資料的意圖（簽到）只能由錨定規則觸發，且不受否定 / 疑問句觸發"""
+import pytest
+
+from src.intent_router import INTENTS, _classifiable_intents, classify_intent
+
+NOT_CHECKIN_MESSAGES = ['不要簽到', '昨天簽到了嗎', '我今天簽到了嗎', '別幫我打卡', '簽到了沒', '簽到？']
+
+
+def _intent_name(message, platform='linebot'):
+    result = classify_intent(message, platform)
+    return result[0]['name'] if result else None
+
+
+@pytest.mark.parametrize('message', ['簽到', '我要簽到', '幫我打卡', '每日簽到', '今天簽到'])
+def test_checkin_rule_matches(message):
+    assert _intent_name(message) == 'checkin'
+
+
+@pytest.mark.parametrize('message', NOT_CHECKIN_MESSAGES)
+def test_negation_and_question_do_not_check_in(message):
+    assert _intent_name(message) != 'checkin'
+
+
+@pytest.mark.parametrize('platform', ['linebot', 'web'])
+def test_classifier_only_sees_read_only_intents(platform):
+    intents = _classifiable_intents(platform)
+    assert intents
+    assert all(intent['read_only'] for intent in intents)
+    assert 'checkin' not in {intent['name'] for intent in intents}
+
+
+def test_write_intents_are_marked():
+    write_tools = {intent['tool'] for intent in INTENTS if not intent['read_only']}
+    assert {'linebot_checkin_tool', 'linebot_quiz_generator_tool', 'quiz_generator_tool'} <= write_tools
+
+
+@pytest.mark.parametrize('message', NOT_CHECKIN_MESSAGES)
+def test_classifier_never_returns_checkin(message):
+    pytest.importorskip('sklearn')
+    descriptions = {'linebot_checkin_tool': '每日簽到，記錄用戶今天的簽到並累積連續簽到天數'}
+    result = classify_intent(message, 'linebot', descriptions)
+    assert result is None or result[0]['name'] != 'checkin'
+
+
+def test_read_only_rules_still_route():
+    assert _intent_name('查看行事曆') == 'calendar'
+    assert _intent_name('今天有什麼行程') == 'today_events'
+    assert _intent_name('網站有哪些功能', 'web') == 'navigation'
@@ -0,0 +1,135 @@
+"""客觀題本地評分：各種作答格式正規化後需與標準答案一致，無法確定時交由 AI 評分（回傳 None）"""
+import pytest
+
+from src.objective_grader import grade_objective_answer
+
+CHOICE_OPTIONS = ['(A)Bubble Sort', '(B)Selection Sort', '(C)Merge Sort', '(D)Heap Sort']
+PLAIN_OPTIONS = ['Stack', 'Queue', 'Tree', 'Graph']
+TRUE_FALSE_OPTIONS = ['是', '否']
+REVERSED_TRUE_FALSE_OPTIONS = ['否', '是']
+
+
+def _grade(question_type, correct_answer, user_answer, options=None):
+    result = grade_objective_answer({
+        'question_id': 'q1',
+        'question_type': question_type,
+        'correct_answer': correct_answer,
+        'user_answer': user_answer,
+        'options': options or [],
+    })
+    return None if result is None else result['is_correct']
+
+
+@pytest.mark.parametrize('correct_answer, user_answer, options, expected', [
+    ('B', 'B', CHOICE_OPTIONS, True),
+    ('B', 'b', CHOICE_OPTIONS, True),
+    ('B', '(B)', CHOICE_OPTIONS, True),
+    ('B', 'B. Selection Sort', CHOICE_OPTIONS, True),
+    ('B', 'Selection Sort', CHOICE_OPTIONS, True),
+    ('B', '(B)Selection Sort', CHOICE_OPTIONS, True),
+    ('B', 1, CHOICE_OPTIONS, True),
+    ('(B)Selection Sort', 'b', CHOICE_OPTIONS, True),
+    ('B', 'C', CHOICE_OPTIONS, False),
+    ('B', 0, CHOICE_OPTIONS, False),
+    ('B', 'Merge Sort', CHOICE_OPTIONS, False),
+    ('Queue', 'b', PLAIN_OPTIONS, True),
+    ('Queue', 1, PLAIN_OPTIONS, True),
+    ('Queue', 'Tree', PLAIN_OPTIONS, False),
+    # 代號與內容不一致、超出選項範圍、無法辨識：交由 AI
+    ('B', 'B. Merge Sort', CHOICE_OPTIONS, None),
+    ('B', 'E', CHOICE_OPTIONS, None),
+    ('B', 7, CHOICE_OPTIONS, None),
+    ('B', '我不知道', CHOICE_OPTIONS, None),
+    ('B', '', CHOICE_OPTIONS, None),
+    ('B', None, CHOICE_OPTIONS, None),
+    ('', 'B', CHOICE_OPTIONS, None),
+])
+def test_single_choice(correct_answer, user_answer, options, expected):
+    assert _grade('single-choice', correct_answer, user_answer, options) == expected
+
+
+@pytest.mark.parametrize('correct_answer, user_answer, options, expected', [
+    ('ABD', 'ABD', CHOICE_OPTIONS, True),
+    ('ABD', 'dba', CHOICE_OPTIONS, True),
+    ('ABD', 'A,B,D', CHOICE_OPTIONS, True),
+    ('ABD', 'A、B、D', CHOICE_OPTIONS, True),
+    ('ABD', '(A)(B)(D)', CHOICE_OPTIONS, True),
+    ('ABD', ['D', 'A', 'B'], CHOICE_OPTIONS, True),
+    ('ABD', [0, 1, 3], CHOICE_OPTIONS, True),
+    (['A', 'B', 'D'], 'A B D', CHOICE_OPTIONS, True),
+    ('A,C', ['Stack', 'Tree'], PLAIN_OPTIONS, True),
+    ('ABD', 'AB', CHOICE_OPTIONS, False),
+    ('ABD', 'ABCD', CHOICE_OPTIONS, False),
+    ('B', 'B', CHOICE_OPTIONS, True),
+    ('B', 'B. Selection Sort', CHOICE_OPTIONS, True),
+    ('A', 'A、B、D', CHOICE_OPTIONS, False),
+    # 含無法辨識的項目：交由 AI
+    ('ABD', 'A,B,Z', CHOICE_OPTIONS, None),
+    ('A', 'A、B、Z', CHOICE_OPTIONS, None),
+    ('ABD', ['A', '其他'], CHOICE_OPTIONS, None),
+    ('ABD', '', CHOICE_OPTIONS, None),
+])
+def test_multiple_choice(correct_answer, user_answer, options, expected):
+    assert _grade('multiple-choice', correct_answer, user_answer, options) == expected
+
+
+@pytest.mark.parametrize('correct_answer, user_answer, options, expected', [
+    ('是', '對', [], True),
+    ('是', '正確。', [], True),
+    ('是', 'O', [], True),
+    ('是', 'True', [], True),
+    ('是', True, [], True),
+    ('是', '(A)正確', [], True),
+    ('否', 'X', [], True),
+    ('否', 'false', [], True),
+    ('否', '錯誤', [], True),
+    ('True', '否', [], False),
+    ('是', 1, [], True),
+    ('是', 0, [], False),
+    # 以選項索引 / 代號作答時，需先對應回選項內容
+    ('是', 0, TRUE_FALSE_OPTIONS, True),
+    ('是', 1, TRUE_FALSE_OPTIONS, False),
+    ('否', 1, TRUE_FALSE_OPTIONS, True),
+    ('是', 'A', TRUE_FALSE_OPTIONS, True),
+    ('是', 'B', TRUE_FALSE_OPTIONS, False),
+    ('是', 1, REVERSED_TRUE_FALSE_OPTIONS, True),
+    ('是', 0, REVERSED_TRUE_FALSE_OPTIONS, False),
+    ('A', '是', TRUE_FALSE_OPTIONS, True),
+    ('B', 0, REVERSED_TRUE_FALSE_OPTIONS, False),
+    ('是', 'T', TRUE_FALSE_OPTIONS, True),
+    ('是', 'F', TRUE_FALSE_OPTIONS, False),
+    # 無法辨識：交由 AI
+    ('是', '不一定', [], None),
+    ('是', 5, TRUE_FALSE_OPTIONS, None),
+    ('是', None, TRUE_FALSE_OPTIONS, None),
+    ('視情況而定', '是', [], None),
+])
+def test_true_false(correct_answer, user_answer, options, expected):
+    assert _grade('true-false', correct_answer, user_answer, options) == expected
+
+
+@pytest.mark.parametrize('question_type, correct_answer, user_answer', [
+    ('fill-in', 'O(n log n)', 'O(n log n)'),
+    ('fill-in', 'O(n log n)', ' o(N LOG N) '),
+    ('fill-in', 'Stack', 'stack'),
+    ('fill-in', '堆疊', 'Stack'),
+    ('short-answer', '先進先出', '先進先出'),
+    ('drawing-answer', '二元樹', ''),
+])
+def test_fill_in_and_open_ended_go_to_ai(question_type, correct_answer, user_answer):
+    # 填空題的同義寫法無法以規則確定，一律交由 AI 評分
+    assert _grade(question_type, correct_answer, user_answer) is None
+
+
+def test_local_result_matches_ai_result_format():
+    result = grade_objective_answer({
+        'question_id': 'q9',
+        'question_type': 'single-choice',
+        'correct_answer': 'B',
+        'user_answer': 'b',
+        'options': CHOICE_OPTIONS,
+    })
+    assert result['question_id'] == 'q9'
+    assert result['score'] == 100
+    assert result['graded_by'] == 'local'
+    assert {'explanation', 'strengths', 'weaknesses', 'suggestions'} <= set(result['feedback'])
@@ -3,12 +3,36 @@
 """
 多組API密鑰管理系統
 支援多個不同的API密鑰組，可以指定使用特定組或隨機選擇
+
+配額感知排程：
+- 每個密鑰維護每分鐘請求數與 token 數的令牌桶
+- 記錄 429（配額用盡）與 5xx 結果，異常密鑰進入逐次加長的冷卻期
+- 在鎖保護下分配「負載最低且健康」的密鑰，避免整批請求集中在已達配額的密鑰
 """
 
 import os
+import re
+import time
 import random
+import threading
+from contextlib import contextmanager
 from typing import List, Dict, Optional
 
+# 每個密鑰的預設配額（可於 api.env 或環境變數 GEMINI_RPM_PER_KEY / GEMINI_TPM_PER_KEY 覆寫）
+DEFAULT_REQUESTS_PER_MINUTE = 10
+DEFAULT_TOKENS_PER_MINUTE = 250000
+# 429 冷卻基準秒數（連續發生時倍增）
+RATE_LIMIT_COOLDOWN_SECONDS = 60
+# 連續 5xx 達門檻後的冷卻基準秒數（連續發生時倍增）
+SERVER_ERROR_COOLDOWN_SECONDS = 15
+SERVER_ERROR_THRESHOLD = 3
+MAX_COOLDOWN_SECONDS = 900
+# 取得密鑰時預設最長等待秒數
+DEFAULT_ACQUIRE_TIMEOUT_SECONDS = 30.0
+
+_RATE_LIMIT_PATTERN = re.compile(r'\b429\b|RESOURCE_EXHAUSTED|quota|rate.?limit', re.IGNORECASE)
+_SERVER_ERROR_PATTERN = re.compile(r'\b5\d\d\b|UNAVAILABLE|INTERNAL|DEADLINE_EXCEEDED|overloaded', re.IGNORECASE)
+
 def load_env_file(file_path: str) -> dict:
     """載入.env文件"""
     env_vars = {}
@@ -28,6 +52,104 @@ def load_env_file(file_path: str) -> dict:
     
     return env_vars
 
+def classify_api_error(error) -> Optional[int]:
+    """將例外或錯誤訊息歸類為 HTTP 狀態碼（429 / 5xx），無法判斷時返回 None"""
+    if error is None:
+        return None
+    for attr in ('status_code', 'code', 'status'):
+        value = getattr(error, attr, None)
+        if isinstance(value, int) and (value == 429 or 500 <= value < 600):
+            return value
+    message = str(error)
+    if _RATE_LIMIT_PATTERN.search(message):
+        return 429
+    if _SERVER_ERROR_PATTERN.search(message):
+        return 503
+    return None
+
+
+class TokenBucket:
+    """令牌桶：容量為每分鐘配額，依時間連續補充"""
+
+    def __init__(self, capacity_per_minute: float):
+        self.capacity = float(capacity_per_minute)
+        self.tokens = float(capacity_per_minute)
+        self.refill_rate = self.capacity / 60.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+            self.updated_at = now
+
+    def available(self, now: float) -> float:
+        self._refill(now)
+        return self.tokens
+
+    def consume(self, amount: float, now: float):
+        """扣除令牌（允許扣成負值，代表預借，之後需等待補回）"""
+        self._refill(now)
+        self.tokens -= amount
+
+    def seconds_until(self, amount: float, now: float) -> float:
+        """距離可扣除 amount 個令牌還需等待的秒數"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount or self.refill_rate <= 0:
+            return 0.0
+        return (amount - self.tokens) / self.refill_rate
+
+    def drain(self, now: float):
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+
+
+class KeyState:
+    """單一密鑰的配額與健康狀態"""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.rate_limit_strikes = 0
+        self.server_error_strikes = 0
+        self.total_requests = 0
+        self.rate_limited_count = 0
+        self.server_error_count = 0
+        self.last_used = 0.0
+
+    def wait_seconds(self, estimated_tokens: float, now: float) -> float:
+        """距離此密鑰可再使用還需等待的秒數"""
+        return max(
+            self.cooldown_until - now,
+            self.request_bucket.seconds_until(1, now),
+            self.token_bucket.seconds_until(estimated_tokens, now),
+            0.0
+        )
+
+
+class KeyLease:
+    """密鑰租約：由 lease_key 產生，呼叫端可回報本次呼叫結果"""
+
+    def __init__(self, manager: 'MultiGroupAPIKeyManager', key: str, estimated_tokens: int = 0):
+        self.manager = manager
+        self.key = key
+        self.estimated_tokens = estimated_tokens
+        self.reported = False
+
+    def succeed(self, tokens_used: Optional[int] = None):
+        """回報呼叫成功（可附上實際 token 用量以校正配額）"""
+        self.reported = True
+        self.manager.record_result(self.key, tokens_used=tokens_used, estimated_tokens=self.estimated_tokens)
+
+    def fail(self, error=None, status_code: Optional[int] = None):
+        """回報呼叫失敗（429 / 5xx 會讓密鑰進入冷卻）"""
+        self.reported = True
+        self.manager.record_result(self.key, status_code=status_code, error=error or 'failed')
+
+
 class MultiGroupAPIKeyManager:
     """多組API密鑰管理器"""
     
@@ -36,6 +158,8 @@ class MultiGroupAPIKeyManager:
         初始化API密鑰管理器
         api_group: 指定要使用的API密鑰組，如果為None則隨機選擇
         """
+        self._condition = threading.Condition()
+        self.key_states: Dict[str, KeyState] = {}
         self.api_groups = self._load_all_api_groups()
         self.current_group = api_group or self._get_default_group()
         self.api_keys = self._get_group_keys(self.current_group)
@@ -49,6 +173,8 @@ class MultiGroupAPIKeyManager:
         # 從api.env讀取所有API密鑰組
         api_env_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'api.env')
         env_vars = load_env_file(api_env_path)
+        self.requests_per_minute = float(os.getenv('GEMINI_RPM_PER_KEY') or env_vars.get('GEMINI_RPM_PER_KEY') or DEFAULT_REQUESTS_PER_MINUTE)
+        self.tokens_per_minute = float(os.getenv('GEMINI_TPM_PER_KEY') or env_vars.get('GEMINI_TPM_PER_KEY') or DEFAULT_TOKENS_PER_MINUTE)
         
         api_groups = {}
         
@@ -61,6 +187,12 @@ class MultiGroupAPIKeyManager:
                     api_groups[group_name] = keys
                     print(f"✅ 載入 {group_name}: {len(keys)} 個密鑰")
         
+        # 為新密鑰建立配額狀態（重新載入時保留既有狀態）
+        for keys in api_groups.values():
+            for key in keys:
+                if key not in self.key_states:
+                    self.key_states[key] = KeyState(self.requests_per_minute, self.tokens_per_minute)
+        
         return api_groups
     
     def _parse_api_keys(self, keys_string: str) -> List[str]:
@@ -135,43 +267,184 @@ class MultiGroupAPIKeyManager:
         if group_name not in self.api_groups:
             raise ValueError(f"API密鑰組 '{group_name}' 不存在")
         
-        self.current_group = group_name
-        self.api_keys = self._get_group_keys(group_name)
-        self.current_index = 0
+        with self._condition:
+            self.current_group = group_name
+            self.api_keys = self._get_group_keys(group_name)
+            self.current_index = 0
         print(f"🔄 切換到API密鑰組: {group_name}")
         print(f"📊 可用密鑰數量: {len(self.api_keys)} 個")
     
     def reload_groups(self):
         """重新載入所有API密鑰組"""
-        self.api_groups = self._load_all_api_groups()
-        self.api_keys = self._get_group_keys(self.current_group)
-        self.current_index = 0
+        with self._condition:
+            self.api_groups = self._load_all_api_groups()
+            self.api_keys = self._get_group_keys(self.current_group)
+            self.current_index = 0
         print(f"🔄 重新載入API密鑰組: {self.current_group}")
         print(f"📊 可用密鑰數量: {len(self.api_keys)} 個")
 
+    # ===== 配額感知排程 =====
+    
+    def _candidate_keys(self, api_group: Optional[str]) -> List[str]:
+        """獲取候選密鑰（指定組或目前組），不改變全域目前組"""
+        if api_group:
+            return self._get_group_keys(api_group)
+        if not self.api_keys:
+            raise ValueError(f"API密鑰組 '{self.current_group}' 沒有可用的密鑰")
+        return self.api_keys
+    
+    def _select_key(self, keys: List[str], estimated_tokens: float, now: float) -> Optional[str]:
+        """挑選目前可用且負載最低的密鑰（需持有鎖），無可用密鑰時返回 None"""
+        best_key = None
+        best_score = None
+        for key in keys:
+            state = self.key_states[key]
+            if state.wait_seconds(estimated_tokens, now) > 0:
+                continue
+            # 進行中請求數少者優先，其次是剩餘請求配額多者，最後是最久未使用者
+            score = (state.in_flight, -state.request_bucket.available(now), state.last_used)
+            if best_score is None or score < best_score:
+                best_key, best_score = key, score
+        return best_key
+    
+    def _consume(self, key: str, estimated_tokens: float, now: float, lease: bool):
+        state = self.key_states[key]
+        state.request_bucket.consume(1, now)
+        state.token_bucket.consume(estimated_tokens, now)
+        state.total_requests += 1
+        state.last_used = now
+        if lease:
+            state.in_flight += 1
+    
+    def acquire_key(self, api_group: Optional[str] = None, estimated_tokens: int = 0,
+                    timeout: Optional[float] = DEFAULT_ACQUIRE_TIMEOUT_SECONDS, lease: bool = True) -> str:
+        """
+        取得負載最低的健康密鑰
+        
+        參數：
+        - api_group: 指定密鑰組，None 表示目前組
+        - estimated_tokens: 預估本次請求的 token 數
+        - timeout: 所有密鑰都達配額或冷卻時最多等待的秒數，逾時後改用最快恢復的密鑰
+        - lease: True 時計入進行中請求數，使用完畢需呼叫 release_key
+        """
+        deadline = time.monotonic() + (timeout or 0)
+        with self._condition:
+            keys = self._candidate_keys(api_group)
+            while True:
+                now = time.monotonic()
+                key = self._select_key(keys, estimated_tokens, now)
+                if key:
+                    self._consume(key, estimated_tokens, now, lease)
+                    return key
+                
+                remaining = deadline - now
+                soonest_wait = min(self.key_states[k].wait_seconds(estimated_tokens, now) for k in keys)
+                if remaining <= 0:
+                    # 逾時：改用最快恢復的密鑰，交由 API 端決定是否拒絕
+                    key = min(keys, key=lambda k: (self.key_states[k].wait_seconds(estimated_tokens, now),
+                                                   self.key_states[k].in_flight))
+                    print(f"⚠️ 所有API密鑰皆達配額或冷卻中，改用最快恢復的密鑰（約 {soonest_wait:.1f} 秒後恢復）")
+                    self._consume(key, estimated_tokens, now, lease)
+                    return key
+                self._condition.wait(min(remaining, max(soonest_wait, 0.05)))
+    
+    def release_key(self, key: str):
+        """釋放 acquire_key 取得的密鑰"""
+        with self._condition:
+            state = self.key_states.get(key)
+            if state and state.in_flight > 0:
+                state.in_flight -= 1
+            self._condition.notify_all()
+    
+    def record_result(self, key: str, status_code: Optional[int] = None, error=None,
+                      tokens_used: Optional[int] = None, estimated_tokens: int = 0):
+        """
+        記錄一次 API 呼叫結果
+        
+        - 成功：清除連續錯誤計數，並以實際 token 用量校正預估值
+        - 429：清空請求配額並進入冷卻（連續發生時冷卻時間倍增）
+        - 5xx：連續達門檻後進入冷卻
+        """
+        if status_code is None and error is not None:
+            status_code = classify_api_error(error)
+        with self._condition:
+            state = self.key_states.get(key)
+            if not state:
+                return
+            now = time.monotonic()
+            if error is None and (status_code is None or status_code < 400):
+                state.rate_limit_strikes = 0
+                state.server_error_strikes = 0
+                if tokens_used is not None:
+                    state.token_bucket.consume(tokens_used - estimated_tokens, now)
+            elif status_code == 429:
+                state.rate_limited_count += 1
+                state.rate_limit_strikes += 1
+                cooldown = min(RATE_LIMIT_COOLDOWN_SECONDS * 2 ** (state.rate_limit_strikes - 1), MAX_COOLDOWN_SECONDS)
+                state.cooldown_until = max(state.cooldown_until, now + cooldown)
+                state.request_bucket.drain(now)
+                print(f"⏸️ API密鑰 {key[:8]}... 達到配額限制，冷卻 {cooldown} 秒")
+            elif status_code and status_code >= 500:
+                state.server_error_count += 1
+                state.server_error_strikes += 1
+                if state.server_error_strikes >= SERVER_ERROR_THRESHOLD:
+                    exponent = state.server_error_strikes - SERVER_ERROR_THRESHOLD
+                    cooldown = min(SERVER_ERROR_COOLDOWN_SECONDS * 2 ** exponent, MAX_COOLDOWN_SECONDS)
+                    state.cooldown_until = max(state.cooldown_until, now + cooldown)
+                    print(f"⏸️ API密鑰 {key[:8]}... 連續 {state.server_error_strikes} 次伺服器錯誤，冷卻 {cooldown} 秒")
+            self._condition.notify_all()
+    
+    @contextmanager
+    def lease_key(self, api_group: Optional[str] = None, estimated_tokens: int = 0,
+                  timeout: Optional[float] = DEFAULT_ACQUIRE_TIMEOUT_SECONDS):
+        """
+        以租約方式使用密鑰：
+            with api_key_manager.lease_key() as lease:
+                model = init_gemini(api_key=lease.key)
+        區塊內拋出例外時自動回報失敗，正常結束且未回報時視為成功
+        """
+        lease = KeyLease(self, self.acquire_key(api_group, estimated_tokens, timeout), estimated_tokens)
+        try:
+            yield lease
+        except Exception as e:
+            if not lease.reported:
+                lease.fail(e)
+            raise
+        else:
+            if not lease.reported:
+                lease.succeed()
+        finally:
+            self.release_key(lease.key)
+
 # 創建全局實例（預設隨機選擇組）
 api_key_manager = MultiGroupAPIKeyManager()
 
 def get_api_key(api_group: Optional[str] = None) -> str:
     """
-    獲取API密鑰的便捷函數
-    api_group: 指定API密鑰組，如果為None則使用當前組
+    獲取API密鑰的便捷函數（挑選負載最低的健康密鑰，不等待）
+    api_group: 指定API密鑰組，如果為None則使用當前組（不會切換全域目前組）
     """
-    if api_group and api_group != api_key_manager.current_group:
-        api_key_manager.switch_group(api_group)
-    
-    return api_key_manager.get_random_key()
+    return api_key_manager.acquire_key(api_group, timeout=0, lease=False)
 
 def get_api_keys_count(api_group: Optional[str] = None) -> int:
     """
     獲取API密鑰數量的便捷函數
     api_group: 指定API密鑰組，如果為None則使用當前組
     """
-    if api_group and api_group != api_key_manager.current_group:
-        api_key_manager.switch_group(api_group)
+    if api_group:
+        return len(api_key_manager.api_groups.get(api_group, []))
     
     return api_key_manager.get_keys_count()
 
+def lease_api_key(api_group: Optional[str] = None, estimated_tokens: int = 0,
+                  timeout: Optional[float] = DEFAULT_ACQUIRE_TIMEOUT_SECONDS):
+    """以租約方式取得密鑰（context manager），見 MultiGroupAPIKeyManager.lease_key"""
+    return api_key_manager.lease_key(api_group, estimated_tokens, timeout)
+
+def report_api_key_result(api_key: str, status_code: Optional[int] = None, error=None):
+    """回報未經租約取得（例如呼叫端指定）的密鑰之呼叫結果（429 / 5xx 會讓密鑰進入冷卻）"""
+    api_key_manager.record_result(api_key, status_code=status_code, error=error)
+
 def get_available_groups() -> List[str]:
     """獲取所有可用的API密鑰組"""
     return api_key_manager.get_all_groups()
@@ -12,7 +12,7 @@ from pymongo import MongoClient
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # 導入標準化函數
-from tool.insert_test_school import normalize_answer_type, get_mongo_connection
+from tool.insert_test_school import normalize_answer_type, get_mongo_connection, invalidate_exam_facets_cache
 
 def check_test_school_questions():
     """檢查測試學校的所有題目"""
@@ -148,6 +148,7 @@ def fix_test_school_questions(dry_run=True, target_count=20):
             result = db.exam.delete_one({'_id': q['_id']})
             if result.deleted_count > 0:
                 print(f"  刪除題目 {q.get('question_number', '?')}")
+        invalidate_exam_facets_cache()
     
     # 2. 重新獲取所有題目（刪除後）
     remaining_questions = list(db.exam.find({
@@ -207,6 +208,9 @@ def fix_test_school_questions(dry_run=True, target_count=20):
                 print(f"[OK] 修復第 {i} 題: {', '.join(changes)}")
                 fixed_count += 1
     
+    if fixed_count:
+        invalidate_exam_facets_cache()
+    
     print(f"\n[OK] 修復完成！")
     print(f"  保留 {len(remaining_questions)} 題")
     print(f"  修復 {fixed_count} 個問題")
@@ -293,6 +297,7 @@ def fix_question_type(question_number, new_answer_type):
     )
     
     if result.modified_count > 0:
+        invalidate_exam_facets_cache()
         print(f"[OK] 修復第 {question_number} 題: answer_type -> '{new_answer_type}'")
         return True
     else:
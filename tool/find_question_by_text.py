@@ -11,7 +11,7 @@ from pymongo import MongoClient
 # 添加父目錄到路徑
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from tool.insert_test_school import get_mongo_connection
+from tool.insert_test_school import get_mongo_connection, invalidate_exam_facets_cache
 
 def find_question_by_text(search_text):
     """搜尋包含特定文字的題目"""
@@ -88,6 +88,7 @@ def fix_question_type(question_number, new_answer_type):
     )
     
     if result.modified_count > 0:
+        invalidate_exam_facets_cache()
         print(f"[OK] 修復第 {question_number} 題: answer_type -> '{new_answer_type}'")
         return True
     else:
@@ -226,6 +226,10 @@ def fix_answer_types(db: Collection, dry_run: bool = True):
         if idx % 1000 == 0:
             print(f"  已處理 {idx}/{total} 題，修復 {fixed_count} 題...")
     
+    if fixed_count:
+        from tool.insert_test_school import invalidate_exam_facets_cache
+        invalidate_exam_facets_cache()
+    
     print("\n" + "=" * 60)
     print(f"修復完成！")
     print(f"  ✅ 成功修復: {fixed_count} 題")
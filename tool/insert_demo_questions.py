@@ -36,6 +36,18 @@ def get_mongo_connection():
         print(f"MongoDB 連接失敗: {str(e)}")
         return None
 
+def invalidate_exam_facets_cache():
+    """題目變動後清除題庫篩選快取與組卷題目池（Web 服務下次讀取時重建）"""
+    try:
+        from config import DevelopmentConfig
+        from src.exam_facets import invalidate_exam_facets_by_url
+        from src.question_pools import invalidate_question_pools_by_url
+        redis_url = DevelopmentConfig().REDIS_URL
+        invalidate_exam_facets_by_url(redis_url)
+        invalidate_question_pools_by_url(redis_url)
+    except Exception as e:
+        print(f"清除題庫篩選快取失敗: {str(e)}")
+
 def insert_demo_questions():
     """插入 7 題 demo 題目到資料庫"""
     
@@ -207,6 +219,9 @@ def insert_demo_questions():
                 else:
                     print(f"[失敗] 插入題目 {question['question_number']} 失敗")
         
+        if inserted_count or updated_count:
+            invalidate_exam_facets_cache()
+        
         print(f"\n統計:")
         print(f"  - 新增題目: {inserted_count}")
         print(f"  - 更新題目: {updated_count}")
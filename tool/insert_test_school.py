@@ -124,6 +124,18 @@ def get_mongo_connection():
         print(f"MongoDB 連接失敗: {str(e)}")
         return None
 
+def invalidate_exam_facets_cache():
+    """題目變動後清除題庫篩選快取與組卷題目池（Web 服務下次讀取時重建）"""
+    try:
+        from config import DevelopmentConfig
+        from src.exam_facets import invalidate_exam_facets_by_url
+        from src.question_pools import invalidate_question_pools_by_url
+        redis_url = DevelopmentConfig().REDIS_URL
+        invalidate_exam_facets_by_url(redis_url)
+        invalidate_question_pools_by_url(redis_url)
+    except Exception as e:
+        print(f"清除題庫篩選快取失敗: {str(e)}")
+
 def insert_test_school_data(auto_mode=False):
     """從資料庫選擇各題型題目插入測試學校"""
     try:
@@ -326,6 +338,9 @@ def insert_test_school_data(auto_mode=False):
             except Exception as e:
                 print(f"插入題目 {question['question_number']} 失敗: {str(e)}")
         
+        if inserted_count:
+            invalidate_exam_facets_cache()
+        
         print(f"\n成功插入 {inserted_count} 筆測試學校資料！")
         print(f"涵蓋了 {len(used_answer_types)} 種不同題型")
         
@@ -438,6 +453,9 @@ def delete_test_school_data(auto_confirm=False):
             'year': '114'
         })
         
+        if result.deleted_count:
+            invalidate_exam_facets_cache()
+        
         print(f"成功刪除 {result.deleted_count} 筆測試學校資料！")
         return True
         